@@ -0,0 +1,115 @@
+# coding: utf-8
+"""
+time the question graph construction on a synthetic posts dump:
+
+1. the original `iterrows` loop building the question-user matrix
+2. `graph_helpers.question_user_matrix`
+
+and check both give the same questions and the same projected question graph
+"""
+
+import time
+import itertools
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+
+from collections import defaultdict
+from scipy import sparse as sp
+
+from graph_helpers import question_user_matrix, QUESTION
+
+
+tf.flags.DEFINE_integer('n_questions', 100000, 'number of questions in the synthetic dump (default: 100000)')
+tf.flags.DEFINE_integer('n_users', 20000, 'number of users in the synthetic dump (default: 20000)')
+tf.flags.DEFINE_float('answers_per_question', 2.0, 'average number of answers per question (default: 2.0)')
+
+FLAGS = tf.flags.FLAGS
+FLAGS._parse_flags()
+print("\nParameters:")
+for attr, value in sorted(FLAGS.__flags.items()):
+    print("{}={}".format(attr.upper(), value))
+print("")
+
+
+def synthetic_posts(n_questions, n_users, answers_per_question, seed=12345):
+    """questions and answers, some authored by anonymous users with only a display name"""
+    rng = np.random.RandomState(seed)
+    n_answers = int(n_questions * answers_per_question)
+    n_posts = n_questions + n_answers
+
+    post_type = np.r_[np.full(n_questions, QUESTION), np.full(n_answers, 2)]
+    parent_id = np.r_[np.full(n_questions, np.nan),
+                      rng.randint(1, n_questions + 1, n_answers)]
+    # skewed activity, a few users author many posts
+    user_id = np.floor(n_users * rng.rand(n_posts) ** 2).astype(np.float64) + 1
+    anonymous = rng.rand(n_posts) < 0.05
+    user_id[anonymous] = np.nan
+    user_name = np.where(anonymous & (rng.rand(n_posts) < 0.5),
+                         np.char.add('user', rng.randint(0, 100, n_posts).astype(str)),
+                         None)
+
+    df = pd.DataFrame({'Id': np.arange(1, n_posts + 1),
+                       'PostTypeId': post_type,
+                       'ParentId': parent_id,
+                       'OwnerUserId': user_id,
+                       'OwnerDisplayName': user_name})
+    return df.sample(frac=1, random_state=seed)
+
+
+def iterrows_question_user_matrix(df):
+    """the original implementation in build_question_graph.py"""
+    q2us = defaultdict(set)
+
+    for i, r in df.iterrows():
+        pid = None
+        if r['PostTypeId'] == QUESTION:
+            pid = int(r['Id'])
+        else:
+            parend_id = r['ParentId']
+            if parend_id > 0:
+                pid = int(parend_id)
+
+        if pid:
+            uname, uid = r['OwnerDisplayName'], r['OwnerUserId']
+            if not np.isnan(uid):
+                q2us[pid].add(int(uid))
+            elif isinstance(uname, str):
+                q2us[pid].add(uname)
+
+    id2q_map = dict(enumerate(q2us))
+    q2id_map = dict(zip(id2q_map.values(), id2q_map.keys()))
+
+    all_users = set(itertools.chain(*q2us.values()))
+    id2u_map = dict(enumerate(all_users))
+    u2id_map = dict(zip(id2u_map.values(), id2u_map.keys()))
+
+    n_entries = sum(map(len, q2us.values()))
+    data = np.ones(n_entries)
+    row_idx = []
+    col_idx = []
+    for q, us in q2us.items():
+        row_idx += [q2id_map[q]]*len(us)
+        col_idx += [u2id_map[u] for u in us]
+    m = sp.csr_matrix((data, (row_idx, col_idx)), shape=(len(q2id_map), len(u2id_map)))
+    return m, np.array(list(id2q_map.values()))
+
+
+def run(name, func, df):
+    start = time.time()
+    m, question_ids = func(df)
+    print('{}: {:.2f}s (#questions={}, #users={})'.format(
+        name, time.time() - start, m.shape[0], m.shape[1]))
+    return m, question_ids
+
+
+df = synthetic_posts(FLAGS.n_questions, FLAGS.n_users, FLAGS.answers_per_question)
+print('synthetic dump with {} posts'.format(df.shape[0]))
+
+m_old, question_ids_old = run('iterrows', iterrows_question_user_matrix, df)
+m_new, question_ids_new = run('vectorized', question_user_matrix, df)
+
+# user columns are numbered differently, compare the unipartite projections
+assert (question_ids_old == question_ids_new).all()
+assert (m_old * m_old.T != m_new * m_new.T).nnz == 0
+print('same questions and question graph')
@@ -0,0 +1,65 @@
+# coding: utf-8
+"""
+compare the walks/sec of the random walk samplers on a synthetic graph:
+
+1. `sample_random_walks.yield_n_random_walks`, one step of one walk at a time
+2. `graph_helpers.random_walks`, all walkers advance together
+"""
+
+import time
+import numpy as np
+import tensorflow as tf
+
+from scipy import sparse as sp
+
+from graph_helpers import walk_start_nodes, random_walks
+from sample_random_walks import yield_n_random_walks
+
+
+tf.flags.DEFINE_integer('num_vertices', 100000, 'number of nodes of the synthetic graph (default: 100000)')
+tf.flags.DEFINE_integer('avg_degree', 20, 'average degree of the synthetic graph (default: 20)')
+tf.flags.DEFINE_integer('n_walks', 200000, 'number of walks to sample (default: 200000)')
+tf.flags.DEFINE_integer('walk_length', 6, 'number of steps per walk (default: 6)')
+tf.flags.DEFINE_float('alpha', 0.05, 'restart probability (default: 0.05)')
+
+FLAGS = tf.flags.FLAGS
+FLAGS._parse_flags()
+print("\nParameters:")
+for attr, value in sorted(FLAGS.__flags.items()):
+    print("{}={}".format(attr.upper(), value))
+print("")
+
+
+def synthetic_graph(num_vertices, avg_degree, seed=12345):
+    """random undirected graph with self-loops, like the question graph"""
+    rng = np.random.RandomState(seed)
+    n_edges = num_vertices * avg_degree // 2
+    rows, cols = rng.randint(0, num_vertices, n_edges), rng.randint(0, num_vertices, n_edges)
+    adj = sp.csr_matrix((np.ones(n_edges), (rows, cols)), shape=(num_vertices, num_vertices))
+    adj = adj + adj.T + sp.identity(num_vertices)
+    adj.data[:] = 1
+    return adj.tocsr()
+
+
+adj = synthetic_graph(FLAGS.num_vertices, FLAGS.avg_degree)
+print('synthetic graph: {} nodes, {} edges'.format(adj.shape[0], adj.nnz))
+
+# the per-walk sampler is slow, time it on a fraction of the walks
+n_slow = max(FLAGS.n_walks // 20, 1)
+start = time.time()
+for _ in yield_n_random_walks(n_slow, adj, FLAGS.walk_length, FLAGS.alpha):
+    pass
+elapsed = time.time() - start
+print('per walk: {:.0f} walks/sec ({} walks in {:.2f}s)'.format(n_slow / elapsed, n_slow, elapsed))
+
+rng = np.random.RandomState(12345)
+start = time.time()
+walks = random_walks(adj, walk_start_nodes(FLAGS.n_walks, adj.shape[0], rng),
+                     FLAGS.walk_length, FLAGS.alpha, rng)
+elapsed = time.time() - start
+print('batched: {:.0f} walks/sec ({} walks in {:.2f}s)'.format(FLAGS.n_walks / elapsed, FLAGS.n_walks, elapsed))
+
+# every step either follows an edge or restarts
+steps = adj[walks[:, :-1].ravel(), walks[:, 1:].ravel()].A1
+restarts = walks[:, 1:] == walks[:, :1]
+assert (steps.reshape(restarts.shape).astype(bool) | restarts).all()
@@ -0,0 +1,70 @@
+# coding: utf-8
+"""
+compare the speed of converting label lists to the (indices, values, shape) feed of a SparseTensor:
+
+1. the original list comprehension
+2. `eval_helpers.label_lists_to_sparse_tuple`, vectorized on the list lengths
+
+for a training batch and for the whole dev set (which the experiments convert once per run)
+"""
+
+import time
+import itertools
+import numpy as np
+import tensorflow as tf
+
+from dataset_helpers import load_split
+from eval_helpers import label_lists_to_sparse_tuple
+
+
+tf.flags.DEFINE_string('data_dir', '', 'directory of dataset, the dev labels are used if given')
+tf.flags.DEFINE_integer('n_docs', 50000, 'number of synthetic documents without data_dir (default: 50000)')
+tf.flags.DEFINE_integer('n_classes', 10000, 'number of synthetic classes without data_dir (default: 10000)')
+tf.flags.DEFINE_integer('batch_size', 64, 'batch size (default: 64)')
+tf.flags.DEFINE_integer('n_repeats', 20, 'number of repetitions of each measure (default: 20)')
+
+FLAGS = tf.flags.FLAGS
+FLAGS._parse_flags()
+print("\nParameters:")
+for attr, value in sorted(FLAGS.__flags.items()):
+    print("{}={}".format(attr.upper(), value))
+print("")
+
+
+def list_label_lists_to_sparse_tuple(label_lists, n_classes):
+    """the original implementation"""
+    indices = [[i, j]
+               for i, row in enumerate(label_lists)
+               for j in range(len(row))]
+    values = list(itertools.chain(*label_lists))
+    shape = (len(label_lists), n_classes)
+    return (indices, values, shape)
+
+
+if FLAGS.data_dir:
+    label_lists = load_split(FLAGS.data_dir, 'labels_id', 'dev').tolist()
+    n_classes = max(itertools.chain(*label_lists)) + 1
+else:
+    # 1 to 5 tags per document, like stackexchange posts
+    rng = np.random.RandomState(12345)
+    n_classes = FLAGS.n_classes
+    label_lists = [rng.choice(n_classes, rng.randint(1, 6), replace=False).tolist()
+                   for _ in range(FLAGS.n_docs)]
+print('{} documents, {} labels'.format(len(label_lists), sum(map(len, label_lists))))
+
+
+def measure(convert, label_lists):
+    """seconds per conversion, including the conversion to arrays done by session.run"""
+    start = time.time()
+    for _ in range(FLAGS.n_repeats):
+        indices, values, shape = convert(label_lists, n_classes)
+        np.asarray(indices, dtype=np.int64), np.asarray(values, dtype=np.int32)
+    return (time.time() - start) / FLAGS.n_repeats
+
+
+for name, data in [('batch of {}'.format(FLAGS.batch_size), label_lists[:FLAGS.batch_size]),
+                   ('all {} documents'.format(len(label_lists)), label_lists)]:
+    old = measure(list_label_lists_to_sparse_tuple, data)
+    new = measure(label_lists_to_sparse_tuple, data)
+    print('{}: lists {:.3f}ms, vectorized {:.3f}ms ({:.1f}x)'.format(
+        name, old * 1000, new * 1000, old / new))
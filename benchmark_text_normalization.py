@@ -0,0 +1,63 @@
+# coding: utf-8
+"""
+compare the throughput (posts/sec) of the text normalization:
+
+1. the original path: clean_str(strip_tags(x)), one post at a time
+2. `normalize_text`: reused parser + single pass cleaning
+3. `normalize_texts` with a process pool
+"""
+
+import time
+import random
+import pandas as pd
+import tensorflow as tf
+
+from data_helpers import clean_str, strip_tags, normalize_text, normalize_texts
+
+
+tf.flags.DEFINE_string('data_dir', '', 'directory of dataset, synthetic posts are used if empty')
+tf.flags.DEFINE_integer('n_posts', 100000, 'number of posts to normalize (default: 100000)')
+tf.flags.DEFINE_integer('n_jobs', 0, 'number of processes for the pool, <= 0 uses all cores (default: 0)')
+
+FLAGS = tf.flags.FLAGS
+FLAGS._parse_flags()
+print("\nParameters:")
+for attr, value in sorted(FLAGS.__flags.items()):
+    print("{}={}".format(attr.upper(), value))
+print("")
+
+
+def synthetic_posts(n, seed=12345):
+    rng = random.Random(seed)
+    words = ["can't", "it's", "(matrix)", "numpy,", "why?", "great!", "we'll", "you're",
+             "&amp;", "&lt;tag&gt;", "regression", "gradient", "x_1", "été"]
+    posts = []
+    for _ in range(n):
+        text = ' '.join(rng.choice(words) for _ in range(rng.randint(20, 300)))
+        posts.append('<p>{}</p><pre><code>print(x)</code></pre>'.format(text))
+    return posts
+
+
+if FLAGS.data_dir:
+    posts = pd.read_csv('{}/posts.csv'.format(FLAGS.data_dir), sep=',',
+                        nrows=FLAGS.n_posts)['Body'].dropna().tolist()
+else:
+    posts = synthetic_posts(FLAGS.n_posts)
+
+
+def run(name, func):
+    start = time.time()
+    output = func()
+    elapsed = time.time() - start
+    print('{}: {:.0f} posts/sec ({:.2f}s)'.format(name, len(posts) / elapsed, elapsed))
+    return output
+
+
+expected = run('clean_str(strip_tags(x))', lambda: [clean_str(strip_tags(p)) for p in posts])
+single = run('normalize_text', lambda: [normalize_text(p) for p in posts])
+pooled = run('normalize_texts (n_jobs={})'.format(FLAGS.n_jobs),
+             lambda: list(normalize_texts(posts, n_jobs=FLAGS.n_jobs)))
+
+assert single == expected
+assert pooled == expected
+print('outputs are identical')
@@ -0,0 +1,121 @@
+# coding: utf-8
+"""
+compare the tf-idf featurization of a large synthetic corpus (train/dev/test):
+
+1. TfidfVectorizer: fit on train and transform the splits in memory, in this process
+2. ChunkedTfidfVectorizer: chunked fit and transforms over `n_jobs` processes,
+   the chunks are written to the dataset format as they are computed
+
+reported for each:
+
+- wall-clock time and peak resident memory, each version runs in a fresh process
+  so they start from the same memory, the chunked version also reports the peak
+  of its largest worker (RUSAGE_CHILDREN), its total is at most that process + n_jobs x the worker
+- the peak memory traced by tracemalloc, the chunked version runs with n_jobs=1 for it
+  so that all of its allocations are made in this process (tracing slows it down)
+"""
+
+import time
+import shutil
+import resource
+import tempfile
+import tracemalloc
+import multiprocessing
+import numpy as np
+import tensorflow as tf
+
+from scipy.sparse import vstack
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from dataset_helpers import CSRFieldWriter, load_splits
+from tfidf_helpers import ChunkedTfidfVectorizer
+
+
+tf.flags.DEFINE_integer('n_docs', 200000, 'number of synthetic documents (default: 200000)')
+tf.flags.DEFINE_integer('vocab_size', 100000, 'number of distinct words (default: 100000)')
+tf.flags.DEFINE_integer('n_jobs', 0, 'number of processes of the chunked version, <= 0 uses all cores (default: 0)')
+tf.flags.DEFINE_integer('chunk_size', 10000, 'number of documents per chunk (default: 10000)')
+
+FLAGS = tf.flags.FLAGS
+FLAGS._parse_flags()
+print("\nParameters:")
+for attr, value in sorted(FLAGS.__flags.items()):
+    print("{}={}".format(attr.upper(), value))
+print("")
+
+
+def synthetic_corpus(n_docs, vocab_size, seed=12345):
+    """documents of 20 to 300 words drawn from a zipf distribution, like posts"""
+    rng = np.random.RandomState(seed)
+    words = np.array(['w{}'.format(i) for i in range(vocab_size)])
+    lengths = rng.randint(20, 300, size=n_docs)
+    ids = (rng.zipf(1.2, size=lengths.sum()) - 1) % vocab_size
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    return [' '.join(words[ids[offsets[i]:offsets[i + 1]]]) for i in range(n_docs)]
+
+
+texts = synthetic_corpus(FLAGS.n_docs, FLAGS.vocab_size)
+n_train, n_dev = int(len(texts) * 0.8), int(len(texts) * 0.1)
+splits = [texts[:n_train], texts[n_train:n_train + n_dev], texts[n_train + n_dev:]]
+print('{} documents, {} words'.format(len(texts), sum(len(text.split()) for text in texts)))
+
+
+def in_memory():
+    vectorizer = TfidfVectorizer()
+    return [vectorizer.fit_transform(splits[0])] + [vectorizer.transform(split) for split in splits[1:]]
+
+
+def chunked_to_dataset(data_dir, n_jobs):
+    vectorizer = ChunkedTfidfVectorizer(n_jobs=n_jobs, chunk_size=FLAGS.chunk_size).fit(splits[0])
+    writer = CSRFieldWriter(data_dir, 'tfidf', len(vectorizer.vocabulary_))
+    for split in splits:
+        for X in vectorizer.transform_chunks(split):
+            writer.write(X)
+    writer.close(list(map(len, splits)))
+
+
+def _timed(conn, func, args):
+    start = time.time()
+    func(*args)
+    elapsed = time.time() - start
+    conn.send((elapsed,
+               resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 2 ** 10))
+    conn.close()
+
+
+def run_in_process(name, func, *args):
+    """wall-clock and peak resident memory of func(*args) run in a new (forked) process"""
+    parent_conn, child_conn = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_timed, args=(child_conn, func, args))
+    process.start()
+    elapsed, self_rss, children_rss = parent_conn.recv()
+    process.join()
+    print('{}: {:.2f}s, {:.0f} docs/sec, peak resident memory {:.1f} MB, of its largest worker {:.1f} MB'.format(
+        name, elapsed, len(texts) / elapsed, self_rss, children_rss))
+
+
+def run_traced(name, func, *args):
+    """peak memory traced by tracemalloc during func(*args), in this process"""
+    tracemalloc.start()
+    output = func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('{}: peak traced memory {:.1f} MB'.format(name, peak / 2 ** 20))
+    return output
+
+
+data_dir, traced_dir = tempfile.mkdtemp(), tempfile.mkdtemp()
+try:
+    run_in_process('TfidfVectorizer', in_memory)
+    run_in_process('ChunkedTfidfVectorizer (n_jobs={})'.format(FLAGS.n_jobs),
+                   chunked_to_dataset, data_dir, FLAGS.n_jobs)
+
+    expected = run_traced('TfidfVectorizer', in_memory)
+    run_traced('ChunkedTfidfVectorizer (n_jobs=1)', chunked_to_dataset, traced_dir, 1)
+
+    output = vstack(load_splits(data_dir, 'tfidf'))
+    print('max absolute difference: {:g}'.format(abs(output - vstack(expected)).max()))
+finally:
+    shutil.rmtree(data_dir)
+    shutil.rmtree(traced_dir)
@@ -3,8 +3,9 @@ from eval_helpers import tf_precision_at_k
 
 
 class Combined():
-    def __init__(self, cnn_model, dw_model):
+    def __init__(self, cnn_model, dw_model, top_k=10):
         self.cnn, self.dw = cnn_model, dw_model
+        self.top_k = min(top_k, self.cnn.num_classes)
         print('cnn:', type(self.cnn))
         print('dw:', type(self.dw))
 
@@ -39,6 +40,11 @@ class Combined():
             self.scores = tf.nn.xw_plus_b(input_tensor, W, b, name="scores")
             self.predictions = tf.argmax(self.scores, 1, name="predictions")
 
+            # the best labels only, so callers do not need to fetch all the scores
+            top_k_values, top_k_indices = tf.nn.top_k(self.scores, k=self.top_k, sorted=True)
+            self.top_k_values = tf.identity(top_k_values, name="top_k_values")
+            self.top_k_indices = tf.identity(top_k_indices, name="top_k_indices")
+
     def add_losses(self):
         # CalculateMean cross-entropy loss
         with tf.name_scope("loss"):
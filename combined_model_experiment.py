@@ -1,22 +1,24 @@
 # coding: utf-8
 
 import os
+import time
 import pickle as pkl
 import numpy as np
 import tensorflow as tf
 import datetime
 import pandas as pd
-import itertools
 
 from sklearn.cross_validation import train_test_split
-from tensorflow.contrib import learn
 
 from kim_cnn import KimCNN
+from vocab_helpers import load_token_ids
 from word2vec import Word2Vec
 from combined import Combined
 from eval_helpers import label_lists_to_sparse_tuple
-from data_helpers import batch_iter, RWBatchGenerator, label_ids_to_binary_matrix, load_pickle
-from tf_helpers import get_variable_value_from_checkpoint
+from data_helpers import dict_batch_iter, bucket_batch_iter, RWBatchGenerator, \
+    label_ids_to_binary_matrix, count_walk_nodes, Prefetcher
+from dataset_helpers import load_split, load_splits
+from tf_helpers import get_variable_value_from_checkpoint, ChunkedEvaluator
                 
 from tensorflow.python import debug as tf_debug
 from tf_helpers import save_embedding_for_viz
@@ -29,10 +31,18 @@ tf.flags.DEFINE_string('data_dir', 'data/stackexchange/datascience/', 'directory
 tf.flags.DEFINE_integer('tag_freq_threshold', 5, 'minimum frequency of a tag')
 
 tf.flags.DEFINE_float("max_document_length", 2000, "Maximum length of document, exceeding part is truncated")
+tf.flags.DEFINE_integer("min_word_frequency", 0,
+                        "Words occurring less often in the training text are out of vocabulary (default: 0)")
+tf.flags.DEFINE_integer("max_vocab_size", 0, "Maximum number of words in the vocabulary, 0 keeps all (default: 0)")
+tf.flags.DEFINE_integer("n_jobs", 1, "Number of processes mapping the texts to word ids, <= 0 uses all cores (default: 1)")
+tf.flags.DEFINE_boolean("token_cache", True,
+                        "Cache the word ids of the splits under data_dir/token_cache, "
+                        "keyed by the text split and the vocabulary parameters (default: True)")
 
 # Architecutural parameters for KimCNN
 
 tf.flags.DEFINE_string("loss_function", 'sigmoid', "loss function: (softmax|sigmoid) (Default: sigmoid)")
+tf.flags.DEFINE_integer("top_k", 10, "Number of best labels output by the output/top_k_* ops (default: 10)")
 
 # Model Hyperparameters
 tf.flags.DEFINE_integer("embedding_dim", 128, "Dimensionality of character embedding (default: 128)")
@@ -43,6 +53,11 @@ tf.flags.DEFINE_float("l2_reg_lambda", 0.0, "L2 regularization lambda (default:
 
 # Training parameters
 tf.flags.DEFINE_integer("batch_size", 64, "Batch Size (default: 64)")
+tf.flags.DEFINE_boolean("bucket_batches", False,
+                        "Batch documents of similar lengths and pad them to the longest one of the batch "
+                        "instead of max_document_length (default: False)")
+tf.flags.DEFINE_integer("bucket_pool_batches", 100,
+                        "Number of batches sorted by length together when bucket_batches is on (default: 100)")
 
 
 tf.flags.DEFINE_integer("dw_batch_size", 128, "Batch Size for deep walk model (default: 128)")
@@ -50,13 +65,24 @@ tf.flags.DEFINE_integer("dw_skip_window", 3, "How many words to consider left an
 tf.flags.DEFINE_integer("dw_num_skips", 4, "How many times to reuse an input to generate a label. (default: 4)")
 tf.flags.DEFINE_integer("dw_embedding_size", 128, "Dimensionality of node embedding. (default: 128)")
 tf.flags.DEFINE_integer("dw_num_negative_samples", 64, "Number of negative examples to sample. (default: 64)")
+tf.flags.DEFINE_string("walks_file", "random_walks.npy",
+                       "random walks under data_dir: .npy array, text file "
+                       "or .json manifest of text shards (default: random_walks.npy)")
+tf.flags.DEFINE_boolean("shuffle_walks", False, "shuffle the random walks (default: False)")
 
 
 # global training parameter
 tf.flags.DEFINE_integer("num_epochs", 200, "Number of training epochs (default: 200)")
 tf.flags.DEFINE_integer("evaluate_every", 100, "Evaluate model on dev set after this many steps (default: 100)")
+tf.flags.DEFINE_integer("dev_batch_size", 0,
+                        "Batch size of the dev set evaluation, 0 evaluates it at once (default: 0)")
+tf.flags.DEFINE_boolean("background_eval", False,
+                        "Evaluate a copy of the weights in a background thread while training goes on "
+                        "(default: False)")
 tf.flags.DEFINE_integer("checkpoint_every", 100, "Save model after this many steps (default: 100)")
 tf.flags.DEFINE_integer("num_checkpoints", 1, "Number of checkpoints to store (default: 1)")  # disk quota is low
+tf.flags.DEFINE_integer("prefetch_batches", 0,
+                        "Number of batches prepared ahead in a background thread, 0 disables it (default: 0)")
 
 tf.flags.DEFINE_string("pretrained_embedding_checkpoint_dir", "",
                        "directory of checkpoint where pretrained embedding lives")
@@ -90,31 +116,39 @@ data_dir = FLAGS.data_dir
 
 # load data
 # ===============================================
-train_text, dev_text, _ = load_pickle(
-    os.path.join(data_dir, "text_split.pkl"))
-y_id_train, y_id_dev, _ = load_pickle(
-    os.path.join(data_dir, "labels_id_split.pkl"))
-y_binary_train, y_binary_dev, _ = load_pickle(
-    os.path.join(data_dir, "labels_binary_split.pkl"))
-node_ids_train, node_ids_dev, _ = load_pickle(
-    os.path.join(data_dir, "node_ids_split.pkl"))
+y_id_train, y_id_dev = load_splits(data_dir, 'labels_id', ['train', 'dev'])
+# only used for the number of classes, the labels are fed as id lists
+y_binary_train = load_split(data_dir, 'labels_binary', 'train')
+node_ids_train, node_ids_dev = load_splits(data_dir, 'node_ids', ['train', 'dev'])
 
 # preprocessing text documents
 # ===============================================
-vocab_processor = learn.preprocessing.VocabularyProcessor(FLAGS.max_document_length)
-x_train = np.array(list(vocab_processor.fit_transform(train_text)))
-x_dev = np.array(list(vocab_processor.transform(dev_text)))
+vocab, x_split, lengths_split = load_token_ids(
+    data_dir, FLAGS.max_document_length, FLAGS.min_word_frequency, FLAGS.max_vocab_size or None,
+    n_jobs=FLAGS.n_jobs, use_cache=FLAGS.token_cache)
+x_train, x_dev = x_split['train'], x_split['dev']
+train_lengths, dev_lengths = lengths_split['train'], lengths_split['dev']
+print("vocabulary size: {:d}".format(len(vocab)))
 
 print("Train/Dev split: {:d}/{:d}".format(len(x_train), len(x_dev)))
 
+filter_sizes = list(map(int, FLAGS.filter_sizes.split(",")))
+if FLAGS.bucket_batches:
+    # the documents are at least as long as the largest filter
+    min_length = max(filter_sizes)
+    # the dev set is fed at once, so it is padded to its longest document
+    x_dev = x_dev[:, :max(dev_lengths.max(), min_length)]
+    print("mean document length: {:.1f}".format(train_lengths.mean()))
+
 num_classes = y_binary_train.shape[1]
 print("num of classes: {:d}".format(num_classes))
 
 
 # load node embedding data
-walks = RWBatchGenerator.read_walks("{}/random_walks.txt".format(data_dir))
+walks = RWBatchGenerator.read_walks(os.path.join(data_dir, FLAGS.walks_file),
+                                   shuffle=FLAGS.shuffle_walks)
 
-vocabulary_size = len(set(itertools.chain(*walks)))
+vocabulary_size = count_walk_nodes(walks)
 
 dw_data_generator = RWBatchGenerator(
     walks, FLAGS.dw_batch_size, FLAGS.dw_num_skips, FLAGS.dw_skip_window)
@@ -135,11 +169,11 @@ with tf.Graph().as_default():
     with sess.as_default():
         with tf.name_scope('kim_cnn'):
             cnn = KimCNN(
-                sequence_length=x_train.shape[1],
+                sequence_length=None if FLAGS.bucket_batches else x_train.shape[1],
                 num_classes=num_classes,
-                vocab_size=len(vocab_processor.vocabulary_),
+                vocab_size=len(vocab),
                 embedding_size=FLAGS.embedding_dim,
-                filter_sizes=list(map(int, FLAGS.filter_sizes.split(","))),
+                filter_sizes=filter_sizes,
                 num_filters=FLAGS.num_filters,
                 l2_reg_lambda=FLAGS.l2_reg_lambda,
                 loss_function=FLAGS.loss_function,
@@ -166,7 +200,7 @@ with tf.Graph().as_default():
                           nce_b_value=nce_b_value)
         
         with tf.name_scope('combined'):
-            model = Combined(cnn, dw)
+            model = Combined(cnn, dw, top_k=FLAGS.top_k)
 
         global_step = tf.Variable(0, name="global_step", trainable=False)
         
@@ -202,9 +236,7 @@ with tf.Graph().as_default():
         train_summary_dir = os.path.join(out_dir, "summaries", "train")
         train_summary_writer = tf.summary.FileWriter(train_summary_dir, sess.graph)
 
-        # Dev summaries
-        dev_summary_op = tf.summary.merge([label_loss_summary, graph_loss_summary,
-                                           p1, p3, p5])
+        # Dev summaries, written by the evaluator
         dev_summary_dir = os.path.join(out_dir, "summaries", "dev")
         dev_summary_writer = tf.summary.FileWriter(dev_summary_dir, sess.graph)
 
@@ -216,23 +248,37 @@ with tf.Graph().as_default():
         saver = tf.train.Saver(tf.global_variables(), max_to_keep=FLAGS.num_checkpoints)
 
         # Write vocabulary
-        vocab_processor.save(os.path.join(data_dir, "vocab"))
-        
+        vocab.save(os.path.join(data_dir, "vocab.json"))
+
+        # the dev feed dicts (and their sparse labels) are built once, not at every evaluation
+        dev_feed_dicts = [
+            ({model.cnn.input_x: batch['x'],
+              model.cnn.input_y_labels: label_lists_to_sparse_tuple(batch['y_id'], num_classes),
+              model.node_ids: batch['node_ids'],
+              model.cnn.dropout_keep_prob: 1.0,
+              # in vain
+              model.dw.train_inputs: [0],
+              model.dw.train_labels: [[0]]},
+             len(batch['x']))
+            for batch in dict_batch_iter({'x': x_dev, 'y_id': y_id_dev, 'node_ids': node_ids_dev},
+                                         FLAGS.dev_batch_size or len(x_dev), 1, shuffle=False)]
+        # the graph loss is left out, its inputs are dummies
+        dev_evaluator = ChunkedEvaluator(
+            sess, [('label_loss', model.label_loss), ('p1', model.p1), ('p3', model.p3), ('p5', model.p5)],
+            lambda: dev_feed_dicts, writer=dev_summary_writer,
+            background=FLAGS.background_eval, session_config=session_conf)
+
         sess.run(tf.global_variables_initializer())
 
         #### DEBUG
         sess.graph.finalize()
         
-        def train_label_step(x_batch, y_batch_binary, y_batch_labels, node_ids, writer):
-            """
-            one training step for the label part
-            """
-            feed_dict = {
-              model.cnn.input_x: x_batch,
-              model.cnn.input_y_binary: y_batch_binary,
+        def label_feed_dict(batch):
+            return {
+              model.cnn.input_x: batch['x'],
               model.cnn.input_y_labels: label_lists_to_sparse_tuple(
-                  y_batch_labels, num_classes),  # needs some conversion
-              model.node_ids: node_ids,  # node ids
+                  batch['y_id'], num_classes),  # needs some conversion
+              model.node_ids: batch['node_ids'],  # node ids
               model.cnn.dropout_keep_prob: FLAGS.dropout_keep_prob,
                 
               # the following is in vain
@@ -241,6 +287,36 @@ with tf.Graph().as_default():
               model.dw.train_inputs: [0],
               model.dw.train_labels: [[0]],
             }
+
+        # the dummy label part fed to the graph steps, it is the same for all of them
+        dummy_label_feed_dict = {
+          model.cnn.input_x: vocab.transform(["asdfkjahdkfhakslfh"]),  # non-sense stuff
+          model.cnn.input_y_labels: label_lists_to_sparse_tuple(
+              [[0]], num_classes),  # needs some conversion
+          model.node_ids: [0],  # node ids
+          model.cnn.dropout_keep_prob: FLAGS.dropout_keep_prob,
+        }
+
+        def graph_feed_dict(x_batch, batch_labels):
+            feed_dict = {
+              model.dw.train_inputs: x_batch,
+              model.dw.train_labels: np.expand_dims(np.array(batch_labels), -1),
+            }
+            # the following is in vain
+            # tf requires all placeholder to be provided some value
+            feed_dict.update(dummy_label_feed_dict)
+            return feed_dict
+
+        def feed_dicts(batches):
+            """the feed dicts of the label step and the graph step for each batch"""
+            for batch in batches:
+                yield (label_feed_dict(batch),
+                       graph_feed_dict(*dw_data_generator.next_batch()))
+
+        def train_label_step(feed_dict, writer):
+            """
+            one training step for the label part
+            """
             _, step, summaries, label_loss, p1, p3, p5 = sess.run(
                 [label_train_op, global_step, train_summary_op, model.label_loss,
                  model.p1, model.p3, model.p5],
@@ -250,24 +326,10 @@ with tf.Graph().as_default():
                 time_str, step, label_loss, p1, p3, p5))
             train_summary_writer.add_summary(summaries, step)
 
-        def train_graph_step(x_batch, batch_labels, writer):
+        def train_graph_step(feed_dict, writer):
             """
             one training step for the graph part
             """
-            feed_dict = {
-              model.dw.train_inputs: x_batch,
-              model.dw.train_labels: np.expand_dims(np.array(batch_labels), -1),
-                
-              # the following is in vain
-              # tf requires all placeholder to be provided some value
-              model.cnn.input_x: list(vocab_processor.transform(["asdfkjahdkfhakslfh"])),  # non-sense stuff
-              model.cnn.input_y_binary: [[0] * num_classes],  # with no label
-              model.cnn.input_y_labels: label_lists_to_sparse_tuple(
-                  [[0]], num_classes),  # needs some conversion
-              model.node_ids: [0],  # node ids
-              model.cnn.dropout_keep_prob: FLAGS.dropout_keep_prob,
-                
-            }
             _, step, summaries, graph_loss = sess.run(
                 [graph_train_op, global_step, train_summary_op, model.graph_loss],
                 feed_dict)
@@ -276,50 +338,41 @@ with tf.Graph().as_default():
                 time_str, step, graph_loss))
             writer.add_summary(summaries, step)
             
-        def dev_step(x_batch, y_batch_binary, y_batch_labels, node_ids, writer):
-            """
-            Evaluates model on a dev set
-            """
-            feed_dict = {
-              model.cnn.input_x: x_batch,
-              model.cnn.input_y_binary: y_batch_binary,
-              model.cnn.input_y_labels: label_lists_to_sparse_tuple(
-                  y_batch_labels, num_classes),  # needs some conversion
-              model.node_ids: node_ids,  # node ids
-              model.cnn.dropout_keep_prob: 1.0,
-                
-              # in vain
-              model.dw.train_inputs: [0],
-              model.dw.train_labels: [[0]],
-            }
-            step, summaries, label_loss, p1, p3, p5 = sess.run(
-                [global_step, dev_summary_op, model.label_loss, model.p1, model.p3, model.p5],
-                feed_dict)
-            time_str = datetime.datetime.now().isoformat()
-            print("{}: step {}, label loss {:g}, p1 {:g}, p3 {:g}, p5 {:g}".format(
-                time_str, step, label_loss, p1, p3, p5))
-            
-            writer.add_summary(summaries, step)
+        # the label indicator matrix is built from the label ids in the graph
+        train_data = {'x': x_train, 'y_id': y_id_train, 'node_ids': node_ids_train}
+        if FLAGS.bucket_batches:
+            batches = bucket_batch_iter(
+                train_data, train_lengths, FLAGS.batch_size, FLAGS.num_epochs,
+                min_length=min_length, pool_batches=FLAGS.bucket_pool_batches)
+        else:
+            batches = dict_batch_iter(train_data, FLAGS.batch_size, FLAGS.num_epochs)
 
-        batches = batch_iter(
-            list(zip(x_train, y_binary_train, y_id_train, node_ids_train)),
-            FLAGS.batch_size, FLAGS.num_epochs)
+        # feed dicts are optionally prepared ahead in a background thread
+        train_feed_dicts = Prefetcher(feed_dicts(batches), FLAGS.prefetch_batches)
 
-        for batch in batches:
+        num_examples, start_time = 0, time.time()
+        for label_feed, graph_feed in train_feed_dicts:
             # train label part
-            x_batch, y_batch_binary, y_train_labels, x_node_ids = zip(*batch)
-            train_label_step(x_batch, y_batch_binary, y_train_labels, x_node_ids, train_summary_writer)
+            train_label_step(label_feed, train_summary_writer)
+            num_examples += len(label_feed[model.cnn.input_x])
             current_step = tf.train.global_step(sess, global_step)  # one step for label training
             
             # train graph part
-            batch_inputs, batch_labels = dw_data_generator.next_batch()
-            train_graph_step(batch_inputs, batch_labels, train_summary_writer)
+            train_graph_step(graph_feed, train_summary_writer)
             
             if current_step % FLAGS.evaluate_every == 0:
+                print("\n{:.1f} examples/sec, input wait: {:.3f}s over the last {} steps".format(
+                    num_examples / (time.time() - start_time),
+                    train_feed_dicts.pop_wait_time(), FLAGS.evaluate_every))
                 print("\nEvaluation:")
-                dev_step(x_dev, y_binary_dev, y_id_dev, node_ids_dev, dev_summary_writer)
+                dev_evaluator.evaluate(current_step)
                 print("")
+                num_examples, start_time = 0, time.time()
                 
             if current_step % FLAGS.checkpoint_every == 0:
                 path = saver.save(sess, checkpoint_prefix, global_step=current_step)
                 print("Saved model checkpoint to {}\n".format(path))        
+
+
+        # the last background evaluation
+        dev_evaluator.join()
@@ -0,0 +1,37 @@
+# coding: utf-8
+"""
+convert the `<field>_split.pkl` pickles written by an older process_train_dev_test.py
+into the memory-mappable dataset format of dataset_helpers.py (data_dir/manifest.json)
+"""
+
+import os
+import tensorflow as tf
+
+from data_helpers import load_pickle
+from dataset_helpers import FIELDS, pickle_path, write_field
+
+
+tf.flags.DEFINE_string('data_dir', 'data/stackexchange/datascience/', 'directory of dataset')
+tf.flags.DEFINE_string('fields', ','.join(FIELDS),
+                       'comma-separated fields to convert, missing pickles are skipped '
+                       '(default: {})'.format(','.join(FIELDS)))
+tf.flags.DEFINE_boolean('remove_pickles', False, 'remove the pickles once converted (default: False)')
+
+FLAGS = tf.flags.FLAGS
+FLAGS._parse_flags()
+print("\nParameters:")
+for attr, value in sorted(FLAGS.__flags.items()):
+    print("{}={}".format(attr.upper(), value))
+print("")
+
+for field in FLAGS.fields.split(','):
+    path = pickle_path(FLAGS.data_dir, field)
+    if not os.path.exists(path):
+        print('{} not found, skipped'.format(path))
+        continue
+    print('converting', path)
+    write_field(FLAGS.data_dir, field, load_pickle(path))
+    if FLAGS.remove_pickles:
+        os.remove(path)
+
+print('written to ', FLAGS.data_dir)
@@ -0,0 +1,26 @@
+# coding: utf-8
+"""
+convert random walks in text format (random_walks.txt or a random_walks.json manifest)
+into the int32 array random_walks.npy
+"""
+
+import os
+import tensorflow as tf
+
+from data_helpers import convert_walks_to_npy
+
+
+tf.flags.DEFINE_string('data_dir', 'data/stackexchange/datascience/', 'directory of dataset')
+tf.flags.DEFINE_string('input_file', 'random_walks.txt', 'text walks under data_dir (default: random_walks.txt)')
+tf.flags.DEFINE_string('output_file', 'random_walks.npy', 'output under data_dir (default: random_walks.npy)')
+
+FLAGS = tf.flags.FLAGS
+FLAGS._parse_flags()
+print("\nParameters:")
+for attr, value in sorted(FLAGS.__flags.items()):
+    print("{}={}".format(attr.upper(), value))
+print("")
+
+output_path = os.path.join(FLAGS.data_dir, FLAGS.output_file)
+convert_walks_to_npy(os.path.join(FLAGS.data_dir, FLAGS.input_file), output_path)
+print('written to ', output_path)
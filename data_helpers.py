@@ -1,11 +1,17 @@
 import re
+import os
+import json
 import pickle as pkl
-import itertools
 import collections
+import itertools
 import numpy as np
 import random
+import time
+import queue
+import threading
 from html.parser import HTMLParser
-from scipy.sparse import csr_matrix
+from multiprocessing import Pool, cpu_count
+from scipy.sparse import csr_matrix, issparse
 
 
 def clean_str(string):
@@ -29,6 +35,34 @@ def clean_str(string):
     return string.strip().lower()
 
 
+_NON_ASCII_REGEXP = re.compile(r"[^\x00-\x7f]+")
+
+# ascii characters outside of [A-Za-z0-9(),!?\'\`] become a space,
+# a one-to-one ascii table keeps `str.translate` on its fast path
+_CLEAN_TABLE = {i: chr(i) if re.match(r"[A-Za-z0-9(),!?\'\`]", chr(i)) else ' '
+                for i in range(128)}
+
+# the remaining substitutions of `clean_str` only involve fixed strings
+_CLEAN_REPLACEMENTS = [
+    ("\'s", " \'s"), ("\'ve", " \'ve"), ("n\'t", " n\'t"), ("\'re", " \'re"),
+    ("\'d", " \'d"), ("\'ll", " \'ll"), (",", " , "), ("!", " ! "),
+    ("(", " \\( "), (")", " \\) "), ("?", " \\? ")
+]
+
+
+def fast_clean_str(string):
+    """
+    faster version of `clean_str`, the output is identical
+
+    the character filtering is done by `str.translate`,
+    the literal substitutions by `str.replace` and the space squeezing by `str.split`
+    """
+    string = _NON_ASCII_REGEXP.sub(" ", string).translate(_CLEAN_TABLE)
+    for old, new in _CLEAN_REPLACEMENTS:
+        string = string.replace(old, new)
+    return ' '.join(string.split()).lower()
+
+
 class MLStripper(HTMLParser):
     def __init__(self):
         self.reset()
@@ -49,6 +83,90 @@ def strip_tags(html):
     return s.get_data()
 
 
+_stripper = None  # one parser per process, see `normalize_text`
+
+
+def normalize_text(html):
+    """
+    equivalent to clean_str(strip_tags(html)),
+    but reuses the html parser and cleans the text in a single pass
+    """
+    global _stripper
+    if _stripper is None:
+        _stripper = MLStripper()
+    _stripper.reset()
+    _stripper.fed = []
+    _stripper.feed(html)
+    return fast_clean_str(_stripper.get_data())
+
+
+def normalize_texts(texts, n_jobs=1, chunksize=256):
+    """
+    normalize an iterable of raw html posts using `n_jobs` processes
+
+    Args:
+
+    texts: iterable of str
+    n_jobs: int, number of processes, <= 0 means all cores
+    chunksize: int, number of posts sent to a worker at a time
+
+    Returns:
+
+    generator of normalized str, in the same order as `texts`
+    """
+    if n_jobs == 1:
+        for text in texts:
+            yield normalize_text(text)
+    else:
+        pool = Pool(n_jobs if n_jobs > 0 else None)
+        try:
+            for text in pool.imap(normalize_text, texts, chunksize):
+                yield text
+        finally:
+            pool.terminate()
+
+
+def chunked(iterable, chunk_size):
+    """the items of `iterable` in lists of `chunk_size` (the last one can be shorter)"""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def parallel_imap(func, items, n_jobs, initializer=None, initargs=()):
+    """
+    func applied to each of `items` in order, over `n_jobs` processes (<= 0 means all cores),
+    `initializer(*initargs)` is called once in each process (in this process if n_jobs is 1)
+
+    unlike Pool.imap, which queues all the items and buffers all the results,
+    at most 2 items per process are sent or waiting to be yielded at a time,
+    so the memory used is bounded when the items or results are large (e.g. chunks of documents)
+    """
+    if n_jobs == 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for item in items:
+            yield func(item)
+    else:
+        n_jobs = n_jobs if n_jobs > 0 else cpu_count()
+        pool = Pool(n_jobs, initializer, initargs)
+        try:
+            pending = collections.deque()
+            for item in items:
+                if len(pending) == 2 * n_jobs:
+                    yield pending.popleft().get()
+                pending.append(pool.apply_async(func, (item, )))
+            while pending:
+                yield pending.popleft().get()
+        finally:
+            pool.terminate()
+
+
 def batch_iter(data, batch_size, num_epochs, shuffle=True):
     """
     Generates a batch iterator for a dataset.
@@ -69,6 +187,243 @@ def batch_iter(data, batch_size, num_epochs, shuffle=True):
             yield shuffled_data[start_index: end_index]
             
 
+class RaggedArray():
+    """
+    rows of different lengths (e.g. label lists) stored as the concatenated `values`
+    and the `offsets` of the rows (number of rows + 1), row i is values[offsets[i]:offsets[i + 1]]
+
+    `values` can be memory-mapped, rows and slices are views of it
+    """
+    def __init__(self, values, offsets):
+        self.values = values
+        self.offsets = np.asarray(offsets)
+
+    @classmethod
+    def from_lists(cls, lists, dtype=np.int32):
+        lengths = np.fromiter((len(row) for row in lists), dtype=np.int64, count=len(lists))
+        values = np.fromiter(itertools.chain(*lists), dtype=dtype, count=lengths.sum())
+        return cls(values, np.concatenate([[0], np.cumsum(lengths)]))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                return self.take(np.arange(start, stop, step))
+            offsets = self.offsets[start:max(start, stop) + 1]
+            return RaggedArray(self.values[offsets[0]:offsets[-1]], offsets - offsets[0])
+        if np.ndim(key) > 0:
+            return self.take(key)
+        if key < 0:
+            key += len(self)
+        return self.values[self.offsets[key]:self.offsets[key + 1]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.values[self.offsets[i]:self.offsets[i + 1]]
+
+    def take(self, indices):
+        """the rows `indices`, copied"""
+        indices = np.asarray(indices, dtype=np.int64)
+        indices = np.where(indices < 0, indices + len(self), indices)
+        starts = self.offsets[indices]
+        lengths = self.offsets[indices + 1] - starts
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        positions = np.arange(offsets[-1]) + np.repeat(starts - offsets[:-1], lengths)
+        return RaggedArray(self.values[positions], offsets)
+
+    def tolist(self):
+        return [row.tolist() for row in self]
+
+
+class TextArray():
+    """
+    strings stored as their concatenated utf-8 bytes (uint8 array) and the byte `offsets`,
+    they are decoded when accessed
+    """
+    def __init__(self, values, offsets):
+        self.values = values
+        self.offsets = np.asarray(offsets)
+
+    @classmethod
+    def from_strings(cls, strings):
+        encoded = [s.encode('utf-8') for s in strings]
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+        values = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return cls(values, np.concatenate([[0], np.cumsum(lengths)]))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            offsets = self.offsets[start:max(start, stop) + 1]
+            return TextArray(self.values[offsets[0]:offsets[-1]], offsets - offsets[0])
+        if key < 0:
+            key += len(self)
+        return self.values[self.offsets[key]:self.offsets[key + 1]].tobytes().decode('utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+def _take(data, indices):
+    """the rows `indices` of a np.ndarray, sparse matrix, `RaggedArray` or list"""
+    if isinstance(data, np.ndarray) or issparse(data):
+        return data[indices]
+    elif isinstance(data, RaggedArray):
+        return data.take(indices)
+    else:
+        return [data[i] for i in indices]
+
+
+def dict_batch_iter(data, batch_size, num_epochs, shuffle=True, rng=np.random):
+    """
+    Generates a batch iterator for a dataset of aligned fields,
+    each batch is a dict of the rows of each field.
+
+    only a permutation of the indices is shuffled, the fields are not copied.
+    without shuffling, the batches are slices (views for np.ndarray)
+
+    Args:
+    data: dict of field name to np.ndarray, sparse matrix or list (e.g. label lists) of the same length
+    rng: np.random.RandomState or the np.random module
+
+    Returns:
+    generator of dict
+    """
+    data_sizes = set(d.shape[0] if hasattr(d, 'shape') else len(d) for d in data.values())
+    assert len(data_sizes) == 1, 'fields have different lengths: {}'.format(data_sizes)
+    data_size = data_sizes.pop()
+
+    num_batches_per_epoch = int((data_size - 1) / batch_size) + 1
+    for epoch in range(num_epochs):
+        if shuffle:
+            shuffle_indices = rng.permutation(data_size)
+        for batch_num in range(num_batches_per_epoch):
+            start_index = batch_num * batch_size
+            end_index = min((batch_num + 1) * batch_size, data_size)
+            if shuffle:
+                indices = shuffle_indices[start_index:end_index]
+                yield {name: _take(d, indices) for name, d in data.items()}
+            else:
+                yield {name: d[start_index:end_index] for name, d in data.items()}
+
+
+def document_lengths(x, pad_id=0):
+    """
+    number of tokens of each row of the padded id matrix `x`,
+    i.e. the position of the last token that is not `pad_id` plus one
+    """
+    not_pad = (x != pad_id)
+    return np.where(not_pad.any(axis=1),
+                    x.shape[1] - np.argmax(not_pad[:, ::-1], axis=1),
+                    0)
+
+
+def bucket_batch_iter(data, lengths, batch_size, num_epochs, padded_field='x',
+                      min_length=1, pool_batches=100, rng=np.random):
+    """
+    like `dict_batch_iter` but the documents in a batch have similar lengths
+    and `data[padded_field]` is cut to the longest document of the batch (at least `min_length`)
+
+    each epoch, the shuffled indices are split into pools of `pool_batches` batches,
+    each pool is sorted by length and cut into batches and the order of all batches is shuffled
+
+    Args:
+    data: dict of aligned fields, `data[padded_field]` is a padded 2d np.ndarray
+    lengths: np.ndarray, document lengths, e.g. from `document_lengths`
+
+    Returns:
+    generator of dict
+    """
+    lengths = np.asarray(lengths)
+    data_size = len(lengths)
+    pool_size = batch_size * pool_batches
+    for epoch in range(num_epochs):
+        shuffle_indices = rng.permutation(data_size)
+        batches = []
+        for start_index in range(0, data_size, pool_size):
+            pool = shuffle_indices[start_index:start_index + pool_size]
+            pool = pool[np.argsort(lengths[pool], kind='mergesort')]
+            batches += [pool[i:i + batch_size] for i in range(0, len(pool), batch_size)]
+
+        for batch_num in rng.permutation(len(batches)):
+            indices = batches[batch_num]
+            batch = {name: _take(d, indices) for name, d in data.items() if name != padded_field}
+            length = max(lengths[indices].max(), min_length)
+            batch[padded_field] = data[padded_field][indices, :length]
+            yield batch
+
+
+class _ProducerError():
+    def __init__(self, exception):
+        self.exception = exception
+
+
+class Prefetcher():
+    """
+    iterate over `iterable` in a background thread that keeps `buffer_size` items ready,
+    so the items (e.g. feed dicts) are prepared while the main thread runs the model
+
+    `wait_time` is the total time (in seconds) the consumer waited for the next item,
+    with buffer_size=0 the items are produced in the consumer thread and that is the time to produce them
+    """
+    _END = object()
+
+    def __init__(self, iterable, buffer_size=8):
+        self.iterator = iter(iterable)
+        self.buffer_size = buffer_size
+        self.wait_time = 0.0
+
+        if self.buffer_size > 0:
+            self.queue = queue.Queue(maxsize=self.buffer_size)
+            self.thread = threading.Thread(target=self._produce)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _produce(self):
+        try:
+            for item in self.iterator:
+                self.queue.put(item)
+        except Exception as e:
+            self.queue.put(_ProducerError(e))
+        self.queue.put(self._END)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.time()
+        try:
+            if self.buffer_size > 0:
+                item = self.queue.get()
+                if item is self._END:
+                    self.queue.put(self._END)  # later calls stop too
+                    raise StopIteration
+                if isinstance(item, _ProducerError):
+                    raise item.exception
+                return item
+            else:
+                return next(self.iterator)
+        finally:
+            self.wait_time += time.time() - start
+
+    def pop_wait_time(self):
+        """the wait time since the last call"""
+        wait_time, self.wait_time = self.wait_time, 0.0
+        return wait_time
+
+
 class MultiLabelIntegerEncoder:
     """transform """
     def fit(self, labels):
@@ -85,98 +440,209 @@ class MultiLabelIntegerEncoder:
         return self.transform(labels)
 
 
-def label_ids_to_binary_matrix(labels_list, shape):
+def label_ids_to_binary_matrix(labels_list, shape, dense=True):
     """
     list of label ids to binary indicator matrix
 
     args:
 
     list of list of int
+    dense: return a np.ndarray, otherwise a csr_matrix
+    (its size grows with the number of labels, not with shape[0] * shape[1])
 
     return:
 
-    csr_matrix
+    np.ndarray or csr_matrix
+    """
+    lengths = np.fromiter((len(ls) for ls in labels_list), dtype=np.int64, count=len(labels_list))
+    indptr = np.concatenate([[0], np.cumsum(lengths)])
+    indices = np.fromiter(itertools.chain(*labels_list), dtype=np.int32, count=indptr[-1])
+    m = csr_matrix((np.ones(len(indices)), indices, indptr), shape=shape)
+    m.sum_duplicates()
+    m.data[:] = 1
+    if dense:
+        return m.toarray()
+    return m
+
+
+def count_walk_nodes(walks):
+    """number of distinct nodes in the walks"""
+    if isinstance(walks, np.ndarray):
+        return np.count_nonzero(np.bincount(walks.ravel()))
+    return len(set(itertools.chain(*walks)))
+
+
+def iter_text_walk_blocks(path, block_size=1000000):
     """
-    size = sum(len(ls) for ls in labels_list)
-    row_indx = list(itertools.chain(
-        *[list(itertools.repeat(i, len(ls)))
-          for i, ls in enumerate(labels_list)]))
-    col_indx = list(itertools.chain(*labels_list))
-    return csr_matrix((np.ones(size), (row_indx, col_indx)),
-                      shape=shape).toarray()
+    read the walks of a text walk file (or .json manifest) as int32 arrays
+
+    Returns:
+
+    generator of 2d ndarray, at most `block_size` walks each
+    """
+    paths = read_walk_manifest(path) if path.endswith('.json') else [path]
+    for p in paths:
+        with open(p, 'r') as f:
+            for lines in iter(lambda: list(itertools.islice(f, block_size)), []):
+                width = len(lines[0].split())
+                block = np.fromstring(''.join(lines), dtype=np.int32, sep=' ')
+                if block.size != width * len(lines) or any(len(l.split()) != width for l in lines):
+                    raise ValueError('walks of different lengths in {}'.format(p))
+                yield block.reshape(len(lines), width)
+
+
+def convert_walks_to_npy(path, output_path, block_size=1000000):
+    """
+    convert a text walk file (or .json manifest) into an int32 .npy array,
+    one row per walk, so it can be memory-mapped by `RWBatchGenerator.read_walks`
+
+    the walks must have the same length
+    """
+    n_walks, width = 0, None
+    for block in iter_text_walk_blocks(path, block_size):
+        if width is not None and block.shape[1] != width:
+            raise ValueError('walks of different lengths in {}'.format(path))
+        n_walks, width = n_walks + block.shape[0], block.shape[1]
+
+    out = np.lib.format.open_memmap(output_path, mode='w+', dtype=np.int32,
+                                    shape=(n_walks, width or 0))
+    offset = 0
+    for block in iter_text_walk_blocks(path, block_size):
+        out[offset:offset + len(block)] = block
+        offset += len(block)
+    out.flush()
+    del out
+
+
+def read_walk_manifest(path):
+    """the shard paths listed in a walk manifest, written by sample_random_walks.py"""
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+    return [os.path.join(os.path.dirname(path), shard['path'])
+            for shard in manifest['shards']]
 
 
 class RWBatchGenerator():
     """Random walk batch generator
+
+    the walks are scanned in order with a sliding window,
+    each center node gives `num_skips` (center, context) pairs with distinct context positions
+
+    pairs are generated with numpy for `buffer_walks` walks at a time,
+    so that `next_batch` is mostly a slice of the buffer
     """
-    def __init__(self, walks, batch_size, num_skips, skip_window):
+    def __init__(self, walks, batch_size, num_skips, skip_window, buffer_walks=4096, seed=None):
         """
         Args:
 
-        walks: list of integer list
+        walks: list of integer list, or 2d array of int
         batch_size: int
         num_skips: int, within each window, number of examples
         skip_window: int, sliding window size
+        buffer_walks: int, number of walks turned into pairs at a time
+        seed: int, random seed of the context sampling
         """
         self.walks = walks
         self.batch_size = batch_size
         self.num_skips = num_skips
         self.skip_window = skip_window
-
-        self.current_walk = 0
-        self.data = self.walks[0]
+        self.buffer_walks = buffer_walks
+        self.rng = np.random.RandomState(seed)
 
         self.span = 2 * self.skip_window + 1  # [ self.skip_window target self.skip_window ]
-        self.data_index = 0
+        # positions of the context relative to the center
+        self.context_offsets = np.array([i for i in range(-self.skip_window, self.skip_window + 1)
+                                         if i != 0])
+
+        self.current_walk = 0
+        self.buffer = (np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32))
+        self.buffer_index = 0
 
     @classmethod
-    def read_walks(cls, path):
-        walks = []
-        with open(path, 'r') as f:
-            for l in f:
-                walks.append(list(map(int, l.strip().split())))
+    def read_walks(cls, path, shuffle=False, seed=None):
+        """
+        Args:
+
+        path: str, random walk file: .npy array of walks, text file with one walk per line,
+            or the .json manifest of text walk shards
+        shuffle: bool, shuffle the shard order and the walks
+        seed: int, random seed for shuffling
+
+        Returns:
+
+        list of integer list, or a read-only memory-mapped 2d array for .npy
+        """
+        if path.endswith('.npy'):
+            walks = np.load(path, mmap_mode='r')
+            if shuffle:  # loads the walks in memory
+                walks = walks[np.random.RandomState(seed).permutation(len(walks))]
+            return walks
+
+        rng = random.Random(seed)
+        if path.endswith('.json'):
+            paths = read_walk_manifest(path)
+            if shuffle:
+                rng.shuffle(paths)
+            walks = list(itertools.chain(*map(cls.read_walks, paths)))
+        else:
+            walks = []
+            with open(path, 'r') as f:
+                for l in f:
+                    walks.append(list(map(int, l.strip().split())))
+        if shuffle:
+            rng.shuffle(walks)
         return walks
     
+    def _next_walks(self):
+        """the next `buffer_walks` walks (looping back to the first walk) as a flat array + lengths"""
+        idx = np.arange(self.current_walk, self.current_walk + self.buffer_walks) % len(self.walks)
+        self.current_walk = (idx[-1] + 1) % len(self.walks)
+
+        if isinstance(self.walks, np.ndarray):
+            block = np.asarray(self.walks[idx])
+            return block.ravel(), np.full(len(idx), block.shape[1], dtype=np.int64)
+        else:
+            block = [self.walks[i] for i in idx]
+            lengths = np.array(list(map(len, block)), dtype=np.int64)
+            return np.fromiter(itertools.chain(*block), dtype=np.int64, count=lengths.sum()), lengths
+
+    def _generate_pairs(self):
+        """(center, context) pairs of the next walks"""
+        flat, lengths = self._next_walks()
+
+        # position of the centers in `flat`
+        n_centers = np.maximum(lengths - 2 * self.skip_window, 0)
+        walk_starts = np.cumsum(lengths) - lengths
+        center_starts = np.cumsum(n_centers) - n_centers
+        centers = (np.arange(n_centers.sum()) +
+                   np.repeat(walk_starts + self.skip_window - center_starts, n_centers))
+
+        # sample `num_skips` distinct context positions for each center
+        order = np.argsort(self.rng.random_sample((len(centers), len(self.context_offsets))), axis=1)
+        contexts = centers[:, None] + self.context_offsets[order[:, :self.num_skips]]
+
+        batch = np.repeat(flat[centers], self.num_skips).astype(np.int32)
+        labels = flat[contexts].ravel().astype(np.int32)
+        return batch, labels
+
     def next_batch(self):
-        batch = np.ndarray(shape=(self.batch_size), dtype=np.int32)
-        labels = np.ndarray(shape=(self.batch_size), dtype=np.int32)
-        buffer = collections.deque(maxlen=self.span)
-
-        if self.data_index + self.span > len(self.data):
-            self.data_index = 0
-
-        buffer.extend(self.data[self.data_index:self.data_index + self.span])
-        self.data_index += self.span
-        for i in range(self.batch_size // self.num_skips):
-            target = self.skip_window  # target label at the center of the buffer
-            targets_to_avoid = [self.skip_window]
-            for j in range(self.num_skips):
-                # sample unique targets
-                while target in targets_to_avoid:
-                    target = random.randint(0, self.span-1)
-                targets_to_avoid.append(target)
-                batch[i * self.num_skips + j] = buffer[self.skip_window]
-                labels[i * self.num_skips + j] = buffer[target]
-            if self.data_index == len(self.data):
-                self.current_walk += 1
-
-                if self.current_walk == len(self.walks):  # used all walks
-                    self.current_walk = 0
-                    
-                self.data = self.walks[self.current_walk]
-
-                # equivalent to: buffer[:] = self.data[:self.span]
-                buffer.clear()
-                buffer.extend(self.data[:self.span])
-                self.data_index = self.span
-            else:
-                buffer.append(self.data[self.data_index])
-                self.data_index += 1
-        # Backtrack a little bit to avoid skipping words in the end of a batch
-        self.data_index = (self.data_index + len(self.data) - self.span) % len(self.data)
+        batch, labels = self.buffer
+        start = self.buffer_index
+        n_empty = 0
+        while len(batch) - start < self.batch_size:
+            new_batch, new_labels = self._generate_pairs()
+            if len(new_batch) == 0:
+                n_empty += self.buffer_walks
+                if n_empty >= len(self.walks):
+                    raise ValueError('walks are shorter than the window span {}'.format(self.span))
+            batch = np.concatenate([batch[start:], new_batch])
+            labels = np.concatenate([labels[start:], new_labels])
+            start = 0
+
+        self.buffer = (batch, labels)
+        self.buffer_index = start + self.batch_size
+        return (batch[start:self.buffer_index], labels[start:self.buffer_index])
 
-        return (batch, labels)
-    
 
 def load_pickle(path, mode='rb'):
     return pkl.load(open(path, mode))
@@ -0,0 +1,277 @@
+"""
+dataset directory format replacing the `<field>_split.pkl` pickles of process_train_dev_test.py
+
+data_dir/manifest.json has the split names and boundaries and the kind of each field,
+the rows of all splits of a field are concatenated in .npy files under data_dir/<field>/:
+
+- array: values.npy (e.g. node_ids)
+- ragged: values.npy and offsets.npy, a `RaggedArray` (e.g. labels_id)
+- text: values.npy (utf-8 bytes) and offsets.npy, a `TextArray` (e.g. text)
+- csr: data.npy, indices.npy and indptr.npy, a csr_matrix (e.g. tfidf, labels_binary)
+
+the files are memory-mapped, so loading a split only reads the parts of it that are used
+"""
+import os
+import json
+import hashlib
+import collections
+import numpy as np
+
+from scipy.sparse import csr_matrix, issparse, vstack
+
+from data_helpers import RaggedArray, TextArray, load_pickle
+
+
+MANIFEST_FILE = 'manifest.json'
+FORMAT_VERSION = 1
+SPLITS = ['train', 'dev', 'test']
+
+# the fields written by process_train_dev_test.py and their kinds
+FIELDS = collections.OrderedDict([
+    ('text', 'text'),
+    ('tfidf', 'csr'),
+    ('labels', 'text'),
+    ('labels_id', 'ragged'),
+    ('labels_binary', 'csr'),
+    ('node_ids', 'array'),
+])
+
+# the files of each kind of field
+KIND_FILES = {
+    'array': ['values'],
+    'ragged': ['values', 'offsets'],
+    'text': ['values', 'offsets'],
+    'csr': ['data', 'indices', 'indptr'],
+}
+
+
+def pickle_path(data_dir, field):
+    """the path of the pickled splits of `field` used before this format"""
+    return os.path.join(data_dir, '{}_split.pkl'.format(field))
+
+
+def read_manifest(data_dir):
+    """the manifest of `data_dir`, None if the dataset is not in this format"""
+    path = os.path.join(data_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(data_dir, manifest):
+    path = os.path.join(data_dir, MANIFEST_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.rename(path + '.tmp', path)
+
+
+def _field_path(data_dir, field, name):
+    return os.path.join(data_dir, field, '{}.npy'.format(name))
+
+
+def _offsets(lengths):
+    return np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+
+
+def _make_field_dir(data_dir, field):
+    field_dir = os.path.join(data_dir, field)
+    if not os.path.exists(field_dir):
+        os.makedirs(field_dir)
+
+
+def _check_manifest(data_dir, sizes, split_names):
+    """the manifest of `data_dir` (a new one if there is none) after checking the split sizes"""
+    manifest = read_manifest(data_dir) or {'version': FORMAT_VERSION,
+                                           'splits': list(split_names),
+                                           'boundaries': _offsets(sizes).tolist(),
+                                           'fields': {}}
+    assert manifest['splits'] == list(split_names), 'splits differ from the manifest'
+    assert np.diff(manifest['boundaries']).tolist() == sizes, \
+        'split sizes {} differ from the manifest {}'.format(sizes, np.diff(manifest['boundaries']).tolist())
+    return manifest
+
+
+def _concatenate(kind, splits):
+    """the arrays of `kind` holding the rows of all `splits`"""
+    if kind == 'array':
+        return {'values': np.concatenate([np.asarray(split) for split in splits])}
+    elif kind == 'ragged':
+        rows = [split if isinstance(split, RaggedArray) else RaggedArray.from_lists(split)
+                for split in splits]
+        return {'values': np.concatenate([r.values for r in rows]).astype(np.int32),
+                'offsets': _offsets(np.concatenate([r.lengths() for r in rows]))}
+    elif kind == 'text':
+        rows = [split if isinstance(split, TextArray) else TextArray.from_strings(split)
+                for split in splits]
+        return {'values': np.concatenate([r.values for r in rows]),
+                'offsets': _offsets(np.concatenate([np.diff(r.offsets) for r in rows]))}
+    elif kind == 'csr':
+        X = vstack([csr_matrix(split) for split in splits], format='csr')
+        # the same index dtype for indices and indptr, or scipy copies them when loading
+        index_dtype = np.int32 if X.nnz < np.iinfo(np.int32).max else np.int64
+        return {'data': X.data, 'indices': X.indices.astype(index_dtype),
+                'indptr': X.indptr.astype(index_dtype), 'shape': X.shape}
+    raise ValueError('unknown kind of field: {}'.format(kind))
+
+
+def write_field(data_dir, field, splits, kind=None, split_names=SPLITS):
+    """
+    write the rows of `field` for each split of `split_names` and record it in the manifest
+
+    Args:
+    splits: list of the rows of each split, e.g. (train, dev, test):
+            np.ndarray / list of label lists / list of str / sparse matrix depending on the kind
+    kind: 'array', 'ragged', 'text' or 'csr', by default the one of `FIELDS`
+    """
+    kind = kind or FIELDS[field]
+    sizes = [split.shape[0] if issparse(split) else len(split) for split in splits]
+    manifest = _check_manifest(data_dir, sizes, split_names)
+
+    arrays = _concatenate(kind, splits)
+    field_info = {'kind': kind}
+    if 'shape' in arrays:
+        field_info['shape'] = list(arrays.pop('shape'))
+
+    _make_field_dir(data_dir, field)
+    for name, array in arrays.items():
+        np.save(_field_path(data_dir, field, name), array)
+
+    manifest['fields'][field] = field_info
+    write_manifest(data_dir, manifest)
+
+
+class CSRFieldWriter():
+    """
+    writes a csr field part by part, e.g. the tf-idf matrix of chunks of documents,
+    so the whole matrix is never in memory
+
+    the parts are the consecutive rows of all splits,
+    `close` gets the split sizes and records the field in the manifest
+
+    Args:
+    n_cols: number of columns of the parts
+    """
+    def __init__(self, data_dir, field, n_cols, dtype=np.float64, split_names=SPLITS):
+        self.data_dir = data_dir
+        self.field = field
+        self.n_cols = n_cols
+        self.dtype = np.dtype(dtype)
+        self.split_names = split_names
+        self.row_lengths = []
+
+        _make_field_dir(data_dir, field)
+        # raw arrays, converted to .npy by `close` once their lengths are known
+        self.files = {'data': open(self._raw_path('data'), 'wb'),
+                      'indices': open(self._raw_path('indices'), 'wb')}
+
+    def _raw_path(self, name):
+        return _field_path(self.data_dir, self.field, name) + '.part'
+
+    def write(self, X):
+        X = csr_matrix(X)
+        assert X.shape[1] == self.n_cols, '{} columns instead of {}'.format(X.shape[1], self.n_cols)
+        self.files['data'].write(np.asarray(X.data, dtype=self.dtype).tobytes())
+        self.files['indices'].write(np.asarray(X.indices, dtype=np.int32).tobytes())
+        self.row_lengths.append(np.diff(X.indptr))
+
+    def close(self, split_sizes, block_size=1 << 24):
+        """
+        Args:
+        split_sizes: number of rows of each split, they sum up to the number of written rows
+        block_size: number of values copied at a time into the .npy files
+        """
+        for f in self.files.values():
+            f.close()
+        lengths = np.concatenate(self.row_lengths) if self.row_lengths else np.zeros(0, dtype=np.int64)
+        assert sum(split_sizes) == len(lengths), \
+            'split sizes {} for {} written rows'.format(split_sizes, len(lengths))
+        manifest = _check_manifest(self.data_dir, list(split_sizes), self.split_names)
+
+        indptr = _offsets(lengths)
+        # the same index dtype for indices and indptr, see `_concatenate`
+        index_dtype = np.int32 if indptr[-1] < np.iinfo(np.int32).max else np.int64
+        for name, raw_dtype, dtype in [('data', self.dtype, self.dtype),
+                                       ('indices', np.int32, index_dtype)]:
+            path = _field_path(self.data_dir, self.field, name)
+            if indptr[-1] == 0:
+                np.save(path, np.zeros(0, dtype=dtype))
+            else:
+                raw = np.memmap(self._raw_path(name), dtype=raw_dtype, mode='r')
+                out = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(len(raw), ))
+                for start in range(0, len(raw), block_size):
+                    out[start:start + block_size] = raw[start:start + block_size]
+                out.flush()
+                del raw, out
+            os.remove(self._raw_path(name))
+        np.save(_field_path(self.data_dir, self.field, 'indptr'), indptr.astype(index_dtype))
+
+        manifest['fields'][self.field] = {'kind': 'csr', 'shape': [len(lengths), self.n_cols]}
+        write_manifest(self.data_dir, manifest)
+
+
+def _load_split(data_dir, field, field_info, start, end, mmap_mode):
+    kind = field_info['kind']
+
+    def load(name):
+        return np.load(_field_path(data_dir, field, name), mmap_mode=mmap_mode)
+
+    if kind == 'array':
+        return load('values')[start:end]
+    elif kind in ('ragged', 'text'):
+        offsets = np.array(load('offsets')[start:end + 1])
+        values = load('values')[offsets[0]:offsets[-1]]
+        cls = RaggedArray if kind == 'ragged' else TextArray
+        return cls(values, offsets - offsets[0])
+    elif kind == 'csr':
+        indptr = np.array(load('indptr')[start:end + 1])
+        data = load('data')[indptr[0]:indptr[-1]]
+        indices = load('indices')[indptr[0]:indptr[-1]]
+        return csr_matrix((data, indices, indptr - indptr[0]),
+                          shape=(end - start, field_info['shape'][1]), copy=False)
+    raise ValueError('unknown kind of field: {}'.format(kind))
+
+
+def load_splits(data_dir, field, splits=SPLITS, mmap_mode='r'):
+    """
+    the rows of `field` for each of `splits`,
+    from the pickle `data_dir/<field>_split.pkl` if the dataset is not converted yet
+
+    Returns:
+    list with the rows of each split:
+    np.ndarray, `RaggedArray`, `TextArray` or csr_matrix depending on the kind of the field
+    (as pickled for the old format, except label lists which become `RaggedArray`)
+    """
+    manifest = read_manifest(data_dir)
+    if manifest is None or field not in manifest['fields']:
+        rows = dict(zip(SPLITS, load_pickle(pickle_path(data_dir, field))))
+        if FIELDS.get(field) == 'ragged':
+            return [RaggedArray.from_lists(rows[split]) for split in splits]
+        return [rows[split] for split in splits]
+
+    field_info = manifest['fields'][field]
+    boundaries = dict(zip(manifest['splits'], zip(manifest['boundaries'][:-1], manifest['boundaries'][1:])))
+    return [_load_split(data_dir, field, field_info, start, end, mmap_mode)
+            for start, end in (boundaries[split] for split in splits)]
+
+
+def load_split(data_dir, field, split, mmap_mode='r'):
+    """the rows of `field` for `split`, see `load_splits`"""
+    return load_splits(data_dir, field, [split], mmap_mode)[0]
+
+
+def field_digest(data_dir, field, block_size=1 << 20):
+    """sha1 hex digest of the files of `field` (or of its pickle for the old format)"""
+    manifest = read_manifest(data_dir)
+    sha1 = hashlib.sha1()
+    if manifest is None or field not in manifest['fields']:
+        paths = [pickle_path(data_dir, field)]
+    else:
+        # the split boundaries, not the whole manifest which changes with the other fields
+        sha1.update(json.dumps([manifest['splits'], manifest['boundaries']]).encode('utf-8'))
+        paths = [_field_path(data_dir, field, name) for name in KIND_FILES[manifest['fields'][field]['kind']]]
+    for path in paths:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                sha1.update(block)
+    return sha1.hexdigest()
@@ -2,17 +2,22 @@
 
 import tensorflow as tf
 import os
-import itertools
 import numpy as np
 
 from word2vec import Word2Vec
-from data_helpers import RWBatchGenerator
+from data_helpers import RWBatchGenerator, count_walk_nodes, Prefetcher
 from tf_helpers import save_embedding_for_viz
 
 
 tf.flags.DEFINE_string('data_dir', 'data/stackexchange/datascience/', 'directory of dataset')
+tf.flags.DEFINE_string("walks_file", "random_walks.npy",
+                       "random walks under data_dir: .npy array, text file "
+                       "or .json manifest of text shards (default: random_walks.npy)")
+tf.flags.DEFINE_boolean("shuffle_walks", False, "shuffle the random walks (default: False)")
 tf.flags.DEFINE_integer("checkpoint_every", 5000, "Save model after this many steps (default: 5000)")
 tf.flags.DEFINE_integer("num_checkpoints", 1, "Number of checkpoints to store (default: 1)")
+tf.flags.DEFINE_integer("prefetch_batches", 0,
+                        "Number of batches prepared ahead in a background thread, 0 disables it (default: 0)")
 tf.flags.DEFINE_boolean("save_viz_embedding", False,
                         "save embeddding for visualization or not (default: False)")
 
@@ -35,9 +40,10 @@ embedding_size = 128  # Dimension of the embedding vector.
 skip_window = 3       # How many words to consider left and right.
 num_skips = 4  # How many times to reuse an input to generate a label.
 
-walks = RWBatchGenerator.read_walks("{}/random_walks.txt".format(data_dir))
+walks = RWBatchGenerator.read_walks(os.path.join(data_dir, FLAGS.walks_file),
+                                   shuffle=FLAGS.shuffle_walks)
 
-vocabulary_size = len(set(itertools.chain(*walks)))
+vocabulary_size = count_walk_nodes(walks)
 
 generator = RWBatchGenerator(walks, batch_size, num_skips, skip_window)
 
@@ -94,12 +100,17 @@ with tf.Session(graph=graph) as session:
     init.run()
     print('Initialized')
 
+    def feed_dicts():
+        for _ in range(num_steps):
+            batch_inputs, batch_labels = generator.next_batch()
+            yield {model.train_inputs: batch_inputs,
+                   model.train_labels: np.expand_dims(np.array(batch_labels), -1)}
+
+    # feed dicts are optionally prepared ahead in a background thread
+    train_feed_dicts = Prefetcher(feed_dicts(), FLAGS.prefetch_batches)
+
     average_loss = 0
-    for step in range(num_steps):
-        batch_inputs, batch_labels = generator.next_batch()
-        
-        feed_dict = {model.train_inputs: batch_inputs,
-                     model.train_labels: np.expand_dims(np.array(batch_labels), -1)}
+    for step, feed_dict in enumerate(train_feed_dicts):
 
         # We perform one update step by evaluating the optimizer op (including it
         # in the list of returned values for session.run()
@@ -111,6 +122,7 @@ with tf.Session(graph=graph) as session:
                 average_loss /= 2000
             # The average loss is an estimate of the loss over the last 2000 batches.
             print('Average loss at step ', step, ': ', average_loss)
+            print('input wait: {:.3f}s'.format(train_feed_dicts.pop_wait_time()))
             average_loss = 0
 
         if step % FLAGS.checkpoint_every == 0 and step > 0:
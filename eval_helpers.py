@@ -1,9 +1,12 @@
 import numpy as np
 import tensorflow as tf
 import itertools
+import collections
 
 from scipy.sparse import issparse
 
+from data_helpers import RaggedArray
+
 
 def precision(p, t):
     """
@@ -14,24 +17,233 @@ def precision(p, t):
     return len(t.intersection(p)) / len(p)
 
 
-def precision_at_ks(Y_pred_scores, Y_test, ks=[1, 3, 5, 10]):
+def top_k_indices(scores, k):
+    """
+    column indices of the `k` largest scores of each row, in decreasing order of score
+
+    scores: nd.array or sparse matrix of scores
+
+    returns: nd.array of shape (n_rows, k), for sparse scores
+    the rows with less than k stored scores are padded with -1
+    """
+    if issparse(scores):
+        scores = scores.tocsr()
+        rows = np.repeat(np.arange(scores.shape[0]), np.diff(scores.indptr))
+        # sort by row, then by decreasing score
+        order = np.lexsort((-scores.data, rows))
+        rank = np.arange(len(order)) - scores.indptr[rows[order]]
+        keep = order[rank < k]
+        top = np.full((scores.shape[0], k), -1, dtype=np.int64)
+        top[rows[keep], rank[rank < k]] = scores.indices[keep]
+        return top
+    else:
+        n_rows, n_cols = scores.shape
+        k = min(k, n_cols)
+        if k < n_cols:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(n_cols), (n_rows, 1))
+        # only the top slice is sorted
+        row_indices = np.arange(n_rows)[:, None]
+        order = np.argsort(-scores[row_indices, top], axis=1, kind='mergesort')
+        return top[row_indices, order]
+
+
+def _label_rows(Y):
+    """row ids and labels of `Y` (label lists or label indicator matrix), as two flat arrays"""
+    if issparse(Y):
+        Y = Y.tocsr()
+        lengths = np.diff(Y.indptr)
+        labels = Y.indices
+    elif isinstance(Y, RaggedArray):
+        lengths = Y.lengths()
+        labels = np.asarray(Y.values, dtype=np.int64)
+    else:
+        lengths = np.fromiter((len(ys) for ys in Y), dtype=np.int64, count=len(Y))
+        labels = np.fromiter(itertools.chain(*Y), dtype=np.int64, count=lengths.sum())
+    return np.repeat(np.arange(len(lengths)), lengths), labels
+
+
+def _grow(a, size):
+    """pad the 1d array `a` with zeros to `size`"""
+    if len(a) >= size:
+        return a
+    return np.concatenate([a, np.zeros(size - len(a), dtype=a.dtype)])
+
+
+def inverse_label_propensities(Y_train, n_labels, A=0.55, B=1.5):
+    """
+    inverse propensity of each label estimated from its frequency in the training labels,
+    as in Jain et al., Extreme Multi-label Loss Functions for Recommendation, Tagging, Ranking & Other
+    Missing Label Applications, KDD 2016
+
+    1 / p_l = 1 + C (N_l + B)^-A, C = (log N - 1) (B + 1)^A
+
+    Y_train: training labels (label lists or label indicator matrix)
+    """
+    _, labels = _label_rows(Y_train)
+    n = Y_train.shape[0] if issparse(Y_train) else len(Y_train)
+    counts = np.bincount(labels, minlength=n_labels)
+    C = (np.log(n) - 1) * (B + 1) ** A
+    return 1 + C * (counts + B) ** -A
+
+
+class RankingMetrics():
+    """
+    ranking metrics at `ks` accumulated over batches of top k label indices:
+
+    - p@k: precision, as `precision_at_ks`
+    - ndcg@k: normalized discounted cumulative gain
+    - psp@k, psndcg@k: propensity scored p@k and ndcg@k (Jain et al., KDD 2016),
+      normalized by their best possible value over all rows (ratio of sums),
+      only if `inv_propensities` is given
+    - coverage@k: fraction of the distinct true labels that are correctly predicted at least once
+
+    inv_propensities: nd.array, e.g. from `inverse_label_propensities`,
+    labels out of its range get its largest value
+    """
+    def __init__(self, ks=[1, 3, 5], inv_propensities=None):
+        self.ks = ks
+        self.max_k = max(ks)
+        self.inv_propensities = inv_propensities
+        self.n_rows = 0
+        self.sums = collections.defaultdict(float)
+        self.true_labels = np.zeros(0, dtype=bool)
+        self.covered_labels = {k: np.zeros(0, dtype=bool) for k in ks}
+
+    def _weights(self, labels):
+        w = np.full(len(labels), self.inv_propensities.max())
+        inside = labels < len(self.inv_propensities)
+        w[inside] = self.inv_propensities[labels[inside]]
+        return w
+
+    def update(self, top, Y, n_predicted=None):
+        """
+        top: nd.array of label indices in decreasing order of score, e.g. from `top_k_indices`,
+        -1 for no label
+        Y: true labels of the same rows (label lists or label indicator matrix)
+        n_predicted: nd.array, number of labels scored for each row (sparse scores),
+        by default the number of columns of `top`
+        """
+        n_rows = top.shape[0]
+        top = top[:, :self.max_k]
+        rows = np.arange(n_rows)
+
+        # a (row, label) pair is a hit if it is in the ground truth,
+        # both are linearized into the keys row * n_keys + label
+        true_rows, true_labels = _label_rows(Y)
+        n_keys = max(top.max() + 1 if top.size else 0,
+                     true_labels.max() + 1 if len(true_labels) else 0, 1)
+        true_keys = np.unique(true_rows * n_keys + true_labels)
+        true_rows, true_labels = true_keys // n_keys, true_keys % n_keys
+        n_true = np.bincount(true_rows, minlength=n_rows)
+
+        hits = np.isin(rows[:, None] * n_keys + top, true_keys) & (top >= 0)
+        discounts = 1 / np.log2(np.arange(top.shape[1]) + 2)
+        ideal_dcg = np.concatenate([[0], np.cumsum(discounts)])
+        cum_hits = np.cumsum(hits, axis=1)
+        cum_dcg = np.cumsum(hits * discounts, axis=1)
+
+        if self.inv_propensities is not None:
+            weighted_hits = hits * self._weights(np.maximum(top, 0).ravel()).reshape(top.shape)
+            cum_ps_hits = np.cumsum(weighted_hits, axis=1)
+            cum_ps_dcg = np.cumsum(weighted_hits * discounts, axis=1)
+
+            # the best case: the true labels ranked by decreasing inverse propensity
+            w = self._weights(true_labels)
+            order = np.lexsort((-w, true_rows))
+            offsets = np.concatenate([[0], np.cumsum(n_true)])
+            rank = np.arange(len(order)) - offsets[true_rows[order]]
+            in_top = rank < top.shape[1]
+            best = np.zeros(top.shape)
+            best[true_rows[order][in_top], rank[in_top]] = w[order][in_top]
+            cum_best_hits = np.cumsum(best, axis=1)
+            cum_best_dcg = np.cumsum(best * discounts, axis=1)
+
+        self.true_labels = _grow(self.true_labels, n_keys)
+        self.true_labels[true_labels] = True
+
+        if n_predicted is None:
+            n_predicted = np.full(n_rows, top.shape[1])
+        for k in self.ks:
+            j = min(k, top.shape[1]) - 1
+            denominator = np.minimum(k, n_predicted)
+            self.sums['p@{}'.format(k)] += np.sum(
+                np.where(denominator > 0, cum_hits[:, j] / np.maximum(denominator, 1), 0.))
+
+            idcg = ideal_dcg[np.minimum(k, np.minimum(n_true, top.shape[1]))]
+            self.sums['ndcg@{}'.format(k)] += np.sum(
+                np.where(idcg > 0, cum_dcg[:, j] / np.maximum(idcg, 1e-12), 0.))
+
+            if self.inv_propensities is not None:
+                self.sums['psp@{}'.format(k)] += np.sum(cum_ps_hits[:, j])
+                self.sums['best_psp@{}'.format(k)] += np.sum(cum_best_hits[:, j])
+                self.sums['psndcg@{}'.format(k)] += np.sum(cum_ps_dcg[:, j])
+                self.sums['best_psndcg@{}'.format(k)] += np.sum(cum_best_dcg[:, j])
+
+            covered = _grow(self.covered_labels[k], n_keys)
+            covered[top[:, :j + 1][hits[:, :j + 1]]] = True
+            self.covered_labels[k] = covered
+
+        self.n_rows += n_rows
+
+    def result(self):
+        """OrderedDict of metric name (e.g. 'p@1') to value"""
+        names = ['p', 'ndcg']
+        if self.inv_propensities is not None:
+            names += ['psp', 'psndcg']
+        result = collections.OrderedDict()
+        for name in names:
+            for k in self.ks:
+                key = '{}@{}'.format(name, k)
+                if name.startswith('ps'):
+                    best = self.sums['best_' + key]
+                    result[key] = self.sums[key] / best if best > 0 else 0.
+                else:
+                    result[key] = self.sums[key] / self.n_rows if self.n_rows else 0.
+        n_true_labels = np.count_nonzero(self.true_labels)
+        for k in self.ks:
+            result['coverage@{}'.format(k)] = (np.count_nonzero(self.covered_labels[k]) / n_true_labels
+                                               if n_true_labels else 0.)
+        return result
+
+
+def ranking_metrics(Y_pred_scores, Y_test, ks=[1, 3, 5], inv_propensities=None, block_size=1000):
+    """
+    Y_pred_scores: nd.array or sparse matrix, entry ij is the score of label j for instance i
+    Y_test: true labels (label lists or label indicator matrix)
+    block_size: number of rows of dense scores ranked at a time, bounds the memory of argpartition
+
+    for sparse scores, the top k labels of a row are among its stored scores
+
+    returns: OrderedDict of metric name to value, see `RankingMetrics`
+    """
+    max_k = max(ks)
+    n_rows, n_cols = Y_pred_scores.shape
+    if issparse(Y_pred_scores):
+        top = top_k_indices(Y_pred_scores, max_k)
+        n_predicted = np.diff(Y_pred_scores.tocsr().indptr)
+    else:
+        top = np.concatenate([top_k_indices(Y_pred_scores[i:i + block_size], max_k)
+                              for i in range(0, max(n_rows, 1), block_size)])
+        n_predicted = np.full(n_rows, n_cols, dtype=np.int64)
+
+    metrics = RankingMetrics(ks, inv_propensities)
+    metrics.update(top, Y_test, n_predicted)
+    return metrics.result()
+
+
+def precision_at_ks(Y_pred_scores, Y_test, ks=[1, 3, 5, 10], block_size=1000):
     """
     Y_pred_scores: nd.array of dtype float, entry ij is the score of label j for instance i
     Y_test: list of label ids
-    """
-    result = []
-    for k in [1, 3, 5, 10]:
-        Y_pred = []
-        for i in np.arange(Y_pred_scores.shape[0]):
-            if issparse(Y_pred_scores):
-                idx = np.argsort(Y_pred_scores[i].data)[::-1]
-                Y_pred.append(set(Y_pred_scores[i].indices[idx[:k]]))
-            else:  # is ndarray
-                idx = np.argsort(Y_pred_scores[i, :])[::-1]
-                Y_pred.append(set(idx[:k]))
+    block_size: number of rows of dense scores ranked at a time, bounds the memory of argpartition
 
-        result.append(np.mean([precision(yp, set(yt)) for yt, yp in zip(Y_test, Y_pred)]))
-    return result
+    for sparse scores, the top k labels of a row are among its stored scores,
+    rows without any stored score have a precision of 0
+    """
+    result = ranking_metrics(Y_pred_scores, Y_test, ks, block_size=block_size)
+    return [result['p@{}'.format(k)] for k in ks]
 
 
 def tf_precision_at_k(pred_values, correct_labels, k, name=None):
@@ -50,6 +262,9 @@ def label_lists_to_sparse_tuple(label_lists, n_classes):
     """given label lists and number of a
     return the sparse representation (indices, values, shape)
 
+    label_lists can also be a `RaggedArray` or a csr_matrix of label indicators (e.g. labels_binary),
+    its rows are then the label lists
+
     example:
 
     >> label_lists = [[0, 1, 2], [1, 2], [0, 2]]
@@ -61,9 +276,23 @@ def label_lists_to_sparse_tuple(label_lists, n_classes):
      [1 2 0]
      [0 2 0]]
     """
-    indices = [[i, j]
-               for i, row in enumerate(label_lists)
-               for j in range(len(row))]
-    values = list(itertools.chain(*label_lists))
-    shape = (len(label_lists), n_classes)
+    if issparse(label_lists):
+        label_lists = label_lists.tocsr()
+        lengths = np.diff(label_lists.indptr)
+        values = label_lists.indices.astype(np.int32)
+    elif isinstance(label_lists, RaggedArray):
+        lengths = label_lists.lengths()
+        values = np.asarray(label_lists.values, dtype=np.int32)
+    else:
+        lengths = np.fromiter((len(row) for row in label_lists), dtype=np.int64,
+                              count=len(label_lists))
+        values = np.fromiter(itertools.chain(*label_lists), dtype=np.int32,
+                             count=lengths.sum())
+    n_rows = len(lengths)
+    # row i has the positions 0 .. lengths[i] - 1
+    row_indices = np.repeat(np.arange(n_rows), lengths)
+    offsets = np.cumsum(lengths) - lengths
+    col_indices = np.arange(len(values)) - np.repeat(offsets, lengths)
+    indices = np.stack([row_indices, col_indices], axis=1).astype(np.int64)
+    shape = (n_rows, n_classes)
     return (indices, values, shape)
@@ -4,11 +4,12 @@ import os
 import numpy as np
 import tensorflow as tf
 
-from tensorflow.contrib import learn
 from tqdm import tqdm
 
-from data_helpers import load_pickle, batch_iter
-from eval_helpers import precision_at_ks
+from data_helpers import dict_batch_iter
+from dataset_helpers import load_split, load_splits
+from vocab_helpers import Vocabulary
+from eval_helpers import RankingMetrics, inverse_label_propensities, top_k_indices
 
 
 tf.flags.DEFINE_string('data_dir', '', 'directory of dataset')
@@ -17,6 +18,10 @@ tf.flags.DEFINE_boolean('use_node_embedding', False, 'use node embedding or not'
 tf.flags.DEFINE_string("checkpoint_dir", "",
                        "Checkpoint directory from training run")
 tf.flags.DEFINE_integer("batch_size", 64, "")
+tf.flags.DEFINE_string("scores_path", "",
+                       "if given, the label scores of all documents are written to this .npy file")
+tf.flags.DEFINE_boolean("extended_metrics", False,
+                        "also report nDCG@k, propensity scored P@k and nDCG@k and coverage@k (default: False)")
 
 tf.flags.DEFINE_boolean("allow_soft_placement", True, "Allow device soft device placement")
 tf.flags.DEFINE_boolean("log_device_placement", False, "Log placement of ops on devices")
@@ -30,19 +35,15 @@ print("")
 
 data_dir = FLAGS.data_dir
 
-_, _, test_text = load_pickle(
-    os.path.join(data_dir, "text_split.pkl"))
-_, _, y_id_test = load_pickle(
-    os.path.join(data_dir, "labels_id_split.pkl"))
+test_text = load_split(data_dir, 'text', 'test')
+y_id_train, y_id_test = load_splits(data_dir, 'labels_id', ['train', 'test'])
+if FLAGS.use_node_embedding:
+    node_ids_test = load_split(data_dir, 'node_ids', 'test')
 
-_, _, node_ids_test = load_pickle(
-    os.path.join(data_dir, "node_ids_split.pkl"))
 
+vocab = Vocabulary.restore(os.path.join(data_dir, "vocab.json"))
 
-vocab_path = os.path.join(data_dir, "vocab")
-vocab_processor = learn.preprocessing.VocabularyProcessor.restore(vocab_path)
-
-X = vocab_processor.transform(test_text)
+X = vocab.transform(test_text)
 
 checkpoint_file = tf.train.latest_checkpoint(FLAGS.checkpoint_dir)
 
@@ -63,38 +64,66 @@ with graph.as_default():
             dropout_keep_prob = graph.get_operation_by_name("kim_cnn/dropout_keep_prob").outputs[0]
             input_node_ids = graph.get_operation_by_name("combined/input_node_ids").outputs[0]
 
-            label_scores = graph.get_operation_by_name("combined/output/scores").outputs[0]
+            output_scope = "combined/output"
         else:
             input_x = graph.get_operation_by_name("input_x").outputs[0]
             dropout_keep_prob = graph.get_operation_by_name("dropout_keep_prob").outputs[0]
-            
-            label_scores = graph.get_operation_by_name("output/scores").outputs[0]
+
+            output_scope = "output"
+
+        label_scores = graph.get_operation_by_name(output_scope + "/scores").outputs[0]
+        try:
+            label_top_k_indices = graph.get_operation_by_name(output_scope + "/top_k_indices").outputs[0]
+        except KeyError:  # models trained before the top k ops were added
+            label_top_k_indices = None
     
         # Generate batches for one epoch
         if FLAGS.use_node_embedding:
-            input_data = list(zip(list(X), list(node_ids_test)))
+            input_data = {'x': X, 'y': y_id_test, 'node_ids': node_ids_test}
         else:
-            input_data = list(X)
-        batches = batch_iter(input_data, FLAGS.batch_size, 1, shuffle=False)
-
-        # Collect the predictions here
+            input_data = {'x': X, 'y': y_id_test}
+        batches = dict_batch_iter(input_data, FLAGS.batch_size, 1, shuffle=False)
+
+        ks = [1, 3, 5]
+        num_classes = label_scores.get_shape().as_list()[1]
+        inv_propensities = None
+        if FLAGS.extended_metrics:
+            # label propensities are estimated on the training labels
+            inv_propensities = inverse_label_propensities(y_id_train, num_classes)
+        metrics = RankingMetrics(ks, inv_propensities)
+
+        # only the top labels are fetched if the graph has enough of them
+        fetch_top_k = (label_top_k_indices is not None and not FLAGS.scores_path and
+                       label_top_k_indices.get_shape().as_list()[1] >= min(max(ks), num_classes))
+
+        # each batch is reduced to its top labels right away,
+        # the full scores are only kept (on disk) if asked for
         all_label_scores = None
-        for x_test_batch in tqdm(batches):
+        if FLAGS.scores_path:
+            all_label_scores = np.lib.format.open_memmap(
+                FLAGS.scores_path, mode='w+', dtype=np.float32, shape=(len(X), num_classes))
+
+        start_index = 0
+        for batch in tqdm(batches):
+            feed_dict = {input_x: batch['x'], dropout_keep_prob: 1.0}
             if FLAGS.use_node_embedding:
-                text_batch, node_ids_batch = zip(*x_test_batch)
-                label_score_values = sess.run(
-                    label_scores,
-                    {input_x: text_batch, input_node_ids: node_ids_batch, dropout_keep_prob: 1.0})
-            else:
-                label_score_values = sess.run(
-                    label_scores, {input_x: x_test_batch, dropout_keep_prob: 1.0})
+                feed_dict[input_node_ids] = batch['node_ids']
 
-            if all_label_scores is not None:
-                all_label_scores = np.concatenate([all_label_scores, label_score_values])
+            if fetch_top_k:
+                top = sess.run(label_top_k_indices, feed_dict)
             else:
-                all_label_scores = label_score_values
+                label_score_values = sess.run(label_scores, feed_dict)
+                if all_label_scores is not None:
+                    all_label_scores[start_index:start_index + len(label_score_values)] = label_score_values
+                top = top_k_indices(label_score_values, max(ks))
+            start_index += len(top)
+
+            metrics.update(top, batch['y'])
 
-        precisions = precision_at_ks(all_label_scores, y_id_test, ks=[1, 3, 5])
+        if all_label_scores is not None:
+            all_label_scores.flush()
+            print('scores written to', FLAGS.scores_path)
 
-    for k, p in zip([1, 3, 5], precisions):
-        print('p@{}: {:.5f}'.format(k, p))
+    for name, value in metrics.result().items():
+        if FLAGS.extended_metrics or name.startswith('p@'):
+            print('{}: {:.5f}'.format(name, value))
@@ -0,0 +1,105 @@
+# coding: utf-8
+"""
+export a trained KimCNN or Combined checkpoint to a single frozen inference graph (.pb):
+
+- the variables become constants
+- only the nodes needed for the scores and the top k labels are kept
+  (no optimizer slots, summaries, losses, label placeholders or NCE weights)
+- dropout_keep_prob becomes a constant 1.0, so it does not need to be fed
+
+inputs: `input_x` (and `combined/input_node_ids`), outputs: `output/scores`,
+`output/top_k_values` and `output/top_k_indices` (under `combined/` for Combined)
+
+load it with `tf_helpers.load_frozen_graph` or `inference_helpers.Predictor`
+"""
+
+import os
+import time
+import tensorflow as tf
+
+from tf_helpers import freeze_graph, replace_placeholder_with_constant, load_frozen_graph
+
+
+tf.flags.DEFINE_string("checkpoint_dir", "", "Checkpoint directory from training run")
+tf.flags.DEFINE_string("output_path", "", "path of the frozen graph (default: checkpoint_dir/frozen_model.pb)")
+tf.flags.DEFINE_boolean('use_node_embedding', False, 'the checkpoint is a Combined model or not')
+tf.flags.DEFINE_integer("top_k", 0,
+                        "number of best labels output by the top k nodes, "
+                        "0 keeps the top k of the checkpoint (default: 0)")
+tf.flags.DEFINE_boolean("fold_constants", True,
+                        "fold the constant parts of the graph if the graph transform tool is available "
+                        "(default: True)")
+
+FLAGS = tf.flags.FLAGS
+FLAGS._parse_flags()
+print("\nParameters:")
+for attr, value in sorted(FLAGS.__flags.items()):
+    print("{}={}".format(attr.upper(), value))
+print("")
+
+if FLAGS.use_node_embedding:
+    input_names = ["kim_cnn/input_x", "combined/input_node_ids"]
+    dropout_keep_prob_name = "kim_cnn/dropout_keep_prob"
+    output_scope = "combined/output"
+else:
+    input_names = ["input_x"]
+    dropout_keep_prob_name = "dropout_keep_prob"
+    output_scope = "output"
+
+output_path = FLAGS.output_path or os.path.join(FLAGS.checkpoint_dir, 'frozen_model.pb')
+checkpoint_file = tf.train.latest_checkpoint(FLAGS.checkpoint_dir)
+
+start = time.time()
+graph = tf.Graph()
+with graph.as_default():
+    sess = tf.Session()
+    saver = tf.train.import_meta_graph("{}.meta".format(checkpoint_file), clear_devices=True)
+    saver.restore(sess, checkpoint_file)
+print('checkpoint restored in {:.2f}s, {} nodes'.format(
+    time.time() - start, len(graph.as_graph_def().node)))
+
+scores = graph.get_operation_by_name(output_scope + "/scores").outputs[0]
+try:
+    graph.get_operation_by_name(output_scope + "/top_k_indices")
+    has_top_k = True
+except KeyError:  # models trained before the top k ops were added
+    has_top_k = False
+
+if FLAGS.top_k > 0 or not has_top_k:
+    # new top k nodes, they are renamed to output_scope/top_k_* after freezing
+    k = min(FLAGS.top_k or 10, scores.get_shape().as_list()[1])
+    with graph.as_default(), tf.name_scope('export'):
+        top_k_values, top_k_indices = tf.nn.top_k(scores, k=k, sorted=True)
+        tf.identity(top_k_values, name="top_k_values")
+        tf.identity(top_k_indices, name="top_k_indices")
+    top_k_scope = "export"
+else:
+    top_k_scope = output_scope
+
+output_names = [output_scope + "/scores",
+                top_k_scope + "/top_k_values",
+                top_k_scope + "/top_k_indices"]
+graph_def = freeze_graph(sess, output_names)
+
+for node in graph_def.node:
+    if node.name.startswith("export/top_k_"):
+        node.name = node.name.replace("export/", output_scope + "/")
+output_names = [name.replace("export/", output_scope + "/") for name in output_names]
+
+replace_placeholder_with_constant(graph_def, dropout_keep_prob_name, 1.0)
+
+if FLAGS.fold_constants:
+    try:
+        from tensorflow.tools.graph_transforms import TransformGraph
+        graph_def = TransformGraph(graph_def, input_names, output_names,
+                                   ['fold_constants(ignore_errors=true)'])
+    except ImportError:
+        print('graph transform tool not available, constants are not folded')
+
+with tf.gfile.GFile(output_path, 'wb') as f:
+    f.write(graph_def.SerializeToString())
+print('{} nodes written to {}'.format(len(graph_def.node), output_path))
+
+start = time.time()
+load_frozen_graph(output_path)
+print('frozen graph loaded in {:.2f}s'.format(time.time() - start))
@@ -1,7 +1,6 @@
 # coding: utf-8
 
 # supprese warning
-import pickle as pkl
 import numpy as np
 import tensorflow as tf
 import os
@@ -15,12 +14,15 @@ warnings.warn = warn
 
 from fastxml import Trainer, Inferencer
 
-from eval_helpers import precision_at_ks
+from eval_helpers import ranking_metrics, inverse_label_propensities
+from dataset_helpers import load_splits
 
 
 tf.flags.DEFINE_string('data_dir', 'data/datascience/', 'directory of dataset')
 tf.flags.DEFINE_integer('n_trees', 32, 'number of forests')
 tf.flags.DEFINE_boolean('eval', False, "whether evaluate on test or not")
+tf.flags.DEFINE_boolean('extended_metrics', False,
+                        'also report nDCG@k, propensity scored P@k and nDCG@k and coverage@k (default: False)')
 
 FLAGS = tf.flags.FLAGS
 FLAGS._parse_flags()
@@ -28,8 +30,8 @@ FLAGS._parse_flags()
 data_dir = FLAGS.data_dir
 
 # load train/test data
-x_train, x_dev, x_test = pkl.load(open(os.path.join(data_dir, "tfidf_split.pkl"), 'rb'))
-y_train, y_dev, y_test = pkl.load(open(os.path.join(data_dir, "labels_id_split.pkl"), 'rb'))
+x_train, x_dev, x_test = load_splits(data_dir, 'tfidf')
+y_train, y_dev, y_test = load_splits(data_dir, 'labels_id')
 
 # convert dtype to be compatible with fastxml
 x_train.data = np.asarray(x_train.data, dtype=np.float32)
@@ -42,7 +44,7 @@ model_path = os.path.join(data_dir, 'fastxml.model')
 if not FLAGS.eval:
     print("training...")
     trainer = Trainer(n_trees=FLAGS.n_trees, n_jobs=-1)
-    trainer.fit(list(x_train), y_train)
+    trainer.fit(list(x_train), y_train.tolist())
     trainer.save(model_path)
 
 clf = Inferencer(model_path)
@@ -54,12 +56,19 @@ print("fastxml:")
 if not FLAGS.eval:
     print('validating...')
     pred = clf.predict(x_dev)
-    precs = precision_at_ks(pred, y_dev, ks=ks)
+    y_true = y_dev
 else:
     print('testing...')
     pred = clf.predict(x_test)
-    precs = precision_at_ks(pred, y_test, ks=ks)
+    y_true = y_test
+
+inv_propensities = None
+if FLAGS.extended_metrics:
+    # label propensities are estimated on the training labels
+    inv_propensities = inverse_label_propensities(y_train, pred.shape[1])
+metrics = ranking_metrics(pred, y_true, ks=ks, inv_propensities=inv_propensities)
 
 print("{} result".format("Test" if FLAGS.eval else "Dev"))
-for p, k in zip(precs, ks):
-    print("p@{}: {:.2f}".format(k, p))
+for name, value in metrics.items():
+    if FLAGS.extended_metrics or name.startswith('p@'):
+        print("{}: {:.2f}".format(name, value))
@@ -0,0 +1,254 @@
+import numpy as np
+import pandas as pd
+
+from scipy import sparse as sp
+from scipy.sparse.csgraph import connected_components
+
+
+QUESTION = 1
+
+
+def question_user_matrix(df):
+    """
+    build the question-user bi-partite adjacency matrix from the posts
+
+    a question is associated with the users who authored either the question or its answers,
+    a user is identified by OwnerUserId, or by OwnerDisplayName if the id is missing
+
+    Args:
+
+    df: DataFrame of posts.csv
+
+    Returns:
+
+    m: csr_matrix of shape (#questions, #users), row->question, column->user
+    question_ids: ndarray of int, the question id of each row,
+        questions are ordered by their first appearance in `df`
+    """
+    post_type = df['PostTypeId'].values
+    parent_id = df['ParentId'].values.astype(np.float64)
+    question_id = np.where(post_type == QUESTION,
+                           df['Id'].values.astype(np.float64),
+                           parent_id)
+    with np.errstate(invalid='ignore'):  # nan ParentId
+        has_question = (post_type == QUESTION) | (parent_id > 0)
+    has_question &= (question_id != 0)
+
+    user_id = df['OwnerUserId'].values.astype(np.float64)
+    has_user_id = ~np.isnan(user_id)
+    user_name = df['OwnerDisplayName']
+    if pd.api.types.is_numeric_dtype(user_name):  # all missing, or parsed as numbers
+        has_user_name = np.zeros(len(df), dtype=bool)
+    else:
+        has_user_name = user_name.notnull().values & ~has_user_id
+
+    # encode user ids and user names into one code space
+    user_code = np.full(len(df), -1, dtype=np.int64)
+    id_codes, id_uniques = pd.factorize(user_id[has_user_id].astype(np.int64))
+    user_code[has_user_id] = id_codes
+    name_codes, _ = pd.factorize(user_name.values[has_user_name])
+    user_code[has_user_name] = name_codes + len(id_uniques)
+
+    keep = has_question & (user_code >= 0)
+    row_idx, question_ids = pd.factorize(question_id[keep].astype(np.int64))
+    col_idx = user_code[keep]
+    n_users = len(id_uniques) + (name_codes.max() + 1 if len(name_codes) else 0)
+
+    m = sp.csr_matrix((np.ones(len(row_idx)), (row_idx, col_idx)),
+                      shape=(len(question_ids), n_users))
+    m.data[:] = 1  # a user answering several times counts once
+    return m, np.asarray(question_ids)
+
+
+def cap_user_degree(m, max_user_degree, seed=None):
+    """
+    keep at most `max_user_degree` questions per user, sampled uniformly
+
+    a user with degree d adds a dense d x d block to the unipartite projection,
+    capping the degree of the hub users bounds the size of that block
+
+    Args:
+
+    m: csr_matrix, question-user matrix
+    max_user_degree: int
+    seed: int, random seed
+
+    Returns:
+
+    csr_matrix of the same shape
+    """
+    m = m.tocsc()
+    m.sort_indices()
+    user_degree = np.diff(m.indptr)
+    if len(user_degree) == 0 or user_degree.max() <= max_user_degree:
+        return m.tocsr()
+
+    # rank the entries of each column in random order
+    users = np.repeat(np.arange(m.shape[1]), user_degree)
+    rng = np.random.RandomState(seed)
+    order = np.lexsort((rng.rand(m.nnz), users))
+    rank = np.empty(m.nnz, dtype=np.int64)
+    rank[order] = np.arange(m.nnz) - m.indptr[users[order]]
+
+    keep = rank < max_user_degree
+    indptr = np.r_[0, np.cumsum(np.minimum(user_degree, max_user_degree))]
+    return sp.csc_matrix((m.data[keep], m.indices[keep], indptr), shape=m.shape).tocsr()
+
+
+def iter_projection_blocks(m, max_block_size):
+    """
+    compute the unipartite projection m * m.T block by block of rows
+
+    the rows are grouped so that computing a block involves at most `max_block_size`
+    question-question co-occurrences (a single row exceeding it forms its own block),
+    so the memory does not depend on the size of the full projection
+
+    Args:
+
+    m: csr_matrix, question-user matrix
+    max_block_size: int
+
+    Returns:
+
+    generator of (int, csr_matrix), the index of the first row and the block
+    """
+    m = m.tocsr()
+    mt = m.T.tocsr()
+    user_degree = np.diff(mt.indptr)
+    # number of co-occurrences generated by each row
+    cost = np.cumsum(m.dot(user_degree.astype(np.float64)))
+
+    start = 0
+    while start < m.shape[0]:
+        offset = cost[start - 1] if start > 0 else 0
+        end = max(np.searchsorted(cost, offset + max_block_size, side='right'), start + 1)
+        yield start, m[start:end] * mt
+        start = end
+
+
+def pattern(m):
+    """the sparsity pattern of `m` as a csr_matrix of int8 ones"""
+    m = m.tocsr()
+    return sp.csr_matrix((np.ones(m.nnz, dtype=np.int8), m.indices, m.indptr), shape=m.shape)
+
+
+def largest_component(adj):
+    """
+    Args:
+
+    adj: csr_matrix, symmetric adjacency matrix
+
+    Returns:
+
+    ndarray of int, the sorted nodes of the largest connected component
+    """
+    _, labels = connected_components(adj, directed=False)
+    return np.flatnonzero(labels == np.argmax(np.bincount(labels)))
+
+
+def subgraph(adj, nodes):
+    """the adjacency matrix induced by `nodes`, re-indexed as 0..len(nodes)-1"""
+    return adj[nodes][:, nodes].tocsr()
+
+
+def save_graph(path, adj, question_ids):
+    """
+    save the question graph,
+    `path` ending with .gt uses graph_tool, otherwise an .npz holding the csr arrays
+
+    Args:
+
+    path: str
+    adj: csr_matrix, adjacency matrix of the graph
+    question_ids: ndarray of int, the question id of each node
+    """
+    if path.endswith('.gt'):
+        from graph_tool import Graph
+
+        g = Graph()
+        g.add_vertex(adj.shape[0])
+        g.add_edge_list(np.column_stack(adj.nonzero()))
+        prop_question_id = g.new_vertex_property('int')
+        prop_question_id.a = question_ids
+        g.vertex_properties['question_id'] = prop_question_id
+        g.save(path)
+    else:
+        adj = adj.tocsr()
+        np.savez(path, data=adj.data, indices=adj.indices, indptr=adj.indptr,
+                 shape=adj.shape, question_id=question_ids)
+
+
+def load_graph(path):
+    """
+    load the question graph saved by `save_graph`
+
+    Returns:
+
+    adj: csr_matrix, adjacency matrix of the graph
+    question_ids: ndarray of int, the question id of each node
+    """
+    if path.endswith('.gt'):
+        from graph_tool import load_graph as load_gt_graph
+
+        g = load_gt_graph(path)
+        edges = g.get_edges()
+        n = g.num_vertices()
+        adj = sp.csr_matrix((np.ones(len(edges), dtype=np.int8), (edges[:, 0], edges[:, 1])),
+                            shape=(n, n))
+        return adj, np.array(g.vertex_properties['question_id'].a)
+    else:
+        f = np.load(path)
+        adj = sp.csr_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+        return adj, f['question_id']
+
+
+def walk_start_nodes(n, num_vertices, rng=np.random):
+    """
+    the start nodes of `n` random walks:
+    every node once in each full round, then a sample without replacement for the remainder
+
+    Returns:
+
+    ndarray of int, of length n
+    """
+    rounds = [np.tile(np.arange(num_vertices), n // num_vertices)]
+    if n % num_vertices > 0:
+        rounds.append(rng.choice(num_vertices, n % num_vertices, replace=False))
+    return np.concatenate(rounds)
+
+
+def random_walks(adj, start_nodes, walk_length, alpha=0.05, rng=np.random):
+    """
+    random walks with restart on unweighted graph,
+    all the walkers advance by one step at a time
+
+    Args:
+
+    adj: csr_matrix, adjacency matrix
+    start_nodes: array of int, one walk per start node
+    walk_length: int, number of steps
+    alpha: proba of restart
+    rng: np.random.RandomState
+
+    Returns:
+
+    ndarray of int32, shape (len(start_nodes), walk_length + 1)
+    """
+    start_nodes = np.asarray(start_nodes, dtype=np.int64)
+    indptr, indices = adj.indptr, adj.indices
+    degree = np.diff(indptr)
+    n = len(start_nodes)
+
+    walks = np.empty((n, walk_length + 1), dtype=np.int32)
+    walks[:, 0] = current = start_nodes
+    for i in range(1, walk_length + 1):
+        d = degree[current]
+        # pick a neighbour uniformly, nodes without neighbours stay put
+        pos = indptr[current] + (rng.random_sample(n) * d).astype(np.int64)
+        neighbours = indices[np.minimum(pos, len(indices) - 1)] if len(indices) else current
+        current = np.where(d > 0, neighbours, current)
+
+        restart = rng.random_sample(n) <= alpha
+        current = np.where(restart, start_nodes, current)
+        walks[:, i] = current
+    return walks
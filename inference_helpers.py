@@ -0,0 +1,158 @@
+"""
+tag prediction for new posts with a trained KimCNN checkpoint
+"""
+import time
+import queue
+import threading
+import numpy as np
+import tensorflow as tf
+
+from data_helpers import load_pickle, normalize_text
+from eval_helpers import top_k_indices
+from tf_helpers import load_frozen_graph
+from vocab_helpers import Vocabulary
+
+
+class Predictor():
+    """
+    restores a KimCNN checkpoint, its vocabulary and label encoder once
+    and predicts the top k tags of raw posts (html or text)
+
+    Args:
+    model_path: a frozen graph (.pb) written by export_model.py, which loads much faster,
+    or a directory of checkpoints, the latest one is restored
+    vocab_path: the vocabulary saved by kim_cnn_experiment.py (data_dir/vocab.json)
+    label_encoder_path: the `MultiLabelIntegerEncoder` dumped by process_train_dev_test.py
+    """
+    def __init__(self, model_path, vocab_path, label_encoder_path, top_k=5,
+                 session_config=None):
+        self.top_k = top_k
+        self.vocab = Vocabulary.restore(vocab_path)
+
+        label_encoder = load_pickle(label_encoder_path)
+        self.id2label = label_encoder.id2label_
+        self.unk_id = label_encoder.UNK
+
+        if model_path.endswith('.pb'):
+            self.graph = load_frozen_graph(model_path)
+            self.sess = tf.Session(graph=self.graph, config=session_config)
+        else:
+            checkpoint_file = tf.train.latest_checkpoint(model_path)
+            self.graph = tf.Graph()
+            with self.graph.as_default():
+                self.sess = tf.Session(config=session_config)
+                saver = tf.train.import_meta_graph("{}.meta".format(checkpoint_file))
+                saver.restore(self.sess, checkpoint_file)
+
+        self.input_x = self.graph.get_operation_by_name("input_x").outputs[0]
+        self.dropout_keep_prob = self.graph.get_operation_by_name("dropout_keep_prob").outputs[0]
+        self.scores = self.graph.get_operation_by_name("output/scores").outputs[0]
+        try:
+            self.top_k_values = self.graph.get_operation_by_name("output/top_k_values").outputs[0]
+            self.top_k_indices = self.graph.get_operation_by_name("output/top_k_indices").outputs[0]
+        except KeyError:  # models trained before the top k ops were added
+            self.top_k_values = self.top_k_indices = None
+
+    def transform(self, texts):
+        """normalize the raw posts like process_posts.py and map them to word ids"""
+        return self.vocab.transform([normalize_text(text) for text in texts])
+
+    def predict(self, texts):
+        """
+        Args:
+        texts: list of str, raw posts
+
+        Returns:
+        list of list of (tag, score), the top k tags of each post in decreasing order of score
+        """
+        feed_dict = {self.input_x: self.transform(texts), self.dropout_keep_prob: 1.0}
+
+        # one more label in case the UNK label is among the best ones
+        k = self.top_k + 1
+        if self.top_k_indices is not None and self.top_k_indices.get_shape().as_list()[1] >= k:
+            values, indices = self.sess.run([self.top_k_values, self.top_k_indices], feed_dict)
+        else:
+            scores = self.sess.run(self.scores, feed_dict)
+            indices = top_k_indices(scores, k)
+            values = scores[np.arange(len(scores))[:, None], indices]
+
+        return [[(self.id2label[i], float(v))
+                 for i, v in zip(row_indices, row_values) if i != self.unk_id][:self.top_k]
+                for row_indices, row_values in zip(indices, values)]
+
+
+class _Request():
+    def __init__(self, item):
+        self.item = item
+        self.result = None
+        self.exception = None
+        self.done = threading.Event()
+
+
+class MicroBatcher():
+    """
+    groups the items submitted by concurrent callers into batches for `predict_batch`,
+    a batch is run once it has `max_batch_size` items
+    or `max_latency` seconds after its first item arrived,
+    if it fails its items are run one by one so that a bad item only fails its own caller
+
+    Args:
+    predict_batch: function from a list of items to the list of their results
+    """
+    def __init__(self, predict_batch, max_batch_size=64, max_latency=0.01):
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.num_batches = 0
+        self.num_items = 0
+
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def predict(self, items):
+        """the results of `items`, blocks until they are computed"""
+        requests = [_Request(item) for item in items]
+        for request in requests:
+            self.queue.put(request)
+        for request in requests:
+            request.done.wait()
+            if request.exception is not None:
+                raise request.exception
+        return [request.result for request in requests]
+
+    def _next_batch(self):
+        requests = [self.queue.get()]
+        deadline = time.time() + self.max_latency
+        while len(requests) < self.max_batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                requests.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return requests
+
+    def _predict(self, requests):
+        try:
+            results = self.predict_batch([request.item for request in requests])
+            for request, result in zip(requests, results):
+                request.result = result
+        except Exception as e:
+            if len(requests) == 1:
+                requests[0].exception = e
+                return
+            # one bad item fails the whole batch, so only its own request gets the error
+            for request in requests:
+                self._predict([request])
+
+    def _run(self):
+        while True:
+            requests = self._next_batch()
+            self._predict(requests)
+            self.num_batches += 1
+            self.num_items += len(requests)
+            for request in requests:
+                request.done.set()
@@ -13,12 +13,15 @@ class KimCNN():
     """
     A CNN for text classification.
     Uses an embedding layer, followed by a convolutional, max-pooling and softmax layer.
+
+    sequence_length=None accepts batches of any length (e.g. from `bucket_batch_iter`)
     """
     def __init__(
             self, sequence_length, num_classes, vocab_size,
             embedding_size, filter_sizes, num_filters, l2_reg_lambda=0.0,
             loss_function='softmax',
-            redefine_output_layer=False):
+            redefine_output_layer=False,
+            top_k=10):
 
         self.sequence_length = sequence_length
         self.num_classes = num_classes
@@ -28,20 +31,23 @@ class KimCNN():
         self.num_filters          = num_filters
         self.l2_reg_lambda        = l2_reg_lambda
         self.loss_function        = loss_function 
+        self.top_k                = min(top_k, num_classes)
         
         # Placeholders for input, output and dropout
         self.input_x = tf.placeholder(
             tf.int32, [None, self.sequence_length], name="input_x")
 
-        # label indicator matrix
-        self.input_y_binary = tf.placeholder(
-            tf.float32, [None, self.num_classes], name="input_y_binary")
-
         # label list, a SparseTensor because label list length varies
         self.input_y_labels = tf.sparse_placeholder(
             tf.int32, shape=[None, self.num_classes],
             name='input_y_labels')
 
+        # label indicator matrix, built from the label list in the graph unless it is fed,
+        # so no dense label matrix has to be kept or fed
+        self.input_y_binary = tf.placeholder_with_default(
+            tf.to_float(tf.sparse_to_indicator(self.input_y_labels, self.num_classes)),
+            [None, self.num_classes], name="input_y_binary")
+
         self.dropout_keep_prob = tf.placeholder(tf.float32, name="dropout_keep_prob")
 
         # Keeping track of l2 regularization loss (optional)
@@ -85,12 +91,17 @@ class KimCNN():
                 h = tf.nn.relu(tf.nn.bias_add(conv, b), name="relu")
                 # Maxpooling over the outputs
                 # dim still 4d
-                pooled = tf.nn.max_pool(
-                    h,
-                    ksize=[1, self.sequence_length - filter_size + 1, 1, 1],
-                    strides=[1, 1, 1, 1],
-                    padding='VALID',
-                    name="pool")
+                if self.sequence_length is None:
+                    # the length varies between batches (at least the largest filter size),
+                    # so pool over the whole time axis
+                    pooled = tf.reduce_max(h, axis=1, keep_dims=True, name="pool")
+                else:
+                    pooled = tf.nn.max_pool(
+                        h,
+                        ksize=[1, self.sequence_length - filter_size + 1, 1, 1],
+                        strides=[1, 1, 1, 1],
+                        padding='VALID',
+                        name="pool")
                 pooled_outputs.append(pooled)
 
         # Combine all the pooled features
@@ -116,6 +127,11 @@ class KimCNN():
             self.scores = tf.nn.xw_plus_b(self.h_drop, W, b, name="scores")
             self.predictions = tf.argmax(self.scores, 1, name="predictions")
 
+            # the best labels only, so callers do not need to fetch all the scores
+            top_k_values, top_k_indices = tf.nn.top_k(self.scores, k=self.top_k, sorted=True)
+            self.top_k_values = tf.identity(top_k_values, name="top_k_values")
+            self.top_k_indices = tf.identity(top_k_indices, name="top_k_indices")
+
     def add_loss(self):
         # CalculateMean cross-entropy loss
         with tf.name_scope("loss"):
@@ -1,15 +1,16 @@
 # coding: utf-8
 
 import os
-import numpy as np
+import time
 import tensorflow as tf
 import datetime
 
-from tensorflow.contrib import learn
-
 from kim_cnn import KimCNN
+from vocab_helpers import load_token_ids
 from eval_helpers import label_lists_to_sparse_tuple
-from data_helpers import batch_iter, load_pickle
+from data_helpers import dict_batch_iter, bucket_batch_iter, Prefetcher
+from dataset_helpers import load_split, load_splits
+from tf_helpers import ChunkedEvaluator
 
 
 tf.flags.DEFINE_string('data_dir', '', 'directory of dataset')
@@ -18,10 +19,18 @@ tf.flags.DEFINE_integer('tag_freq_threshold', 5, 'minimum frequency of a tag')
 tf.flags.DEFINE_float("dev_sample_percentage", .1, "Percentage of the training data to use for validation")
 tf.flags.DEFINE_float("max_document_length", 2000,
                       "Maximum length of document, exceeding part is truncated")
+tf.flags.DEFINE_integer("min_word_frequency", 0,
+                        "Words occurring less often in the training text are out of vocabulary (default: 0)")
+tf.flags.DEFINE_integer("max_vocab_size", 0, "Maximum number of words in the vocabulary, 0 keeps all (default: 0)")
+tf.flags.DEFINE_integer("n_jobs", 1, "Number of processes mapping the texts to word ids, <= 0 uses all cores (default: 1)")
+tf.flags.DEFINE_boolean("token_cache", True,
+                        "Cache the word ids of the splits under data_dir/token_cache, "
+                        "keyed by the text split and the vocabulary parameters (default: True)")
 
 # Architecutural parameters
 
 tf.flags.DEFINE_string("loss_function", 'sigmoid', "loss function: (softmax|sigmoid) (Default: sigmoid)")
+tf.flags.DEFINE_integer("top_k", 10, "Number of best labels output by the output/top_k_* ops (default: 10)")
 
 # Model Hyperparameters
 tf.flags.DEFINE_integer("embedding_dim", 128, "Dimensionality of character embedding (default: 128)")
@@ -32,10 +41,22 @@ tf.flags.DEFINE_float("l2_reg_lambda", 0.0, "L2 regularization lambda (default:
 
 # Training parameters
 tf.flags.DEFINE_integer("batch_size", 64, "Batch Size (default: 64)")
+tf.flags.DEFINE_boolean("bucket_batches", False,
+                        "Batch documents of similar lengths and pad them to the longest one of the batch "
+                        "instead of max_document_length (default: False)")
+tf.flags.DEFINE_integer("bucket_pool_batches", 100,
+                        "Number of batches sorted by length together when bucket_batches is on (default: 100)")
 tf.flags.DEFINE_integer("num_epochs", 200, "Number of training epochs (default: 200)")
 tf.flags.DEFINE_integer("evaluate_every", 100, "Evaluate model on dev set after this many steps (default: 100)")
+tf.flags.DEFINE_integer("dev_batch_size", 0,
+                        "Batch size of the dev set evaluation, 0 evaluates it at once (default: 0)")
+tf.flags.DEFINE_boolean("background_eval", False,
+                        "Evaluate a copy of the weights in a background thread while training goes on "
+                        "(default: False)")
 tf.flags.DEFINE_integer("checkpoint_every", 100, "Save model after this many steps (default: 100)")
 tf.flags.DEFINE_integer("num_checkpoints", 1, "Number of checkpoints to store (default: 1)")  # our storage quota is low
+tf.flags.DEFINE_integer("prefetch_batches", 0,
+                        "Number of batches prepared ahead in a background thread, 0 disables it (default: 0)")
 
 # Misc Parameters
 tf.flags.DEFINE_boolean("allow_soft_placement", True, "Allow device soft device placement")
@@ -55,21 +76,29 @@ print('dataset_id:', dataset_id)
 
 # load data
 # ===============================================
-train_text, dev_text, _ = load_pickle(
-    os.path.join(data_dir, "text_split.pkl"))
-y_id_train, y_id_dev, _ = load_pickle(
-    os.path.join(data_dir, "labels_id_split.pkl"))
-y_binary_train, y_binary_dev, _ = load_pickle(
-    os.path.join(data_dir, "labels_binary_split.pkl"))
+y_id_train, y_id_dev = load_splits(data_dir, 'labels_id', ['train', 'dev'])
+# only used for the number of classes, the labels are fed as id lists
+y_binary_train = load_split(data_dir, 'labels_binary', 'train')
 
 # preprocessing text documents
 # ===============================================
-vocab_processor = learn.preprocessing.VocabularyProcessor(FLAGS.max_document_length)
-x_train = np.array(list(vocab_processor.fit_transform(train_text)))
-x_dev = np.array(list(vocab_processor.transform(dev_text)))
+vocab, x_split, lengths_split = load_token_ids(
+    data_dir, FLAGS.max_document_length, FLAGS.min_word_frequency, FLAGS.max_vocab_size or None,
+    n_jobs=FLAGS.n_jobs, use_cache=FLAGS.token_cache)
+x_train, x_dev = x_split['train'], x_split['dev']
+train_lengths, dev_lengths = lengths_split['train'], lengths_split['dev']
+print("vocabulary size: {:d}".format(len(vocab)))
 
 print("Train/Dev split: {:d}/{:d}".format(len(x_train), len(x_dev)))
 
+filter_sizes = list(map(int, FLAGS.filter_sizes.split(",")))
+if FLAGS.bucket_batches:
+    # the documents are at least as long as the largest filter
+    min_length = max(filter_sizes)
+    # the dev set is fed at once, so it is padded to its longest document
+    x_dev = x_dev[:, :max(dev_lengths.max(), min_length)]
+    print("mean document length: {:.1f}".format(train_lengths.mean()))
+
 num_classes = y_binary_train.shape[1]
 print("num of classes: {:d}".format(num_classes))
 
@@ -84,14 +113,15 @@ with tf.Graph().as_default():
     sess = tf.Session(config=session_conf)
     with sess.as_default():
         cnn = KimCNN(
-            sequence_length=x_train.shape[1],
+            sequence_length=None if FLAGS.bucket_batches else x_train.shape[1],
             num_classes=num_classes,
-            vocab_size=len(vocab_processor.vocabulary_),
+            vocab_size=len(vocab),
             embedding_size=FLAGS.embedding_dim,
-            filter_sizes=list(map(int, FLAGS.filter_sizes.split(","))),
+            filter_sizes=filter_sizes,
             num_filters=FLAGS.num_filters,
             l2_reg_lambda=FLAGS.l2_reg_lambda,
-            loss_function=FLAGS.loss_function)
+            loss_function=FLAGS.loss_function,
+            top_k=FLAGS.top_k)
 
         # Define Training procedure
         global_step = tf.Variable(0, name="global_step", trainable=False)
@@ -133,8 +163,7 @@ with tf.Graph().as_default():
         train_summary_dir = os.path.join(out_dir, "summaries", "train")
         train_summary_writer = tf.summary.FileWriter(train_summary_dir, sess.graph)
 
-        # Dev summaries
-        dev_summary_op = tf.summary.merge([loss_summary, p1, p3, p5])
+        # Dev summaries, written by the evaluator
         dev_summary_dir = os.path.join(out_dir, "summaries", "dev")
         dev_summary_writer = tf.summary.FileWriter(dev_summary_dir, sess.graph)
 
@@ -146,22 +175,36 @@ with tf.Graph().as_default():
         saver = tf.train.Saver(tf.global_variables(), max_to_keep=FLAGS.num_checkpoints)
 
         # Write vocabulary
-        vocab_processor.save(os.path.join(data_dir, "vocab"))
+        vocab.save(os.path.join(data_dir, "vocab.json"))
+
+        # the dev feed dicts (and their sparse labels) are built once, not at every evaluation
+        dev_feed_dicts = [
+            ({cnn.input_x: batch['x'],
+              cnn.input_y_labels: label_lists_to_sparse_tuple(batch['y_id'], num_classes),
+              cnn.dropout_keep_prob: 1.0},
+             len(batch['x']))
+            for batch in dict_batch_iter({'x': x_dev, 'y_id': y_id_dev},
+                                         FLAGS.dev_batch_size or len(x_dev), 1, shuffle=False)]
+        dev_evaluator = ChunkedEvaluator(
+            sess, [('loss', cnn.loss), ('p1', cnn.p1), ('p3', cnn.p3), ('p5', cnn.p5)],
+            lambda: dev_feed_dicts, writer=dev_summary_writer,
+            background=FLAGS.background_eval, session_config=session_conf)
 
         # Initialize all variables
         sess.run(tf.global_variables_initializer())
 
-        def train_step(x_batch, y_binary_batch, y_batch_labels):
-            """
-            A single training step
-            """
-            feed_dict = {
-              cnn.input_x: x_batch,
-              cnn.input_y_binary: y_binary_batch,
+        def train_feed_dict(batch):
+            return {
+              cnn.input_x: batch['x'],
               cnn.input_y_labels: label_lists_to_sparse_tuple(
-                  y_batch_labels, num_classes),  # needs some conversion
+                  batch['y_id'], num_classes),  # needs some conversion
               cnn.dropout_keep_prob: FLAGS.dropout_keep_prob
             }
+
+        def train_step(feed_dict):
+            """
+            A single training step
+            """
             _, step, summaries, loss, p1, p3, p5 = sess.run(
                 [train_op, global_step, train_summary_op, cnn.loss, cnn.p1, cnn.p3, cnn.p5],
                 feed_dict)
@@ -170,41 +213,38 @@ with tf.Graph().as_default():
                 time_str, step, loss, p1, p3, p5))
             train_summary_writer.add_summary(summaries, step)
 
-        def dev_step(x_batch, y_binary_batch, y_batch_labels, writer=None):
-            """
-            Evaluates model on a dev set
-            """
-            feed_dict = {
-              cnn.input_x: x_batch,
-              cnn.input_y_binary: y_binary_batch,
-              cnn.input_y_labels: label_lists_to_sparse_tuple(
-                  y_batch_labels, num_classes),  # needs some conversion
-              cnn.dropout_keep_prob: 1.0
-            }
-            step, summaries, loss, p1, p3, p5 = sess.run(
-                [global_step, dev_summary_op, cnn.loss, cnn.p1, cnn.p3, cnn.p5],
-                feed_dict)
-            time_str = datetime.datetime.now().isoformat()
-            print("[DEV] {}: step {}, loss {:g}, p1 {:g}, p3 {:g}, p5 {:g}".format(
-                time_str, step, loss, p1, p3, p5))
-            if writer:
-                writer.add_summary(summaries, step)
-
         # Generate batches
-        batches = batch_iter(
-            list(zip(x_train, y_binary_train, y_id_train)), FLAGS.batch_size, FLAGS.num_epochs)
+        # the label indicator matrix is built from the label ids in the graph
+        train_data = {'x': x_train, 'y_id': y_id_train}
+        if FLAGS.bucket_batches:
+            batches = bucket_batch_iter(
+                train_data, train_lengths, FLAGS.batch_size, FLAGS.num_epochs,
+                min_length=min_length, pool_batches=FLAGS.bucket_pool_batches)
+        else:
+            batches = dict_batch_iter(train_data, FLAGS.batch_size, FLAGS.num_epochs)
+        # feed dicts are optionally prepared ahead in a background thread
+        train_feed_dicts = Prefetcher((train_feed_dict(batch) for batch in batches),
+                                      FLAGS.prefetch_batches)
         # Training loop. For each batch...
-        for batch in batches:
-            x_batch, y_binary_batch, y_id_batch = zip(*batch)
-            train_step(x_batch, y_binary_batch, y_id_batch)
+        num_examples, start_time = 0, time.time()
+        for feed_dict in train_feed_dicts:
+            train_step(feed_dict)
+            num_examples += len(feed_dict[cnn.input_x])
             current_step = tf.train.global_step(sess, global_step)
 
             if current_step % FLAGS.evaluate_every == 0:
+                print("\n{:.1f} examples/sec, input wait: {:.3f}s over the last {} steps".format(
+                    num_examples / (time.time() - start_time),
+                    train_feed_dicts.pop_wait_time(), FLAGS.evaluate_every))
                 print("\nEvaluation:")
-                dev_step(x_dev, y_binary_dev, y_id_dev, writer=dev_summary_writer)
+                dev_evaluator.evaluate(current_step)
                 print("")
+                num_examples, start_time = 0, time.time()
 
             if current_step % FLAGS.checkpoint_every == 0:
                 path = saver.save(sess, checkpoint_prefix, global_step=current_step)
                 print("Saved model checkpoint to {}\n".format(path))
 
+
+        # the last background evaluation
+        dev_evaluator.join()
@@ -1,9 +1,8 @@
 # coding: utf-8
 
-import itertools
-import os
+import numpy as np
 import tensorflow as tf
-from data_helpers import load_pickle
+from dataset_helpers import load_splits
 
 tf.flags.DEFINE_string('data_dir', 'data/datascience', 'directory of dataset')
 
@@ -16,12 +15,11 @@ for attr, value in sorted(FLAGS.__flags.items()):
 print("")
 
 data_dir = FLAGS.data_dir
-train, dev, test = load_pickle(os.path.join(data_dir,
-                                            "labels_id_split.pkl"))
+splits = load_splits(data_dir, 'labels_id')
 
+n_instances = sum(map(len, splits))
+labels = np.concatenate([split.values for split in splits])
 
-data = train + dev + test
-
-print('#instances: ', len(data))
-print('# unique labels: ', len(set(itertools.chain(*data))))
-print('avg labels per instance: ', sum(map(len, data)) / len(data))
+print('#instances: ', n_instances)
+print('# unique labels: ', len(np.unique(labels)))
+print('avg labels per instance: ', len(labels) / n_instances)
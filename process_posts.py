@@ -6,78 +6,133 @@ import pandas as pd
 import pickle as pkl
 import itertools
 import tensorflow as tf
-from data_helpers import strip_tags, clean_str
+from collections import Counter
+from data_helpers import normalize_texts
 
 
 tf.flags.DEFINE_string('data_dir', '', 'directory of dataset')
 tf.flags.DEFINE_integer('tag_freq_threshold', 0, 'minimum frequency of a tag')
+tf.flags.DEFINE_integer('chunk_size', 0,
+                        'number of rows of posts.csv to read at a time, 0 reads the whole file (default: 0)')
+tf.flags.DEFINE_integer('n_jobs', 1, 'number of processes to normalize the texts, <= 0 uses all cores (default: 1)')
 
 FLAGS = tf.flags.FLAGS
 FLAGS._parse_flags()
 
 data_dir = FLAGS.data_dir
 tag_freq_threshold = FLAGS.tag_freq_threshold
+chunk_size = FLAGS.chunk_size
 
 
 label_path = os.path.join(data_dir, "labels.csv")
 text_path = os.path.join(data_dir, "input_text.csv")
-df = pd.read_csv('{}/posts.csv'.format(data_dir), sep=',')
+posts_path = '{}/posts.csv'.format(data_dir)
 
+target_question_ids = set(pkl.load(open('{}/connected_question_ids.pkl'.format(data_dir), 'rb')))
 
-print("dataset containing {} records".format(df.shape[0]))
 
+# extract tags
+regexp = re.compile("<(.+?)>")
 
-target_question_ids = set(pkl.load(open('{}/connected_question_ids.pkl'.format(data_dir), 'rb')))
-id_target = df['Id'].apply(target_question_ids.__contains__)
 
+def extract_tags(s):
+    return regexp.findall(s)
 
-qs = df[id_target & (df['PostTypeId'] == 1)]  # we only consider questions here
 
-print("contains {} questions".format(qs.shape[0]))
+def select_questions(df):
+    """keep the questions in the largest connected component"""
+    id_target = df['Id'].apply(target_question_ids.__contains__)
+    return df[id_target & (df['PostTypeId'] == 1)]  # we only consider questions here
 
 
-# extract tags
-regexp = re.compile("<(.+?)>")
+def normalize_tags(qs, tags, tag_set):
+    """drop infrequent tags and return labels indexed by question id,
+    together with the mask of questions having at least one valid tag"""
+    normalized_tags = [[t for t in ts if t in tag_set] for ts in tags]
+    y = pd.Series(list(map(lambda l: ",".join(l), normalized_tags)), index=qs['Id'])
+    mask = (y.apply(len) > 0).values
+    return y, mask
 
 
-def extract_tags(s):
-    return regexp.findall(s)
+def make_input_text(qs):
+    # titles and bodies in a single call, so they share the process pool
+    texts = list(normalize_texts(itertools.chain(qs['Title'], qs['Body']), n_jobs=FLAGS.n_jobs))
+    title, body = texts[:len(qs)], texts[len(qs):]
+
+    # concatenate the texts
+    return pd.Series([' '.join(l) for l in list(zip(title, body))], index=qs['Id'])
+
+
+def print_tag_set_size(tag_set):
+    print('number of unique labels (frequency>{}): {}'.format(
+        tag_freq_threshold, len(tag_set)))
+
+
+if chunk_size > 0:
+    # streaming mode: peak memory is bounded by `chunk_size`
+    # 1st pass only reads the columns needed to count the tags
+    tag_freq = Counter()
+    n_records, n_questions = 0, 0
+    for df in pd.read_csv(posts_path, sep=',', chunksize=chunk_size,
+                          usecols=['Id', 'PostTypeId', 'Tags']):
+        n_records += df.shape[0]
+        qs = select_questions(df)
+        n_questions += qs.shape[0]
+        for ts in qs["Tags"].apply(extract_tags):
+            tag_freq.update(ts)
+
+    print("dataset containing {} records".format(n_records))
+    print("contains {} questions".format(n_questions))
 
-tags = qs["Tags"].apply(extract_tags).tolist()
+    tag_set = {t for t, c in tag_freq.items() if c > tag_freq_threshold}
+    print_tag_set_size(tag_set)
 
-# filter out infrequent tags
-tag_freq = pd.Series(list(itertools.chain(*tags))).value_counts()
-valid_tags = tag_freq.index[tag_freq > tag_freq_threshold]
-tag_set = set(valid_tags)
+    # 2nd pass normalizes the texts and appends the outputs chunk by chunk
+    n_labeled = 0
+    print('saving labels to {}'.format(label_path))
+    print("saving input text to {}".format(text_path))
+    with open(label_path, 'w') as label_file, open(text_path, 'w') as text_file:
+        for df in pd.read_csv(posts_path, sep=',', chunksize=chunk_size):
+            qs = select_questions(df)
+            y, mask = normalize_tags(qs, qs["Tags"].apply(extract_tags).tolist(), tag_set)
+            qs, y = qs[mask], y[mask]
+            n_labeled += qs.shape[0]
 
-print('number of unique labels (frequency>{}): {}'.format(
-    tag_freq_threshold, len(tag_set)))
+            y.to_csv(label_file, header=False)
+            make_input_text(qs).to_csv(text_file, header=False)
 
+    print('num. questions with at least one valid labels: {}'.format(n_labeled))
+else:
+    df = pd.read_csv(posts_path, sep=',')
 
-normalized_tags = [[t for t in ts if t in tag_set] for ts in tags]
+    print("dataset containing {} records".format(df.shape[0]))
 
+    qs = select_questions(df)
 
-# save labels to file
-y = pd.Series(list(map(lambda l: ",".join(l), normalized_tags)), index=qs['Id'])
+    print("contains {} questions".format(qs.shape[0]))
 
-mask = (y.apply(len) > 0).as_matrix()
+    tags = qs["Tags"].apply(extract_tags).tolist()
 
-qs = qs[mask]
+    # filter out infrequent tags
+    tag_freq = pd.Series(list(itertools.chain(*tags))).value_counts()
+    valid_tags = tag_freq.index[tag_freq > tag_freq_threshold]
+    tag_set = set(valid_tags)
 
-assert y.shape[0] == qs.shape[0]
+    print_tag_set_size(tag_set)
 
-print('num. questions with at least one valid labels: {}'.format(qs.shape[0]))
+    # save labels to file
+    y, mask = normalize_tags(qs, tags, tag_set)
 
-print('saving labels to {}'.format(label_path))
-y.to_csv(label_path)
+    qs, y = qs[mask], y[mask]
 
+    assert y.shape[0] == qs.shape[0]
 
-body = qs['Body'].apply(strip_tags).apply(clean_str)
-title = qs['Title'].apply(strip_tags).apply(clean_str)
+    print('num. questions with at least one valid labels: {}'.format(qs.shape[0]))
 
-# concatenate the texts
-input_text = pd.Series([' '.join(l) for l in list(zip(title, body))], index=qs['Id'])
+    print('saving labels to {}'.format(label_path))
+    y.to_csv(label_path, header=False)
 
+    input_text = make_input_text(qs)
 
-print("saving input text to {}".format(text_path))
-input_text.to_csv(text_path)
+    print("saving input text to {}".format(text_path))
+    input_text.to_csv(text_path, header=False)
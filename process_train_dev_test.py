@@ -3,6 +3,8 @@
 encode:
 1. the text using tf-idf
 2. labels into binary vector
+
+the splits of each field are written in the dataset format of dataset_helpers.py
 """
 
 import os
@@ -10,13 +12,15 @@ import pickle as pkl
 import itertools
 import tensorflow as tf
 
-from sklearn.feature_extraction.text import TfidfVectorizer
-
 from data_helpers import MultiLabelIntegerEncoder, label_ids_to_binary_matrix
+from dataset_helpers import write_field, CSRFieldWriter, MANIFEST_FILE
+from tfidf_helpers import ChunkedTfidfVectorizer
 
 
 tf.flags.DEFINE_string('data_dir', 'data/stackexchange/datascience/', 'directory of dataset')
 tf.flags.DEFINE_integer('tag_freq_threshold', 0, 'minimum frequency of a tag')
+tf.flags.DEFINE_integer('n_jobs', 1, 'number of processes computing the tf-idf, <= 0 uses all cores (default: 1)')
+tf.flags.DEFINE_integer('chunk_size', 10000, 'number of documents per tf-idf chunk (default: 10000)')
 
 FLAGS = tf.flags.FLAGS
 FLAGS._parse_flags()
@@ -30,11 +34,6 @@ dump_path = '{}/train_dev_test.pkl'.format(data_dir)
                                                 pkl.load(open(dump_path, 'rb'))
 
 
-vectorizer = TfidfVectorizer()
-x_tfidf_train = vectorizer.fit_transform(x_text_train)
-x_tfidf_dev, x_tfidf_test = vectorizer.transform(x_text_dev), vectorizer.transform(x_text_test)
-
-
 label_encoder = MultiLabelIntegerEncoder()
 
 
@@ -53,37 +52,40 @@ print('y_ints_dev[0]', y_ints_dev[0])
 n_cols = len(set(itertools.chain(*y_ints_train)))
 n_cols += 1  # for UNK labels
 
-y_binary_train = label_ids_to_binary_matrix(y_ints_train, (len(y_ints_train), n_cols))
-y_binary_dev = label_ids_to_binary_matrix(y_ints_dev, (len(y_ints_dev), n_cols))
+# kept sparse, the dense matrices are num. of docs x num. of labels
+y_binary_train = label_ids_to_binary_matrix(y_ints_train, (len(y_ints_train), n_cols), dense=False)
+y_binary_dev = label_ids_to_binary_matrix(y_ints_dev, (len(y_ints_dev), n_cols), dense=False)
 print('y_binary_dev', y_binary_dev)
-y_binary_test = label_ids_to_binary_matrix(y_ints_test, (len(y_ints_test), n_cols))
-
-text_path = os.path.join(data_dir, 'text_split.pkl')
-tfidf_path = os.path.join(data_dir, 'tfidf_split.pkl')
-labels_path = os.path.join(data_dir, 'labels_split.pkl')
-labels_id_path = os.path.join(data_dir, 'labels_id_split.pkl')
-labels_binary_path = os.path.join(data_dir, 'labels_binary_split.pkl')
-node_ids_path = os.path.join(data_dir, 'node_ids_split.pkl')
-
+y_binary_test = label_ids_to_binary_matrix(y_ints_test, (len(y_ints_test), n_cols), dense=False)
 
 label_encoder_path = os.path.join(data_dir, 'label_encoder.pkl')
-tfidf_vectorizer_path = os.path.join(data_dir, 'text_vectorizer.pkl')
-
 
-def dump_data(variable, path):
-    pkl.dump(variable, open(path, 'wb'))
 
-
-dump_info = [
-    ((x_text_train, x_text_dev, x_text_test), text_path),
-    ((x_tfidf_train, x_tfidf_dev, x_tfidf_test), tfidf_path),
-    ((y_labels_train, y_labels_dev, y_labels_test), labels_path),
-    ((y_ints_train, y_ints_dev, y_ints_test), labels_id_path),
-    ((y_binary_train, y_binary_dev, y_binary_test), labels_binary_path),
-    ((node_ids_train, node_ids_dev, node_ids_test), node_ids_path)
+split_fields = [
+    ('text', (x_text_train, x_text_dev, x_text_test)),
+    ('labels', (y_labels_train, y_labels_dev, y_labels_test)),
+    ('labels_id', (y_ints_train, y_ints_dev, y_ints_test)),
+    ('labels_binary', (y_binary_train, y_binary_dev, y_binary_test)),
+    ('node_ids', (node_ids_train, node_ids_dev, node_ids_test)),
 ]
 
-
-for var, path in dump_info:
-    print('dumping to', path)
-    dump_data(var, path)
+# the fields of a previous split are replaced
+if os.path.exists(os.path.join(data_dir, MANIFEST_FILE)):
+    os.remove(os.path.join(data_dir, MANIFEST_FILE))
+
+for field, splits in split_fields:
+    print('writing', field, 'to', os.path.join(data_dir, field))
+    write_field(data_dir, field, splits)
+
+# the tf-idf chunks are written as they are computed
+print('writing tfidf to', os.path.join(data_dir, 'tfidf'))
+vectorizer = ChunkedTfidfVectorizer(n_jobs=FLAGS.n_jobs, chunk_size=FLAGS.chunk_size).fit(x_text_train)
+tfidf_writer = CSRFieldWriter(data_dir, 'tfidf', len(vectorizer.vocabulary_))
+for texts in (x_text_train, x_text_dev, x_text_test):
+    for X in vectorizer.transform_chunks(texts):
+        tfidf_writer.write(X)
+tfidf_writer.close([len(x_text_train), len(x_text_dev), len(x_text_test)])
+
+# to map the predicted label ids back to tags
+print('dumping to', label_encoder_path)
+pkl.dump(label_encoder, open(label_encoder_path, 'wb'))
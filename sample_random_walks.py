@@ -1,49 +1,120 @@
 # coding: utf-8
 
+import os
+import json
 import tensorflow as tf
 import numpy as np
+from multiprocessing import Pool
 from tqdm import tqdm
-from graph_tool import load_graph
 
+from graph_helpers import load_graph, walk_start_nodes, random_walks
 
-def random_walk(g, start_node, walk_length, alpha=0.05):
+
+def random_walk(adj, start_node, walk_length, alpha=0.05):
     """
     random walk on unweighted, undirected graph
     
     Args:
+    adj: csr_matrix, adjacency matrix
     alpha: proba of restart
     
     Returns:
     a list of integer list
     """
     walk = [start_node]
-    c = g.vertex(start_node)
+    c = start_node
     for i in range(walk_length):
         if np.random.random() <= alpha:
-            n = g.vertex(start_node)
+            n = start_node
         else:
-            n = np.random.choice(list(c.out_neighbours()))
+            n = np.random.choice(adj.indices[adj.indptr[c]:adj.indptr[c + 1]])
         c = n
         walk.append(int(c))
     return walk
 
 
-def yield_n_random_walks(n, g, walk_length, alpha):
-    nodes = list(map(int, g.vertices()))
+def yield_n_random_walks(n, adj, walk_length, alpha):
+    num_vertices = adj.shape[0]
+    nodes = list(range(num_vertices))
     while n > 0:
-        if n >= g.num_vertices():
+        if n >= num_vertices:
             nodes_to_start = nodes
         else:
             nodes_to_start = np.random.choice(nodes, n, replace=False)
 
         for v in nodes_to_start:
-            yield random_walk(g, v, walk_length, alpha)
+            yield random_walk(adj, v, walk_length, alpha)
             
         n -= len(nodes_to_start)
 
 
+_adj = None  # the graph loaded by each worker process, see `init_worker`
+
+
+def init_worker(graph_path):
+    global _adj
+    _adj, _ = load_graph(graph_path)
+
+
+def write_walks(path, adj, start_nodes, walk_length, alpha, rng, walk_batch_size, offset=0):
+    """
+    sample one walk per start node and write them to `path`,
+    either a text file with one walk per line,
+    or the rows from `offset` of an existing .npy file (see `create_walk_array`)
+
+    Returns:
+
+    generator of int, the number of walks written by each batch
+    """
+    def batches():
+        for i in range(0, len(start_nodes), walk_batch_size):
+            yield i, random_walks(adj, start_nodes[i:i + walk_batch_size], walk_length, alpha, rng)
+
+    if path.endswith('.npy'):
+        out = np.lib.format.open_memmap(path, mode='r+')
+        for i, walks in batches():
+            out[offset + i:offset + i + len(walks)] = walks
+            yield len(walks)
+        out.flush()
+        del out
+    else:
+        with open(path, 'w') as f:
+            for _, walks in batches():
+                np.savetxt(f, walks, fmt='%d')
+                yield len(walks)
+
+
+def create_walk_array(path, num_walks, walk_length):
+    """allocate the .npy file of int32 walks, one row per walk"""
+    out = np.lib.format.open_memmap(path, mode='w+', dtype=np.int32,
+                                    shape=(num_walks, walk_length + 1))
+    del out
+
+
+def write_walk_shard(args):
+    """
+    sample the walks of one shard in a worker process
+
+    each shard has its own random stream seeded by (seed, shard index)
+    """
+    shard, path, offset, start_nodes, walk_length, alpha, seed, walk_batch_size = args
+    rng = np.random.RandomState([seed, shard])
+    return sum(write_walks(path, _adj, start_nodes, walk_length, alpha, rng, walk_batch_size, offset))
+
+
 if __name__ == '__main__':
     tf.flags.DEFINE_string('data_dir', 'data/stackexchange/datascience/', 'directory of dataset')
+    tf.flags.DEFINE_string('graph_format', 'npz', 'format of question_graph: npz or gt (default: npz)')
+    tf.flags.DEFINE_integer('walk_batch_size', 100000, 'number of walks advanced together (default: 100000)')
+    tf.flags.DEFINE_integer('seed', 12345, 'random seed')
+    tf.flags.DEFINE_string('walk_format', 'npy',
+                           'npy: int32 array random_walks.npy, '
+                           'txt: random_walks.txt with one walk per line (default: npy)')
+    tf.flags.DEFINE_integer('n_shards', 1,
+                            'number of shards sampled in parallel, in txt format they are written to '
+                            'random_walks/ and listed by random_walks.json (default: 1)')
+    tf.flags.DEFINE_integer('n_jobs', 0, 'number of worker processes writing the shards, '
+                            '<= 0 uses all cores (default: 0)')
 
     FLAGS = tf.flags.FLAGS
     FLAGS._parse_flags()
@@ -60,12 +131,54 @@ if __name__ == '__main__':
     walk_length = 6
     alpha = 0.05
     
-    # output
-    walks = []  # list of list of nodes
-
-    g = load_graph('{}/question_graph.gt'.format(data_dir))
-    total = num_walks_per_node * g.num_vertices()
-    with open('{}/random_walks.txt'.format(data_dir), 'w') as f:
-        for walk in tqdm(yield_n_random_walks(total, g, walk_length, alpha), total=total):
-            f.write(' '.join(map(str, walk)) + '\n')
-    print('written to ', '{}/random_walks.txt'.format(data_dir))
+    rng = np.random.RandomState(FLAGS.seed)
+    graph_path = '{}/question_graph.{}'.format(data_dir, FLAGS.graph_format)
+    adj, _ = load_graph(graph_path)
+    total = num_walks_per_node * adj.shape[0]
+    start_nodes = walk_start_nodes(total, adj.shape[0], rng)
+
+    if FLAGS.walk_format == 'npy':
+        # all the shards write their rows into the same file
+        path = os.path.join(data_dir, 'random_walks.npy')
+        create_walk_array(path, total, walk_length)
+        shard_paths = [path] * FLAGS.n_shards
+    elif FLAGS.n_shards <= 1:
+        path = os.path.join(data_dir, 'random_walks.txt')
+        shard_paths = [path]
+    else:
+        # one text file per shard,
+        # the manifest lists the shards in the order of the start nodes
+        path = os.path.join(data_dir, 'random_walks.json')
+        shard_dir = os.path.join(data_dir, 'random_walks')
+        if not os.path.exists(shard_dir):
+            os.makedirs(shard_dir)
+        shard_paths = [os.path.join(shard_dir, 'walks-{:05d}.txt'.format(i))
+                       for i in range(FLAGS.n_shards)]
+
+    with tqdm(total=total) as progress:
+        if FLAGS.n_shards <= 1:
+            for n in write_walks(shard_paths[0], adj, start_nodes, walk_length, alpha, rng,
+                                 FLAGS.walk_batch_size):
+                progress.update(n)
+        else:
+            tasks = []
+            offset = 0
+            for i, (shard_path, shard_start_nodes) in enumerate(
+                    zip(shard_paths, np.array_split(start_nodes, FLAGS.n_shards))):
+                tasks.append((i, shard_path, offset, shard_start_nodes,
+                              walk_length, alpha, FLAGS.seed, FLAGS.walk_batch_size))
+                offset += len(shard_start_nodes)
+
+            n_jobs = FLAGS.n_jobs if FLAGS.n_jobs > 0 else None
+            pool = Pool(n_jobs, initializer=init_worker, initargs=(graph_path,))
+            for n in pool.imap_unordered(write_walk_shard, tasks):
+                progress.update(n)
+            pool.close()
+            pool.join()
+
+    if path.endswith('.json'):
+        shards = [{'path': os.path.relpath(shard_path, data_dir), 'num_walks': len(task[3])}
+                  for shard_path, task in zip(shard_paths, tasks)]
+        with open(path, 'w') as f:
+            json.dump({'num_walks': total, 'walk_length': walk_length, 'shards': shards}, f, indent=2)
+    print('written to ', path)
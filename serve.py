@@ -0,0 +1,93 @@
+# coding: utf-8
+"""
+http server suggesting tags for new posts with a trained KimCNN model
+
+POST a json object with "text" (one post) or "texts" (list of posts), raw html or text:
+
+    curl -d '{"text": "<p>how to tune the learning rate of adam?</p>"}' localhost:8000
+
+the response has the top k tags with their scores for each post:
+
+    {"tags": [[{"tag": "deep-learning", "score": 1.3}, ...]]}
+
+the posts of concurrent requests are scored together in micro batches
+"""
+
+import os
+import json
+import tensorflow as tf
+
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+from inference_helpers import Predictor, MicroBatcher
+
+
+tf.flags.DEFINE_string('data_dir', '', 'directory of dataset, with vocab.json and label_encoder.pkl')
+tf.flags.DEFINE_string("checkpoint_dir", "", "Checkpoint directory from training run")
+tf.flags.DEFINE_string("frozen_model_path", "",
+                       "frozen graph written by export_model.py, used instead of the checkpoint if given")
+tf.flags.DEFINE_string("host", "localhost", "host to listen on (default: localhost)")
+tf.flags.DEFINE_integer("port", 8000, "port to listen on (default: 8000)")
+tf.flags.DEFINE_integer("top_k", 5, "number of tags returned per post (default: 5)")
+tf.flags.DEFINE_integer("max_batch_size", 64, "maximum number of posts scored together (default: 64)")
+tf.flags.DEFINE_float("max_latency_ms", 10,
+                      "how long the first post of a batch waits for others, in milliseconds (default: 10)")
+
+tf.flags.DEFINE_boolean("allow_soft_placement", True, "Allow device soft device placement")
+tf.flags.DEFINE_boolean("log_device_placement", False, "Log placement of ops on devices")
+
+FLAGS = tf.flags.FLAGS
+FLAGS._parse_flags()
+print("\nParameters:")
+for attr, value in sorted(FLAGS.__flags.items()):
+    print("{}={}".format(attr.upper(), value))
+print("")
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class TagHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+            texts = request['texts'] if 'texts' in request else [request['text']]
+            if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+                raise TypeError('"text" must be a string and "texts" a list of strings')
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_error(400, 'expected a json object with "text" or "texts" ({})'.format(e))
+            return
+
+        try:
+            tags = batcher.predict(texts)
+        except Exception as e:
+            self.send_error(500, 'prediction failed ({})'.format(e))
+            return
+        body = json.dumps({'tags': [[{'tag': tag, 'score': score} for tag, score in post_tags]
+                                    for post_tags in tags]}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+session_conf = tf.ConfigProto(
+    allow_soft_placement=FLAGS.allow_soft_placement,
+    log_device_placement=FLAGS.log_device_placement)
+predictor = Predictor(FLAGS.frozen_model_path or FLAGS.checkpoint_dir,
+                      os.path.join(FLAGS.data_dir, "vocab.json"),
+                      os.path.join(FLAGS.data_dir, "label_encoder.pkl"),
+                      top_k=FLAGS.top_k,
+                      session_config=session_conf)
+batcher = MicroBatcher(predictor.predict, FLAGS.max_batch_size, FLAGS.max_latency_ms / 1000)
+
+server = ThreadingHTTPServer((FLAGS.host, FLAGS.port), TagHandler)
+print('serving on {}:{}'.format(FLAGS.host, FLAGS.port))
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    print('{} posts in {} batches'.format(batcher.num_items, batcher.num_batches))
@@ -1,4 +1,11 @@
-from data_helpers import RWBatchGenerator
+import json
+import numpy as np
+import pytest
+from scipy.sparse import csr_matrix
+
+from data_helpers import RWBatchGenerator, clean_str, strip_tags, fast_clean_str, normalize_texts, parallel_imap, \
+    convert_walks_to_npy, count_walk_nodes, Prefetcher, dict_batch_iter, \
+    document_lengths, bucket_batch_iter, label_ids_to_binary_matrix, RaggedArray, TextArray
 
 
 def test_dw_batch_generator():
@@ -16,3 +23,191 @@ def test_dw_batch_generator():
     batches, labels = g.next_batch()
     assert set(zip(batches, labels)) == {(2, 1), (2, 3), (3, 2), (3, 4), (5, 4), (5, 6)}
     assert set(list(zip(batches, labels))[-2:]) == {(2, 1), (2, 3)}  # the last two loops back
+
+
+def test_dw_batch_generator_on_array():
+    walks = np.array([[1, 2, 3], [3, 4, 5], [5, 6, 7]], dtype=np.int32)
+
+    g = RWBatchGenerator(walks, 2, 2, 1)
+    expected_batches = [{(2, 1), (2, 3)}, {(4, 3), (4, 5)}, {(6, 5), (6, 7)}] * 10
+    for exp in expected_batches:
+        batches, labels = g.next_batch()
+        assert set(zip(batches, labels)) == exp
+
+
+def test_dw_batch_generator_samples_distinct_contexts():
+    walks = np.arange(100).reshape(10, 10)
+
+    g = RWBatchGenerator(walks, 30, 3, 2, buffer_walks=3, seed=1)
+    for _ in range(20):
+        batches, labels = g.next_batch()
+        for center in range(0, 30, 3):  # 3 pairs per center
+            assert len(set(batches[center:center + 3])) == 1
+            contexts = labels[center:center + 3]
+            assert len(set(contexts)) == 3
+            assert all(0 < abs(c - batches[center]) <= 2 for c in contexts)
+
+
+def test_fast_clean_str():
+    strings = ["Hello (world)? It's  fine, isn't it!",
+               "we'll\tsee\nwhat you're   doing, I'd say `x`",
+               "café “quoted” \\back\\slash n't 's",
+               "", "   "]
+    for s in strings:
+        assert fast_clean_str(s) == clean_str(s)
+
+
+def test_normalize_texts():
+    posts = ["<p>post {} can't <b>be</b> (empty)?</p>".format(i) for i in range(50)]
+    expected = [clean_str(strip_tags(p)) for p in posts]
+    assert list(normalize_texts(posts)) == expected
+    assert list(normalize_texts(posts, n_jobs=2, chunksize=3)) == expected  # order is kept
+
+
+def test_parallel_imap():
+    sent = []
+
+    def items():
+        for i in range(20):
+            sent.append(i)
+            yield i
+
+    results = parallel_imap(abs, items(), n_jobs=2)
+    assert next(results) == 0
+    assert len(sent) <= 5  # at most 2 items per process are pending
+    assert list(results) == list(range(1, 20))  # order is kept
+    assert list(parallel_imap(abs, [-1, -2], n_jobs=1)) == [1, 2]
+
+
+def test_read_walks_from_manifest(tmpdir):
+    tmpdir.mkdir('random_walks')
+    tmpdir.join('random_walks', 'walks-00000.txt').write('1 2 3\n4 5 6\n')
+    tmpdir.join('random_walks', 'walks-00001.txt').write('7 8 9\n')
+    tmpdir.join('random_walks.json').write(json.dumps({
+        'shards': [{'path': 'random_walks/walks-00000.txt', 'num_walks': 2},
+                   {'path': 'random_walks/walks-00001.txt', 'num_walks': 1}]}))
+
+    path = str(tmpdir.join('random_walks.json'))
+    assert RWBatchGenerator.read_walks(path) == [[1, 2, 3], [4, 5, 6], [7, 8, 9]]
+
+    shuffled = RWBatchGenerator.read_walks(path, shuffle=True, seed=1)
+    assert sorted(shuffled) == [[1, 2, 3], [4, 5, 6], [7, 8, 9]]
+
+
+def test_convert_walks_to_npy(tmpdir):
+    tmpdir.join('random_walks.txt').write('1 2 3\n4 5 6\n7 8 9\n')
+    path = str(tmpdir.join('random_walks.npy'))
+    convert_walks_to_npy(str(tmpdir.join('random_walks.txt')), path, block_size=2)
+
+    walks = RWBatchGenerator.read_walks(path)
+    assert isinstance(walks, np.memmap)
+    assert walks.dtype == np.int32
+    assert walks.tolist() == [[1, 2, 3], [4, 5, 6], [7, 8, 9]]
+    assert count_walk_nodes(walks) == 9
+
+
+def test_prefetcher():
+    for buffer_size in [0, 1, 8]:
+        items = Prefetcher(iter(range(20)), buffer_size)
+        assert list(items) == list(range(20))
+        assert list(items) == []  # exhausted
+        assert items.pop_wait_time() >= 0
+        assert items.wait_time == 0
+
+
+def test_prefetcher_raises_producer_error():
+    def items():
+        yield 1
+        raise ValueError('bad batch')
+
+    p = Prefetcher(items(), 2)
+    assert next(p) == 1
+    with pytest.raises(ValueError):
+        next(p)
+
+
+def test_dict_batch_iter():
+    x = np.arange(10).reshape(5, 2)
+    y = csr_matrix(np.eye(5))
+    labels = [[0], [1, 2], [], [3], [4]]
+    data = {'x': x, 'y': y, 'labels': labels}
+
+    batches = list(dict_batch_iter(data, 2, 1, shuffle=False))
+    assert [len(b['labels']) for b in batches] == [2, 2, 1]
+    assert np.shares_memory(batches[0]['x'], x)  # slices, not copies
+    assert batches[1]['labels'] == [[], [3]]
+
+    batches = list(dict_batch_iter(data, 2, 2, rng=np.random.RandomState(0)))
+    assert len(batches) == 6
+    for epoch in [batches[:3], batches[3:]]:
+        xs = np.concatenate([b['x'] for b in epoch])
+        assert sorted(xs[:, 0].tolist()) == [0, 2, 4, 6, 8]
+        for b in epoch:  # the fields stay aligned
+            rows = b['x'][:, 0] // 2
+            assert (b['y'].toarray().argmax(axis=1) == rows).all()
+            assert b['labels'] == [labels[i] for i in rows]
+
+
+def test_document_lengths():
+    x = np.array([[3, 1, 0, 0],
+                  [0, 0, 0, 0],
+                  [2, 0, 5, 0],
+                  [1, 2, 3, 4]])
+    assert document_lengths(x).tolist() == [2, 0, 3, 4]
+
+
+def test_bucket_batch_iter():
+    rng = np.random.RandomState(0)
+    lengths = rng.randint(1, 20, size=50)
+    x = np.zeros((50, 20), dtype=int)
+    for i, l in enumerate(lengths):
+        x[i, :l] = i + 1
+    data = {'x': x, 'ids': list(range(50))}
+
+    batches = list(bucket_batch_iter(data, lengths, 4, 2, min_length=5, pool_batches=5, rng=rng))
+    assert len(batches) == 2 * 13
+    for epoch in [batches[:13], batches[13:]]:
+        assert sorted(i for b in epoch for i in b['ids']) == list(range(50))
+    for b in batches:
+        assert b['x'].shape[1] == max(lengths[b['ids']].max(), 5)
+        assert (b['x'][:, 0] == np.array(b['ids']) + 1).all()  # the fields stay aligned
+
+
+def test_label_ids_to_binary_matrix():
+    labels = [[0, 2], [], [1, 1]]
+    expected = [[1, 0, 1], [0, 0, 0], [0, 1, 0]]
+    assert label_ids_to_binary_matrix(labels, (3, 3)).tolist() == expected
+
+    m = label_ids_to_binary_matrix(labels, (3, 3), dense=False)
+    assert isinstance(m, csr_matrix)
+    assert m.nnz == 3
+    assert m.toarray().tolist() == expected
+
+
+def test_ragged_array():
+    lists = [[1, 2], [], [3], [4, 5, 6]]
+    a = RaggedArray.from_lists(lists)
+    assert len(a) == 4
+    assert a.tolist() == lists
+    assert a.lengths().tolist() == [2, 0, 1, 3]
+    assert a[3].tolist() == [4, 5, 6]
+    assert a[-1].tolist() == [4, 5, 6]
+    assert a[1:3].tolist() == [[], [3]]
+    assert a[::2].tolist() == [[1, 2], [3]]
+    assert a.take([3, 0, 1]).tolist() == [[4, 5, 6], [1, 2], []]
+    assert [row.tolist() for row in a] == lists
+
+    # batches of a ragged field
+    batches = list(dict_batch_iter({'y': a}, 3, 1, rng=np.random.RandomState(0)))
+    assert sorted(row for batch in batches for row in map(tuple, batch['y'].tolist())) == \
+        sorted(map(tuple, lists))
+
+
+def test_text_array():
+    strings = ['how to tune adam', '', 'naïve bayes']
+    a = TextArray.from_strings(strings)
+    assert len(a) == 3
+    assert list(a) == strings
+    assert a[2] == 'naïve bayes'
+    assert list(a[1:]) == strings[1:]
+    assert next(dict_batch_iter({'text': a}, 2, 1, shuffle=False))['text'][1] == ''
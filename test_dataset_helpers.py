@@ -0,0 +1,110 @@
+import os
+import pickle as pkl
+import numpy as np
+import pytest
+
+from scipy.sparse import csr_matrix, issparse
+
+from data_helpers import RaggedArray, TextArray
+from dataset_helpers import write_field, load_splits, load_split, read_manifest, field_digest, CSRFieldWriter
+
+
+def _splits():
+    return {
+        'text': (['how to tune adam', 'svm vs. logistic regression'], ['naïve bayes'], ['', 'pca']),
+        'labels_id': ([[0, 1], [2]], [[]], [[1, 2, 3], [0]]),
+        'tfidf': (csr_matrix([[0, 1.5, 0], [2, 0, 0]]), csr_matrix([[0, 0, 0]]),
+                  csr_matrix([[0, 0, 3], [1, 1, 1]])),
+        'node_ids': (np.array([3, 1]), np.array([0]), np.array([2, 4])),
+    }
+
+
+def test_write_load_splits(tmpdir):
+    data_dir = str(tmpdir)
+    splits = _splits()
+    for field, values in splits.items():
+        write_field(data_dir, field, values)
+
+    manifest = read_manifest(data_dir)
+    assert manifest['splits'] == ['train', 'dev', 'test']
+    assert manifest['boundaries'] == [0, 2, 3, 5]
+    assert manifest['fields']['tfidf'] == {'kind': 'csr', 'shape': [5, 3]}
+
+    text = load_splits(data_dir, 'text')
+    assert all(isinstance(split, TextArray) for split in text)
+    assert [list(split) for split in text] == [list(split) for split in splits['text']]
+
+    labels = load_splits(data_dir, 'labels_id')
+    assert all(isinstance(split, RaggedArray) for split in labels)
+    assert [split.tolist() for split in labels] == [list(split) for split in splits['labels_id']]
+
+    tfidf = load_splits(data_dir, 'tfidf', ['test', 'train'])
+    assert all(issparse(split) for split in tfidf)
+    np.testing.assert_array_equal(tfidf[0].toarray(), splits['tfidf'][2].toarray())
+    np.testing.assert_array_equal(tfidf[1].toarray(), splits['tfidf'][0].toarray())
+
+    node_ids = load_split(data_dir, 'node_ids', 'test')
+    assert isinstance(node_ids, np.memmap)
+    np.testing.assert_array_equal(node_ids, [2, 4])
+
+
+def test_write_field_checks_split_sizes(tmpdir):
+    data_dir = str(tmpdir)
+    write_field(data_dir, 'node_ids', ([1, 2], [3], [4]))
+    with pytest.raises(AssertionError):
+        write_field(data_dir, 'labels_id', ([[1]], [[2]], [[3]]))
+
+
+def test_load_splits_from_pickle(tmpdir):
+    data_dir = str(tmpdir)
+    splits = _splits()
+    for field in ['text', 'labels_id']:
+        with open(os.path.join(data_dir, '{}_split.pkl'.format(field)), 'wb') as f:
+            pkl.dump(splits[field], f)
+
+    assert load_split(data_dir, 'text', 'dev') == ['naïve bayes']
+    labels = load_splits(data_dir, 'labels_id', ['train', 'test'])
+    assert isinstance(labels[0], RaggedArray)
+    assert labels[1].tolist() == [[1, 2, 3], [0]]
+
+    # a converted field is read from the dataset format, the others still from the pickles
+    write_field(data_dir, 'labels_id', splits['labels_id'])
+    assert isinstance(load_split(data_dir, 'labels_id', 'train').values, np.memmap)
+    assert load_split(data_dir, 'text', 'dev') == ['naïve bayes']
+
+
+def test_field_digest(tmpdir):
+    data_dir = str(tmpdir)
+    splits = _splits()
+    write_field(data_dir, 'text', splits['text'])
+    digest = field_digest(data_dir, 'text')
+
+    # other fields do not change it
+    write_field(data_dir, 'labels_id', splits['labels_id'])
+    assert field_digest(data_dir, 'text') == digest
+
+    write_field(data_dir, 'text', (['how to tune sgd', 'svm vs. logistic regression'], ['naïve bayes'], ['', 'pca']))
+    assert field_digest(data_dir, 'text') != digest
+
+
+def test_csr_field_writer(tmpdir):
+    data_dir = str(tmpdir)
+    write_field(data_dir, 'node_ids', (np.arange(3), np.arange(1), np.arange(2)))
+
+    X = csr_matrix(np.array([[0, 1.5, 0], [2, 0, 0], [0, 0, 0], [0, 0, 3], [1, 1, 1], [0, 0.5, 0]]))
+    writer = CSRFieldWriter(data_dir, 'tfidf', 3)
+    for start, end in [(0, 2), (2, 2), (2, 5), (5, 6)]:
+        writer.write(X[start:end])
+    writer.close([3, 1, 2])
+
+    assert sorted(os.listdir(os.path.join(data_dir, 'tfidf'))) == ['data.npy', 'indices.npy', 'indptr.npy']
+    train, dev, test = load_splits(data_dir, 'tfidf')
+    np.testing.assert_array_equal(train.toarray(), X[:3].toarray())
+    np.testing.assert_array_equal(dev.toarray(), X[3:4].toarray())
+    np.testing.assert_array_equal(test.toarray(), X[4:].toarray())
+    assert read_manifest(data_dir)['fields']['tfidf'] == {'kind': 'csr', 'shape': [6, 3]}
+
+    writer = CSRFieldWriter(data_dir, 'empty', 3)
+    writer.write(csr_matrix((6, 3)))
+    writer.close([3, 1, 2])
+    assert load_split(data_dir, 'empty', 'test').nnz == 0
@@ -3,8 +3,9 @@ import numpy as np
 import tensorflow as tf
 from scipy.sparse import csr_matrix
 
+from data_helpers import RaggedArray
 from eval_helpers import tf_precision_at_k, label_lists_to_sparse_tuple, \
-    precision_at_ks
+    precision_at_ks, top_k_indices, ranking_metrics, inverse_label_propensities, RankingMetrics
 
 
 @pytest.fixture
@@ -68,3 +69,78 @@ def test_precision_at_k_sparse(pred_value_1, pred_value_2, correct_values):
         
     p2 = precision_at_ks(csr_matrix(pred_value_2), correct_values, ks=[2])[0]
     assert np.isclose(p2, np.mean([1, 0.5, 0.5]))
+
+
+def test_label_lists_to_sparse_tuple():
+    indices, values, shape = label_lists_to_sparse_tuple([[3, 1], [], [2]], 4)
+    assert indices.tolist() == [[0, 0], [0, 1], [2, 0]]
+    assert values.tolist() == [3, 1, 2]
+    assert shape == (3, 4)
+
+    # rows of a label indicator matrix
+    indices, values, shape = label_lists_to_sparse_tuple(
+        csr_matrix(np.array([[0, 1, 0, 1], [0, 0, 0, 0], [0, 0, 1, 0]])), 4)
+    assert indices.tolist() == [[0, 0], [0, 1], [2, 0]]
+    assert values.tolist() == [1, 3, 2]
+    assert shape == (3, 4)
+
+    # label lists of the dataset format
+    indices, values, shape = label_lists_to_sparse_tuple(RaggedArray.from_lists([[3, 1], [], [2]]), 4)
+    assert indices.tolist() == [[0, 0], [0, 1], [2, 0]]
+    assert values.tolist() == [3, 1, 2]
+    assert shape == (3, 4)
+
+
+def test_precision_at_ks_uses_ks(pred_value_2, correct_values):
+    p1, p2, p3 = precision_at_ks(pred_value_2, correct_values, ks=[1, 2, 3])
+    assert np.isclose(p1, np.mean([1, 0, 1]))
+    assert np.isclose(p2, np.mean([1, 0.5, 0.5]))
+    assert np.isclose(p3, np.mean([1, 2 / 3, 2 / 3]))
+
+
+def test_precision_at_ks_sparse_rows():
+    # less stored scores than k and an empty row
+    scores = csr_matrix(np.array([[0, 0.5, 0.9], [0, 0, 0], [0.2, 0, 0]]))
+    p2, = precision_at_ks(scores, [[2], [0], [1]], ks=[2])
+    assert np.isclose(p2, np.mean([0.5, 0, 0]))
+
+
+def test_top_k_indices(pred_value_1):
+    assert top_k_indices(pred_value_1, 2).tolist() == [[0, 1], [2, 1], [0, 2]]
+    assert top_k_indices(pred_value_1, 5).tolist() == [[0, 1, 2], [2, 1, 0], [0, 2, 1]]
+
+    scores = csr_matrix(np.array([[0, 0.5, 0.9], [0, 0, 0], [0.2, 0, 0]]))
+    assert top_k_indices(scores, 2).tolist() == [[2, 1], [-1, -1], [0, -1]]
+
+
+def test_ranking_metrics(pred_value_2, correct_values):
+    # top 2: [2, 1], [0, 1], [2, 1]
+    m = ranking_metrics(pred_value_2, correct_values, ks=[1, 2])
+    assert np.isclose(m['p@2'], np.mean([1, 0.5, 0.5]))
+    assert np.isclose(m['ndcg@1'], np.mean([1, 0, 1]))
+    idcg = 1 + 1 / np.log2(3)
+    assert np.isclose(m['ndcg@2'], np.mean([1, 1 / np.log2(3) / idcg, 1 / idcg]))
+    assert np.isclose(m['coverage@1'], 1 / 3)  # only label 2 is found at rank 1
+    assert np.isclose(m['coverage@2'], 2 / 3)
+    assert 'psp@1' not in m
+
+    # with equal propensities, psp@k is the number of hits over the best possible number of hits
+    m = ranking_metrics(pred_value_2, correct_values, ks=[2], inv_propensities=np.ones(3))
+    assert np.isclose(m['psp@2'], 4 / 6)
+
+    assert ranking_metrics(pred_value_2, RaggedArray.from_lists(correct_values), ks=[1, 2]) == \
+        ranking_metrics(pred_value_2, correct_values, ks=[1, 2])
+
+
+def test_ranking_metrics_batches(pred_value_1, pred_value_2, correct_values):
+    scores = np.concatenate([pred_value_1, pred_value_2])
+    labels = correct_values * 2
+    inv_propensities = inverse_label_propensities(labels, 3)
+    assert inv_propensities[0] == inv_propensities[1] > inv_propensities[2]  # label 2 is the most frequent
+
+    expected = ranking_metrics(scores, labels, ks=[1, 3], inv_propensities=inv_propensities)
+    metrics = RankingMetrics(ks=[1, 3], inv_propensities=inv_propensities)
+    for i in range(0, 6, 4):
+        metrics.update(top_k_indices(scores[i:i + 4], 3), labels[i:i + 4])
+    for name, value in metrics.result().items():
+        assert np.isclose(value, expected[name])
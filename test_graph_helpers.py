@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse as sp
+
+from graph_helpers import question_user_matrix, cap_user_degree, iter_projection_blocks, \
+    largest_component, subgraph, save_graph, load_graph, walk_start_nodes, random_walks
+
+
+def test_question_user_matrix():
+    df = pd.DataFrame({
+        'Id': [10, 11, 12, 13, 14, 15, 16],
+        'PostTypeId': [1, 2, 1, 2, 2, 1, 2],
+        'ParentId': [np.nan, 10, np.nan, 12, 12, np.nan, 10],
+        'OwnerUserId': [1, 2, 2, np.nan, np.nan, np.nan, 2],
+        'OwnerDisplayName': [np.nan, np.nan, np.nan, 'anna', np.nan, np.nan, np.nan]
+    })
+    m, question_ids = question_user_matrix(df)
+
+    # question 15 has no known user
+    assert question_ids.tolist() == [10, 12]
+    assert m.shape == (2, 3)
+    assert m.sum(axis=1).A1.tolist() == [2, 2]  # user 2 answering twice counts once
+    assert (m * m.T).toarray().tolist() == [[2, 1], [1, 2]]
+
+
+def random_question_user_matrix():
+    m = sp.random(200, 30, density=0.1, random_state=1, format='csr')
+    m.data[:] = 1
+    return m
+
+
+def test_cap_user_degree():
+    m = random_question_user_matrix()
+    capped = cap_user_degree(m, 3, seed=1)
+
+    user_degree = np.diff(m.tocsc().indptr)
+    assert (np.diff(capped.tocsc().indptr) == np.minimum(user_degree, 3)).all()
+    assert capped.multiply(m).nnz == capped.nnz  # only drops entries
+
+
+def test_iter_projection_blocks():
+    m = random_question_user_matrix()
+    blocks = list(iter_projection_blocks(m, 500))
+    assert len(blocks) > 1
+    assert [start for start, _ in blocks] == np.cumsum([0] + [b.shape[0] for _, b in blocks[:-1]]).tolist()
+
+    qm = sp.vstack([b for _, b in blocks])
+    assert (qm != m * m.T).nnz == 0
+
+
+def test_largest_component_and_subgraph():
+    # components: {0, 2, 4} and {1, 3}
+    edges = np.array([[0, 2], [2, 4], [1, 3]])
+    adj = sp.csr_matrix((np.ones(3), (edges[:, 0], edges[:, 1])), shape=(5, 5))
+    adj = adj + adj.T
+
+    nodes = largest_component(adj)
+    assert nodes.tolist() == [0, 2, 4]
+    assert subgraph(adj, nodes).toarray().tolist() == [[0, 1, 0], [1, 0, 1], [0, 1, 0]]
+
+
+def test_save_and_load_graph(tmpdir):
+    adj = random_question_user_matrix()
+    adj = (adj * adj.T).tocsr()
+    question_ids = np.arange(adj.shape[0]) * 10
+
+    path = str(tmpdir.join('question_graph.npz'))
+    save_graph(path, adj, question_ids)
+    loaded_adj, loaded_question_ids = load_graph(path)
+
+    assert (loaded_adj != adj).nnz == 0
+    assert (loaded_question_ids == question_ids).all()
+
+
+def test_walk_start_nodes():
+    start_nodes = walk_start_nodes(10, 4, np.random.RandomState(0))
+    assert start_nodes[:8].tolist() == [0, 1, 2, 3] * 2
+    assert len(set(start_nodes[8:])) == 2
+
+
+def test_random_walks():
+    # path 0 - 1 - 2, node 3 is isolated
+    adj = sp.csr_matrix(np.array([[0, 1, 0, 0], [1, 0, 1, 0], [0, 1, 0, 0], [0, 0, 0, 0]]))
+    start_nodes = np.tile(np.arange(4), 100)
+
+    walks = random_walks(adj, start_nodes, 5, alpha=0.1, rng=np.random.RandomState(0))
+    assert walks.shape == (400, 6)
+    assert (walks[:, 0] == start_nodes).all()
+    assert (walks[3::4] == 3).all()
+
+    dense = adj.toarray()
+    for walk in walks:
+        for u, v in zip(walk[:-1], walk[1:]):
+            assert dense[u, v] == 1 or v == walk[0]  # follows an edge or restarts
+
+    # reproducible
+    assert (random_walks(adj, start_nodes, 5, alpha=0.1, rng=np.random.RandomState(0)) == walks).all()
@@ -0,0 +1,87 @@
+import time
+import threading
+import pytest
+
+from inference_helpers import MicroBatcher
+
+
+def wait_until(condition):
+    while not condition():
+        time.sleep(0.001)
+
+
+def concurrent_requests(batcher, items, release, batch_sizes):
+    """
+    the results (or exceptions) of concurrent `batcher.predict([item])` for each of `items`,
+    the first request holds the batcher on `release` until the others are all queued
+    """
+    results = {}
+
+    def request(item):
+        try:
+            results[item] = batcher.predict([item])
+        except Exception as e:
+            results[item] = e
+
+    num_batches = len(batch_sizes)
+    threads = [threading.Thread(target=request, args=(item, )) for item in items]
+    threads[0].start()
+    wait_until(lambda: len(batch_sizes) > num_batches)
+    for t in threads[1:]:
+        t.start()
+    wait_until(lambda: batcher.queue.qsize() == len(items) - 1)
+    release.set()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_micro_batcher():
+    batch_sizes = []
+    release = threading.Event()
+
+    def predict_batch(items):
+        batch_sizes.append(len(items))
+        release.wait()
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(predict_batch, max_batch_size=4, max_latency=0.05)
+    release.set()
+    assert batcher.predict([1, 2, 3]) == [2, 4, 6]
+    num_batches = batcher.num_batches
+
+    release.clear()
+    results = concurrent_requests(batcher, range(10), release, batch_sizes)
+
+    assert results == {i: [i * 2] for i in range(10)}
+    assert batch_sizes[num_batches:] == [1, 4, 4, 1]
+    assert batcher.num_items == 13
+    assert batcher.num_batches == num_batches + 4
+
+
+def test_micro_batcher_raises():
+    def predict_batch(items):
+        raise ValueError('bad input')
+
+    batcher = MicroBatcher(predict_batch)
+    with pytest.raises(ValueError):
+        batcher.predict(['a'])
+
+
+def test_micro_batcher_bad_item():
+    batch_sizes = []
+    release = threading.Event()
+
+    def predict_batch(items):
+        batch_sizes.append(len(items))
+        release.wait()
+        return [len(item) for item in items]
+
+    batcher = MicroBatcher(predict_batch, max_batch_size=4, max_latency=0.05)
+    results = concurrent_requests(batcher, ['a', 'bc', None], release, batch_sizes)
+
+    # the batch of 'bc' and None fails and is run again item by item
+    assert batch_sizes == [1, 2, 1, 1]
+    assert results['a'] == [1]
+    assert results['bc'] == [2]
+    assert isinstance(results[None], TypeError)
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from tfidf_helpers import ChunkedTfidfVectorizer
+
+
+@pytest.fixture
+def texts():
+    rng = np.random.RandomState(12345)
+    words = ['w{}'.format(i) for i in range(50)] + ['naïve', 'bayes', 'x_1', 'SVM', 'a']
+    return [' '.join(rng.choice(words, rng.randint(0, 30))) for _ in range(100)]
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_chunked_tfidf_vectorizer(texts, n_jobs):
+    expected_vectorizer = TfidfVectorizer()
+    expected = expected_vectorizer.fit_transform(texts[:80])
+
+    vectorizer = ChunkedTfidfVectorizer(n_jobs=n_jobs, chunk_size=16)
+    X = vectorizer.fit_transform(texts[:80])
+    assert vectorizer.vocabulary_ == expected_vectorizer.vocabulary_
+    np.testing.assert_allclose(vectorizer.idf_, expected_vectorizer.idf_)
+    np.testing.assert_allclose(X.toarray(), expected.toarray())
+
+    # unseen words are ignored
+    X = vectorizer.transform(texts[80:] + ['unseen words only'])
+    np.testing.assert_allclose(X.toarray(), expected_vectorizer.transform(texts[80:] + ['unseen words only']).toarray())
+
+    parts = list(vectorizer.transform_chunks(texts[80:]))
+    assert [part.shape[0] for part in parts] == [16, 4]
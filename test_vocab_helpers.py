@@ -0,0 +1,82 @@
+import os
+import pickle as pkl
+import numpy as np
+
+from vocab_helpers import Vocabulary, tokenize, load_token_ids
+
+
+def test_tokenize():
+    assert tokenize("how to use t-sne's output? 3 times") == ['how', 'to', 'use', "t-sne's", 'output', '3', 'times']
+
+
+def test_vocabulary():
+    texts = ['a b c a', 'b a d', 'a']
+    vocab = Vocabulary(3).fit(texts)
+    assert vocab.words_ == ['<PAD>', '<OOV>', 'a', 'b', 'c', 'd']
+    assert len(vocab) == 6
+
+    X, lengths = vocab.transform(texts + ['e b', ''], return_lengths=True)
+    assert X.dtype == np.int32
+    np.testing.assert_array_equal(X, [[2, 3, 4], [3, 2, 5], [2, 0, 0], [1, 3, 0], [0, 0, 0]])
+    np.testing.assert_array_equal(lengths, [3, 3, 1, 2, 0])
+
+    # chunks give the same matrix
+    np.testing.assert_array_equal(vocab.transform(texts, chunk_size=2), X[:3])
+
+
+def test_vocabulary_cutoffs():
+    texts = ['a b c a', 'b a d', 'a']
+    assert Vocabulary(3, min_frequency=2).fit(texts).words_ == ['<PAD>', '<OOV>', 'a', 'b']
+    assert Vocabulary(3, max_size=1).fit(texts).words_ == ['<PAD>', '<OOV>', 'a']
+    np.testing.assert_array_equal(Vocabulary(3, max_size=1).fit_transform(texts),
+                                  [[2, 1, 1], [1, 2, 1], [2, 0, 0]])
+
+
+def test_vocabulary_parallel():
+    texts = ['w{} w{} w{}'.format(i % 7, i % 5, i % 3) for i in range(100)]
+    vocab = Vocabulary(4).fit(texts)
+    parallel_vocab = Vocabulary(4).fit(texts, n_jobs=2, chunk_size=10)
+    assert parallel_vocab.words_ == vocab.words_
+    np.testing.assert_array_equal(vocab.transform(texts, n_jobs=2, chunk_size=10),
+                                  vocab.transform(texts))
+
+
+def test_vocabulary_save_restore(tmpdir):
+    vocab = Vocabulary(5, min_frequency=1, max_size=10).fit(['a b', 'c'])
+    path = str(tmpdir.join('vocab.json'))
+    vocab.save(path)
+    restored = Vocabulary.restore(path)
+    assert restored.words_ == vocab.words_
+    assert restored.max_document_length == 5
+    assert restored.max_size == 10
+    np.testing.assert_array_equal(restored.transform(['b x c']), vocab.transform(['b x c']))
+
+
+def test_load_token_ids(tmpdir):
+    data_dir = str(tmpdir)
+    with open(os.path.join(data_dir, 'text_split.pkl'), 'wb') as f:
+        pkl.dump((['a b c a', 'b a d'], ['a e'], ['d d d d']), f)
+
+    vocab, X, lengths = load_token_ids(data_dir, 3)
+    assert vocab.words_ == ['<PAD>', '<OOV>', 'a', 'b', 'c', 'd']
+    np.testing.assert_array_equal(X['train'], [[2, 3, 4], [3, 2, 5]])
+    np.testing.assert_array_equal(X['dev'], [[2, 1, 0]])
+    np.testing.assert_array_equal(lengths['test'], [3])
+    cache_dirs = os.listdir(os.path.join(data_dir, 'token_cache'))
+    assert len(cache_dirs) == 1
+
+    # cached
+    cached_vocab, cached_X, cached_lengths = load_token_ids(data_dir, 3)
+    assert cached_vocab.words_ == vocab.words_
+    assert isinstance(cached_X['train'], np.memmap)
+    for split in X:
+        np.testing.assert_array_equal(cached_X[split], X[split])
+        np.testing.assert_array_equal(cached_lengths[split], lengths[split])
+
+    # other vocabulary parameters or texts get their own cache
+    load_token_ids(data_dir, 2)
+    with open(os.path.join(data_dir, 'text_split.pkl'), 'wb') as f:
+        pkl.dump((['a b'], ['a'], ['b']), f)
+    vocab, X, _ = load_token_ids(data_dir, 3)
+    np.testing.assert_array_equal(X['train'], [[2, 3, 0]])
+    assert len(os.listdir(os.path.join(data_dir, 'token_cache'))) == 3
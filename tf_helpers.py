@@ -1,4 +1,7 @@
 import os
+import datetime
+import threading
+import collections
 import tensorflow as tf
 from tensorflow.contrib.tensorboard.plugins import projector
 
@@ -58,19 +61,124 @@ def save_embedding_for_viz(embeddings, session, metadata_path, checkpoint_dir):
 
 def get_variable_value_from_checkpoint(checkpoint_file, variable_names=[]):
     """load from checkpoint_file and read the values of the variables of `variable_name`
-    
+
+    the values are read from the checkpoint directly, the training graph is not restored
+
     return
 
     list of variable values
     """
-    sess = tf.Session()
-    with sess.as_default():
-        saver = tf.train.import_meta_graph("{}.meta".format(checkpoint_file))
-        saver.restore(sess, checkpoint_file)
+    reader = tf.train.NewCheckpointReader(checkpoint_file)
+    return [reader.get_tensor(variable_name) for variable_name in variable_names]
+
 
-        vals = []
-        for variable_name in variable_names:
-            embedding_table = sess.graph.get_operation_by_name(variable_name)
-            vals.append(embedding_table.outputs[0].eval())
+def replace_placeholder_with_constant(graph_def, name, value, dtype=tf.float32):
+    """replace the placeholder node `name` of `graph_def` (in place) by a constant"""
+    for node in graph_def.node:
+        if node.name == name:
+            node.op = 'Const'
+            node.ClearField('attr')
+            node.attr['dtype'].CopyFrom(tf.AttrValue(type=dtype.as_datatype_enum))
+            node.attr['value'].CopyFrom(tf.AttrValue(tensor=tf.make_tensor_proto(value, dtype)))
+            return graph_def
+    raise KeyError('no node named {}'.format(name))
 
-    return vals
+
+def freeze_graph(sess, output_names):
+    """
+    the GraphDef computing `output_names` (node names) with the variables replaced by their values in `sess`,
+    the nodes that the outputs do not depend on (optimizer, summaries, losses...) are removed
+    """
+    graph_def = sess.graph.as_graph_def()
+    # the device placements of the training machine do not matter
+    for node in graph_def.node:
+        node.device = ''
+    return tf.graph_util.convert_variables_to_constants(sess, graph_def, output_names)
+
+
+def load_frozen_graph(path):
+    """a new tf.Graph with the GraphDef in `path` (e.g. written by export_model.py) imported without prefix"""
+    graph_def = tf.GraphDef()
+    with open(path, 'rb') as f:
+        graph_def.ParseFromString(f.read())
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.import_graph_def(graph_def, name='')
+    return graph
+
+
+class ChunkedEvaluator():
+    """
+    evaluates scalar `metrics` (means over a batch, e.g. the loss and p@k) on a data set in batches,
+    the batch values are combined by averages weighted by the batch sizes
+
+    with background=True, each evaluation runs in a thread on a snapshot of `variables`
+    loaded into a second session, so training goes on meanwhile.
+    the evaluator then adds assign ops, so it must be created before the graph is finalized
+
+    Args:
+    sess: the training session
+    metrics: list of (name, scalar Tensor)
+    feed_dicts: function returning an iterable of (feed_dict, batch size)
+    writer: tf.summary.FileWriter, the results are written as summaries tagged by the metric names
+    variables: the variables copied into the background session (default: the trainable ones)
+    """
+    def __init__(self, sess, metrics, feed_dicts, writer=None, background=False, variables=None,
+                 session_config=None):
+        self.sess = sess
+        self.metrics = metrics
+        self.feed_dicts = feed_dicts
+        self.writer = writer
+        self.background = background
+        self.thread = None
+
+        if self.background:
+            self.variables = variables or tf.trainable_variables()
+            with sess.graph.as_default(), tf.name_scope('evaluator'):
+                self.placeholders = [tf.placeholder(v.dtype.base_dtype, v.get_shape())
+                                     for v in self.variables]
+                self.assign_op = tf.group(*[tf.assign(v, p)
+                                            for v, p in zip(self.variables, self.placeholders)])
+            self.eval_sess = tf.Session(graph=sess.graph, config=session_config)
+
+    def _evaluate(self, sess, step):
+        totals = [0.0] * len(self.metrics)
+        size = 0
+        for feed_dict, batch_size in self.feed_dicts():
+            values = sess.run([tensor for _, tensor in self.metrics], feed_dict)
+            totals = [total + value * batch_size for total, value in zip(totals, values)]
+            size += batch_size
+        results = collections.OrderedDict(
+            (name, total / size) for (name, _), total in zip(self.metrics, totals))
+
+        time_str = datetime.datetime.now().isoformat()
+        print("[DEV] {}: step {}, {}".format(
+            time_str, step, ", ".join("{} {:g}".format(name, value) for name, value in results.items())))
+        if self.writer:
+            summary = tf.Summary(value=[tf.Summary.Value(tag=name, simple_value=value)
+                                        for name, value in results.items()])
+            self.writer.add_summary(summary, step)
+        return results
+
+    def evaluate(self, step):
+        """
+        evaluate the current weights, the results are printed and written as summaries of `step`
+
+        returns the OrderedDict of metric name to value,
+        None in the background, where the previous evaluation is waited for first
+        """
+        if not self.background:
+            return self._evaluate(self.sess, step)
+
+        self.join()
+        values = self.sess.run(self.variables)
+        self.eval_sess.run(self.assign_op, dict(zip(self.placeholders, values)))
+        self.thread = threading.Thread(target=self._evaluate, args=(self.eval_sess, step))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def join(self):
+        """wait for the background evaluation"""
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
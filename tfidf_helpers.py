@@ -0,0 +1,83 @@
+"""
+tf-idf features of large corpora in chunks over several processes,
+equal to sklearn's TfidfVectorizer with its default parameters
+"""
+import collections
+import numpy as np
+
+from scipy.sparse import vstack
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.preprocessing import normalize
+
+from data_helpers import chunked, parallel_imap
+
+
+def _document_frequencies(texts):
+    analyze = CountVectorizer().build_analyzer()
+    counts = collections.Counter()
+    for text in texts:
+        counts.update(set(analyze(text)))
+    return counts, len(texts)
+
+
+# the count vectorizer and idf of the worker processes, set once by `_init_worker`
+_worker_state = None
+
+
+def _init_worker(vocabulary, idf):
+    global _worker_state
+    _worker_state = (CountVectorizer(vocabulary=vocabulary), idf)
+
+
+def _tfidf(texts):
+    count_vectorizer, idf = _worker_state
+    X = count_vectorizer.transform(texts).astype(np.float64)
+    X.data *= idf[X.indices]
+    return normalize(X, norm='l2', copy=False)
+
+
+class ChunkedTfidfVectorizer():
+    """
+    `fit` counts the document frequencies of the chunks of `chunk_size` documents in parallel,
+    the vocabulary is sorted like TfidfVectorizer's and the idf is smoothed the same way,
+    `transform_chunks` then computes the normalized tf-idf of the chunks in parallel,
+    at most 2 chunks per process are pending at a time (see `data_helpers.parallel_imap`)
+
+    Args:
+    n_jobs: int, number of processes, <= 0 means all cores
+    chunk_size: int, number of documents sent to a worker at a time
+    """
+    def __init__(self, n_jobs=1, chunk_size=10000):
+        self.n_jobs = n_jobs
+        self.chunk_size = chunk_size
+        self.vocabulary_ = None
+        self.idf_ = None
+
+    def fit(self, texts):
+        df = collections.Counter()
+        n_docs = 0
+        for chunk_df, chunk_size in parallel_imap(_document_frequencies,
+                                                  chunked(texts, self.chunk_size), self.n_jobs):
+            df.update(chunk_df)
+            n_docs += chunk_size
+
+        terms = sorted(df)
+        self.vocabulary_ = {term: i for i, term in enumerate(terms)}
+        df = np.array([df[term] for term in terms], dtype=np.float64)
+        self.idf_ = np.log((1 + n_docs) / (1 + df)) + 1
+        return self
+
+    def transform_chunks(self, texts):
+        """generator of the csr tf-idf matrices of the consecutive chunks of `texts`"""
+        return parallel_imap(_tfidf, chunked(texts, self.chunk_size), self.n_jobs,
+                             _init_worker, (self.vocabulary_, self.idf_))
+
+    def transform(self, texts):
+        parts = list(self.transform_chunks(texts))
+        if not parts:
+            return CountVectorizer(vocabulary=self.vocabulary_).transform([]).astype(np.float64)
+        return vstack(parts, format='csr')
+
+    def fit_transform(self, texts):
+        texts = list(texts)
+        return self.fit(texts).transform(texts)
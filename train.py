@@ -5,11 +5,11 @@ import time
 import pickle as pkl
 import tensorflow as tf
 
-from tensorflow.contrib import learn
 from sklearn.preprocessing import MultiLabelBinarizer
 
-from data_helpers import batch_iter
+from data_helpers import dict_batch_iter, Prefetcher
 from text_cnn import TextCNN
+from vocab_helpers import Vocabulary
 
 
 tf.flags.DEFINE_float("dev_sample_percentage", .1, "Percentage of the training data to use for validation")
@@ -27,6 +27,8 @@ tf.flags.DEFINE_integer("num_epochs", 200, "Number of training epochs (default:
 tf.flags.DEFINE_integer("evaluate_every", 100, "Evaluate model on dev set after this many steps (default: 100)")
 tf.flags.DEFINE_integer("checkpoint_every", 100, "Save model after this many steps (default: 100)")
 tf.flags.DEFINE_integer("num_checkpoints", 5, "Number of checkpoints to store (default: 5)")
+tf.flags.DEFINE_integer("prefetch_batches", 0,
+                        "Number of batches prepared ahead in a background thread, 0 disables it (default: 0)")
 
 # Misc Parameters
 tf.flags.DEFINE_boolean("allow_soft_placement", True, "Allow device soft device placement")
@@ -56,8 +58,8 @@ max_doc_len = 1000
 tpls = [(t, l) for t, l in zip(input_text, labels) if len(t.split()) <= max_doc_len]
 input_text, labels = list(zip(*tpls))
 
-text_processor = learn.preprocessing.VocabularyProcessor(max_doc_len)
-x = np.array(list(text_processor.fit_transform(input_text)))
+text_processor = Vocabulary(max_doc_len)
+x = text_processor.fit_transform(input_text)
 
 
 mb = MultiLabelBinarizer()
@@ -77,7 +79,7 @@ dev_x, dev_y = shuffled_x[:idx, :], shuffled_y[:idx, :]
 
 with tf.Session() as sess:
     
-    cnn = TextCNN(max_doc_len, len(mb.classes_), FLAGS.embedding_dim, len(text_processor.vocabulary_),
+    cnn = TextCNN(max_doc_len, len(mb.classes_), FLAGS.embedding_dim, len(text_processor),
                   list(map(int, FLAGS.filter_sizes.split(','))),
                   FLAGS.num_filters)
     # train operation
@@ -127,17 +129,20 @@ with tf.Session() as sess:
     sess.run(tf.local_variables_initializer())
 
     # dump vectorizer
-    text_processor.save(os.path.join(out_dir, 'text_processor'))
+    text_processor.save(os.path.join(out_dir, 'vocab.json'))
     pkl.dump(mb, open(os.path.join(out_dir, 'label_encoder.pkl'), 'wb'))
     
-    data = list(zip(train_x, train_y))
-    batches = batch_iter(data, FLAGS.batch_size, FLAGS.num_epochs)
-    for batch in batches:
-        batch_x, batch_y = zip(*batch)
-        feed_dict = {cnn.input_x: batch_x,
-                     cnn.input_y: batch_y,
-                     cnn.dropout_keep_prob: FLAGS.dropout_keep_prob}
-        
+    batches = dict_batch_iter({'x': train_x, 'y': train_y}, FLAGS.batch_size, FLAGS.num_epochs)
+
+    def feed_dicts():
+        for batch in batches:
+            yield {cnn.input_x: batch['x'],
+                   cnn.input_y: batch['y'],
+                   cnn.dropout_keep_prob: FLAGS.dropout_keep_prob}
+
+    # feed dicts are optionally prepared ahead in a background thread
+    train_feed_dicts = Prefetcher(feed_dicts(), FLAGS.prefetch_batches)
+    for feed_dict in train_feed_dicts:
         current_step = tf.train.global_step(sess, global_step)
         _, current_step, summaries, loss, prec, rec = sess.run(
             [train_op, global_step, train_summary_op, cnn.loss, cnn.precision, cnn.recall],
@@ -146,6 +151,8 @@ with tf.Session() as sess:
         train_summary_writer.add_summary(summaries, current_step)
 
         if current_step % FLAGS.evaluate_every == 0:
+            print("input wait: {:.3f}s over the last {} steps".format(
+                train_feed_dicts.pop_wait_time(), FLAGS.evaluate_every))
             loss, summaries, prec, rec = sess.run(
                 [cnn.loss, dev_summary_op, cnn.precision, cnn.recall],
                 feed_dict={cnn.input_x: dev_x, cnn.input_y: dev_y, cnn.dropout_keep_prob: 1})
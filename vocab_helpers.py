@@ -0,0 +1,232 @@
+"""
+vocabulary mapping normalized documents to padded matrices of word ids,
+replaces tf.contrib.learn's VocabularyProcessor
+"""
+import os
+import re
+import json
+import shutil
+import hashlib
+import tempfile
+import collections
+import numpy as np
+import pandas as pd
+
+from data_helpers import chunked, parallel_imap
+from dataset_helpers import SPLITS, load_splits, field_digest
+
+
+# the tokenizer of VocabularyProcessor
+TOKENIZER_RE = re.compile(r"[A-Z]{2,}(?![a-z])|[A-Z][a-z]+(?=[A-Z])|[\'\w\-]+", re.UNICODE)
+
+
+def tokenize(text):
+    return TOKENIZER_RE.findall(text)
+
+
+def _count_chunk(texts):
+    counts = collections.Counter()
+    for text in texts:
+        counts.update(TOKENIZER_RE.findall(text))
+    return counts
+
+
+# the word index of the worker processes, set once by `_init_worker`
+_worker_index = None
+
+
+def _init_worker(words):
+    global _worker_index
+    _worker_index = pd.Index(words, dtype=object)
+
+
+def _ids_chunk(texts, max_document_length, index=None):
+    """
+    the word ids of the first `max_document_length` tokens of each text, concatenated,
+    and the number of ids of each text
+    """
+    if index is None:
+        index = _worker_index
+    tokens = []
+    lengths = np.zeros(len(texts), dtype=np.int32)
+    for i, text in enumerate(texts):
+        doc_tokens = TOKENIZER_RE.findall(text)[:max_document_length]
+        tokens.extend(doc_tokens)
+        lengths[i] = len(doc_tokens)
+    ids = index.get_indexer(tokens).astype(np.int32)
+    ids[ids < 0] = Vocabulary.OOV
+    return ids, lengths
+
+
+def _ids_chunk_worker(args):
+    return _ids_chunk(*args)
+
+
+class Vocabulary():
+    """
+    word id 0 is the padding, 1 the out of vocabulary words,
+    the others are assigned by decreasing frequency (ties by word)
+
+    Args:
+    max_document_length: documents are truncated or padded to this many words
+    min_frequency: words occurring less often in the fitted documents are out of vocabulary
+    max_size: maximum number of words kept, None keeps all of them
+    """
+    PAD = 0
+    OOV = 1
+    RESERVED = ['<PAD>', '<OOV>']
+
+    def __init__(self, max_document_length, min_frequency=0, max_size=None):
+        self.max_document_length = int(max_document_length)
+        self.min_frequency = min_frequency
+        self.max_size = max_size
+        self.words_ = None
+        self._index = None
+
+    def __len__(self):
+        return len(self.words_)
+
+    def _set_words(self, words):
+        self.words_ = list(words)
+        self._index = pd.Index(self.words_, dtype=object)
+
+    def fit(self, texts, n_jobs=1, chunk_size=10000):
+        """
+        Args:
+        texts: iterable of normalized str
+        n_jobs: int, number of processes, <= 0 means all cores
+        chunk_size: int, number of texts tokenized at a time (by a worker)
+        """
+        counts = collections.Counter()
+        for chunk_counts in parallel_imap(_count_chunk, chunked(texts, chunk_size), n_jobs):
+            counts.update(chunk_counts)
+
+        words = sorted((word for word, count in counts.items() if count >= self.min_frequency),
+                       key=lambda word: (-counts[word], word))
+        if self.max_size is not None:
+            words = words[:self.max_size]
+        self._set_words(self.RESERVED + words)
+        return self
+
+    def transform(self, texts, n_jobs=1, chunk_size=10000, return_lengths=False):
+        """
+        Args:
+        texts: list of normalized str
+        n_jobs: int, number of processes, <= 0 means all cores
+        chunk_size: int, number of texts tokenized at a time (by a worker)
+        return_lengths: return the number of words of each document as well
+
+        Returns:
+        int32 matrix of word ids (n documents x max_document_length), padded by 0
+        (and the int32 array of document lengths)
+        """
+        texts = list(texts)
+        X = np.zeros((len(texts), self.max_document_length), dtype=np.int32)
+        lengths = np.zeros(len(texts), dtype=np.int32)
+
+        if n_jobs == 1:
+            results = (_ids_chunk(chunk, self.max_document_length, self._index)
+                       for chunk in chunked(texts, chunk_size))
+        else:
+            results = parallel_imap(_ids_chunk_worker,
+                                    ((chunk, self.max_document_length) for chunk in chunked(texts, chunk_size)),
+                                    n_jobs, _init_worker, (self.words_, ))
+
+        start = 0
+        for ids, chunk_lengths in results:
+            end = start + len(chunk_lengths)
+            # scatter the concatenated ids to the rows of the chunk
+            offsets = np.cumsum(chunk_lengths) - chunk_lengths
+            rows = np.repeat(np.arange(start, end), chunk_lengths)
+            cols = np.arange(len(ids)) - np.repeat(offsets, chunk_lengths)
+            X[rows, cols] = ids
+            lengths[start:end] = chunk_lengths
+            start = end
+
+        if return_lengths:
+            return X, lengths
+        return X
+
+    def fit_transform(self, texts, n_jobs=1, chunk_size=10000, return_lengths=False):
+        texts = list(texts)
+        return self.fit(texts, n_jobs, chunk_size).transform(
+            texts, n_jobs, chunk_size, return_lengths)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'max_document_length': self.max_document_length,
+                       'min_frequency': self.min_frequency,
+                       'max_size': self.max_size,
+                       'words': self.words_}, f)
+
+    @classmethod
+    def restore(cls, path):
+        with open(path) as f:
+            state = json.load(f)
+        vocab = cls(state['max_document_length'], state['min_frequency'], state['max_size'])
+        vocab._set_words(state['words'])
+        return vocab
+
+
+# bump it when the tokenization or the cache layout changes
+TOKEN_CACHE_VERSION = 1
+
+
+def token_cache_key(data_dir, max_document_length, min_frequency=0, max_size=None):
+    """the cache key of the token ids of the texts of `data_dir` under the vocabulary parameters"""
+    params = json.dumps({'version': TOKEN_CACHE_VERSION,
+                         'text': field_digest(data_dir, 'text'),
+                         'max_document_length': int(max_document_length),
+                         'min_frequency': min_frequency,
+                         'max_size': max_size}, sort_keys=True)
+    return hashlib.sha1(params.encode('utf-8')).hexdigest()
+
+
+def load_token_ids(data_dir, max_document_length, min_frequency=0, max_size=None,
+                   n_jobs=1, use_cache=True):
+    """
+    the vocabulary fitted on the training texts of `data_dir` (train, dev, test)
+    and the word id matrices and document lengths of the splits
+
+    with use_cache, they are stored as .npy files under data_dir/token_cache/<key>/,
+    the key hashes the texts (see `dataset_helpers.field_digest`) and the vocabulary parameters,
+    so the texts are neither loaded nor tokenized again for the same data and parameters.
+    the cached arrays are memory-mapped
+
+    Returns:
+    vocab, {split: word id matrix}, {split: lengths}
+    """
+    if use_cache:
+        key = token_cache_key(data_dir, max_document_length, min_frequency, max_size)
+        cache_dir = os.path.join(data_dir, 'token_cache', key)
+        if os.path.exists(cache_dir):
+            print('loading token ids from {}'.format(cache_dir))
+            vocab = Vocabulary.restore(os.path.join(cache_dir, 'vocab.json'))
+            X = {split: np.load(os.path.join(cache_dir, 'x_{}.npy'.format(split)), mmap_mode='r')
+                 for split in SPLITS}
+            lengths = {split: np.load(os.path.join(cache_dir, 'lengths_{}.npy'.format(split)))
+                       for split in SPLITS}
+            return vocab, X, lengths
+
+    texts = dict(zip(SPLITS, load_splits(data_dir, 'text')))
+
+    vocab = Vocabulary(max_document_length, min_frequency, max_size)
+    vocab.fit(texts['train'], n_jobs=n_jobs)
+    X, lengths = {}, {}
+    for split in SPLITS:
+        X[split], lengths[split] = vocab.transform(texts[split], n_jobs=n_jobs, return_lengths=True)
+
+    if use_cache:
+        # written to a temporary directory first, so an interrupted run leaves no partial cache
+        os.makedirs(os.path.dirname(cache_dir), exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=key, dir=os.path.dirname(cache_dir))
+        vocab.save(os.path.join(tmp_dir, 'vocab.json'))
+        for split in SPLITS:
+            np.save(os.path.join(tmp_dir, 'x_{}.npy'.format(split)), X[split])
+            np.save(os.path.join(tmp_dir, 'lengths_{}.npy'.format(split)), lengths[split])
+        try:
+            os.rename(tmp_dir, cache_dir)
+            print('token ids cached in {}'.format(cache_dir))
+        except OSError:  # written by a concurrent run meanwhile
+            shutil.rmtree(tmp_dir)
+    return vocab, X, lengths